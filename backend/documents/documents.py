@@ -0,0 +1,150 @@
+import base64
+import json
+import os
+import boto3
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+# GET /documents?limit=20&cursor=...
+#
+# Lists the caller's documents newest first from the user-documents-index GSI on
+# pai-embeddings-metadata. The index projects only the catalog attributes below,
+# so each page costs O(limit) small items no matter how many chunks and
+# embeddings the documents hold. The cursor is the opaque LastEvaluatedKey of
+# the previous page.
+#
+# Invoked directly with {"action": "backfill"} it stamps updated_at on documents
+# written before the index existed, so they show up in listings too.
+
+CATALOG_INDEX = 'user-documents-index'
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Stop a backfill invocation with this much time left; re-run it with the returned cursor
+BACKFILL_TIME_MARGIN_MS = 10 * 1000
+
+def json_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body, default=_to_json)
+    }
+
+def _to_json(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_cursor(last_key):
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, default=_to_json, sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+
+def get_table():
+    return boto3.resource('dynamodb').Table(os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata'))
+
+def list_documents(user_id, params):
+    try:
+        limit = min(max(1, int(params.get('limit', DEFAULT_PAGE_SIZE))), MAX_PAGE_SIZE)
+    except ValueError:
+        return json_response(400, {'error': 'limit must be a number'})
+
+    query_kwargs = {
+        'IndexName': CATALOG_INDEX,
+        'KeyConditionExpression': 'user_id = :uid',
+        'ExpressionAttributeValues': {':uid': user_id},
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    if params.get('cursor'):
+        start_key = decode_cursor(params['cursor'])
+        # A cursor only ever continues the caller's own listing
+        if not isinstance(start_key, dict) or start_key.get('user_id') != user_id:
+            return json_response(400, {'error': 'Invalid cursor'})
+        query_kwargs['ExclusiveStartKey'] = start_key
+
+    response = get_table().query(**query_kwargs)
+    documents = [{
+        'doc_id': item['doc_id'],
+        'filename': item.get('filename'),
+        'status': item.get('status', 'processed'),
+        'chunk_count': item.get('chunk_count'),
+        'text_length': item.get('text_length'),
+        'updated_at': item.get('updated_at')
+    } for item in response.get('Items', [])]
+    return json_response(200, {
+        'documents': documents,
+        'next_cursor': encode_cursor(response.get('LastEvaluatedKey'))
+    })
+
+# Helper: Stamp updated_at = 0 on legacy documents so the sparse index includes them
+# Only owned documents are touched (frozen content copies carry no user_id).
+def backfill(event, context):
+    table = get_table()
+    scan_kwargs = {
+        'FilterExpression': 'attribute_exists(user_id) AND attribute_not_exists(updated_at)',
+        'ProjectionExpression': 'doc_id'
+    }
+    if event.get('cursor'):
+        scan_kwargs['ExclusiveStartKey'] = decode_cursor(event['cursor'])
+    stamped = 0
+    while True:
+        page = table.scan(**scan_kwargs)
+        for item in page.get('Items', []):
+            try:
+                table.update_item(
+                    Key={'doc_id': item['doc_id']},
+                    UpdateExpression='SET updated_at = :zero',
+                    ConditionExpression='attribute_not_exists(updated_at)',
+                    ExpressionAttributeValues={':zero': 0}
+                )
+                stamped += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        last_key = page.get('LastEvaluatedKey')
+        if not last_key:
+            print(f"[DOCUMENTS] Backfill finished, stamped {stamped} documents")
+            return {'stamped': stamped, 'finished': True}
+        scan_kwargs['ExclusiveStartKey'] = last_key
+        if context.get_remaining_time_in_millis() < BACKFILL_TIME_MARGIN_MS:
+            print(f"[DOCUMENTS] Backfill paused after stamping {stamped} documents")
+            return {'stamped': stamped, 'finished': False, 'cursor': encode_cursor(last_key)}
+
+def lambda_handler(event, context):
+    if event.get('action') == 'backfill':
+        return backfill(event, context)
+
+    # Handle CORS preflight request
+    http_method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method')
+    if http_method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+            },
+            'body': ''
+        }
+
+    try:
+        user_id = event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {}).get('sub', 'anonymous')
+        return list_documents(user_id, event.get('queryStringParameters') or {})
+    except ClientError as e:
+        print(f"[DOCUMENTS] DynamoDB ClientError: {e}")
+        return json_response(502, {'error': 'Could not load documents. Please try again.'})
+    except Exception as e:
+        import traceback
+        print("Documents Exception:", repr(e))
+        print(traceback.format_exc())
+        return json_response(500, {'error': 'Internal server error'})
@@ -0,0 +1,235 @@
+import json
+import math
+import os
+import time
+import uuid
+import boto3
+from botocore.exceptions import ClientError
+from upload_limits import ALLOWED_CONTENT_TYPE, get_user_tier, max_upload_bytes, parse_file_size
+
+# S3 requires parts of at least 5 MiB (except the last) and at most 10,000 parts
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+# Part URLs are signed in small batches as the upload progresses, so each
+# one only has to outlive the time it takes to send a single part
+PART_URL_EXPIRY = 3600
+MAX_PARTS_PER_SIGN_REQUEST = 100
+# Matches the bucket's AbortIncompleteMultipartUpload rule: after that, the upload can no longer arrive
+AWAITING_UPLOAD_TTL_SECONDS = 7 * 24 * 3600
+
+s3_client = boto3.client('s3')
+
+def json_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body)
+    }
+
+def choose_part_size(file_size):
+    part_size = max(MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+    # Round up to a whole MiB so part boundaries are easy to recompute client-side
+    mib = 1024 * 1024
+    return math.ceil(part_size / mib) * mib
+
+# Helper: Seed the status item so /status can answer while parts are uploading
+# update_item keeps an existing item's version climbing (see presigned_url.py).
+# A new document's seed expires with the incomplete upload itself.
+def seed_status(doc_id, user_id, filename, ingest_mode):
+    status_table_name = os.environ.get('STATUS_TABLE')
+    if not status_table_name:
+        return
+    now = int(time.time())
+    expression = 'SET user_id = :user_id, filename = :filename, #s = :status, updated_at = :now'
+    values = {':user_id': user_id, ':filename': filename, ':status': 'awaiting_upload', ':now': now, ':one': 1}
+    if ingest_mode == 'create':
+        expression += ', expires_at = :expires_at'
+        values[':expires_at'] = now + AWAITING_UPLOAD_TTL_SECONDS
+    try:
+        boto3.resource('dynamodb').Table(status_table_name).update_item(
+            Key={'doc_id': doc_id},
+            UpdateExpression=expression + ' ADD #version :one',
+            ExpressionAttributeNames={'#s': 'status', '#version': 'version'},
+            ExpressionAttributeValues=values
+        )
+    except ClientError as e:
+        print(f"[MULTIPART-UPLOAD] Could not seed status for {doc_id}: {e}")
+
+def list_uploaded_parts(bucket_name, s3_key, upload_id):
+    parts = []
+    kwargs = {'Bucket': bucket_name, 'Key': s3_key, 'UploadId': upload_id}
+    while True:
+        response = s3_client.list_parts(**kwargs)
+        parts.extend(
+            {'PartNumber': p['PartNumber'], 'ETag': p['ETag'], 'Size': p['Size']}
+            for p in response.get('Parts', [])
+        )
+        if not response.get('IsTruncated'):
+            return parts
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+# Helper: Check that an existing document may be revised by this user
+def can_update_document(doc_id, user_id):
+    table = os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata')
+    item = boto3.resource('dynamodb').Table(table).get_item(
+        Key={'doc_id': doc_id}, ProjectionExpression='user_id'
+    ).get('Item')
+    return item is not None and item.get('user_id') == user_id
+
+def too_large_response(tier, max_bytes):
+    return json_response(413, {
+        'error': f'File exceeds the {max_bytes // (1024 * 1024)} MB limit of the {tier} plan',
+        'max_bytes': max_bytes,
+        'tier': tier
+    })
+
+def create_upload(body, user_id, bucket_name, tier):
+    filename = body.get('filename', 'document.pdf')
+    content_type = body.get('content_type', ALLOWED_CONTENT_TYPE)
+    file_size = parse_file_size(body.get('file_size'))
+    if not file_size:
+        return json_response(400, {'error': 'file_size must be a positive number of bytes'})
+    if content_type != ALLOWED_CONTENT_TYPE:
+        return json_response(415, {'error': 'Only PDF files can be uploaded'})
+    if file_size > max_upload_bytes(tier):
+        return too_large_response(tier, max_upload_bytes(tier))
+
+    # Passing an existing doc_id uploads a revised version that is re-indexed incrementally
+    update_doc_id = body.get('doc_id')
+    if update_doc_id and not can_update_document(update_doc_id, user_id):
+        return json_response(404, {'error': 'Document not found'})
+    ingest_mode = 'update' if update_doc_id else 'create'
+
+    doc_id = update_doc_id or str(uuid.uuid4())
+    s3_key = f"uploads/{user_id}/{doc_id}_{filename}"
+    part_size = choose_part_size(file_size)
+
+    # Object metadata is fixed at creation time and survives CompleteMultipartUpload,
+    # so process_upload sees the same doc_id/user_id/filename as with a single PUT
+    response = s3_client.create_multipart_upload(
+        Bucket=bucket_name,
+        Key=s3_key,
+        ContentType=content_type,
+        Metadata={
+            'doc_id': doc_id,
+            'user_id': user_id,
+            'filename': filename,
+            'ingest_mode': ingest_mode
+        }
+    )
+    seed_status(doc_id, user_id, filename, ingest_mode)
+
+    print(f"[MULTIPART-UPLOAD] Created upload for doc_id: {doc_id}, key: {s3_key}, part_size: {part_size}")
+    return json_response(200, {
+        'upload_id': response['UploadId'],
+        'doc_id': doc_id,
+        's3_key': s3_key,
+        'ingest_mode': ingest_mode,
+        'part_size': part_size,
+        'part_count': math.ceil(file_size / part_size)
+    })
+
+def sign_parts(body, bucket_name, s3_key, upload_id):
+    part_numbers = body.get('part_numbers')
+    if not isinstance(part_numbers, list) or not 1 <= len(part_numbers) <= MAX_PARTS_PER_SIGN_REQUEST:
+        return json_response(400, {'error': f'part_numbers must list 1-{MAX_PARTS_PER_SIGN_REQUEST} parts'})
+    if any(not isinstance(n, int) or isinstance(n, bool) or n < 1 or n > MAX_PARTS for n in part_numbers):
+        return json_response(400, {'error': f'part numbers must be between 1 and {MAX_PARTS}'})
+
+    urls = {
+        str(n): s3_client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': bucket_name, 'Key': s3_key, 'UploadId': upload_id, 'PartNumber': n},
+            ExpiresIn=PART_URL_EXPIRY
+        )
+        for n in part_numbers
+    }
+    return json_response(200, {'urls': urls, 'expires_in': PART_URL_EXPIRY})
+
+def complete_upload(bucket_name, s3_key, upload_id, tier):
+    # List parts server-side: browsers can only read part ETags if the bucket
+    # exposes them via CORS, and S3 already knows which parts arrived intact
+    parts = list_uploaded_parts(bucket_name, s3_key, upload_id)
+    if not parts:
+        return json_response(400, {'error': 'No parts have been uploaded'})
+    # Part URLs cannot carry a size condition, so the declared file_size is only
+    # trusted up to here: an oversized upload is discarded instead of completed
+    uploaded_bytes = sum(p['Size'] for p in parts)
+    if uploaded_bytes > max_upload_bytes(tier):
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+        print(f"[MULTIPART-UPLOAD] Aborted {s3_key}: {uploaded_bytes} bytes exceeds the {tier} limit")
+        return too_large_response(tier, max_upload_bytes(tier))
+    s3_client.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts]}
+    )
+    print(f"[MULTIPART-UPLOAD] Completed {s3_key} with {len(parts)} parts")
+    return json_response(200, {'s3_key': s3_key, 'part_count': len(parts)})
+
+def lambda_handler(event, context):
+    # Handle CORS preflight request
+    http_method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method')
+    if http_method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                'Access-Control-Allow-Methods': 'POST,OPTIONS'
+            },
+            'body': ''
+        }
+
+    try:
+        action = (event.get('pathParameters') or {}).get('action')
+        body = json.loads(event.get('body') or '{}')
+        user_id = event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {}).get('sub', 'anonymous')
+        bucket_name = os.environ.get('S3_BUCKET', 'pai-pdf-storage')
+        tier = get_user_tier(event)
+
+        if action == 'create':
+            return create_upload(body, user_id, bucket_name, tier)
+
+        upload_id = body.get('upload_id')
+        s3_key = body.get('s3_key')
+        if not upload_id or not s3_key:
+            return json_response(400, {'error': 'Missing upload_id or s3_key'})
+        # Users may only touch uploads under their own prefix
+        if not s3_key.startswith(f"uploads/{user_id}/"):
+            return json_response(403, {'error': 'Upload does not belong to this user'})
+
+        if action == 'sign-parts':
+            return sign_parts(body, bucket_name, s3_key, upload_id)
+        if action == 'list-parts':
+            # Lets a client resume after a failure by skipping parts S3 already has
+            return json_response(200, {'parts': list_uploaded_parts(bucket_name, s3_key, upload_id)})
+        if action == 'complete':
+            return complete_upload(bucket_name, s3_key, upload_id, tier)
+        if action == 'abort':
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+            print(f"[MULTIPART-UPLOAD] Aborted {s3_key}")
+            return json_response(200, {'aborted': True})
+
+        return json_response(404, {'error': f'Unknown multipart action: {action}'})
+
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        print(f"[MULTIPART-UPLOAD] S3 ClientError - Code: {error_code}, Message: {str(e)}")
+        if error_code == 'NoSuchUpload':
+            # Completed, aborted or expired: the client must start a new upload
+            return json_response(404, {'error': 'Upload not found', 'error_type': 'NO_SUCH_UPLOAD'})
+        return json_response(502, {'error': 'File storage failed. Please try again.', 'error_type': error_code})
+    except Exception as e:
+        import traceback
+        print("Multipart Upload Exception:", repr(e))
+        print(traceback.format_exc())
+
+        return json_response(500, {
+            'error': 'Multipart upload request failed',
+            'debug_info': str(e)
+        })
@@ -1,12 +1,174 @@
 import json
 import os
+import time
 import uuid
 import boto3
 from botocore.exceptions import ClientError
+from upload_limits import ALLOWED_CONTENT_TYPE, get_user_tier, max_upload_bytes, parse_file_size
+
+UPLOAD_URL_EXPIRY = 300
+# POST /presigned-url/batch issues policies for up to this many files at once.
+# A folder upload signs batches just ahead of use, but a batch's last files may
+# still wait behind its first ones, so batch policies live longer.
+MAX_BATCH_FILES = 50
+BATCH_UPLOAD_URL_EXPIRY = 900
+# A seeded awaiting_upload status whose upload never arrives is dropped after this long
+AWAITING_UPLOAD_TTL_SECONDS = 24 * 3600
+
+# Created once per container; signing is local, so a warm batch makes no S3 calls
+s3_client = boto3.client('s3')
+dynamodb = boto3.resource('dynamodb')
+
+def json_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body)
+    }
+
+# Helper: Check that an existing document may be revised by this user
+def can_update_document(doc_id, user_id):
+    table = os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata')
+    try:
+        item = dynamodb.Table(table).get_item(
+            Key={'doc_id': doc_id}, ProjectionExpression='user_id'
+        ).get('Item')
+    except ClientError as e:
+        raise Exception(f"DynamoDB get_item failed: {e}")
+    return item is not None and item.get('user_id') == user_id
+
+# Helper: Check one requested file against the caller's tier
+# Refuses up front what the POST policy would reject after a full transfer.
+# Returns (status code, error body) or None if the file is acceptable.
+def validate_file(spec, tier, max_bytes):
+    if spec.get('content_type', ALLOWED_CONTENT_TYPE) != ALLOWED_CONTENT_TYPE:
+        return 415, {'error': 'Only PDF files can be uploaded'}
+    # The size is optional here; the POST policy enforces the real one
+    file_size = parse_file_size(spec.get('file_size') or 0)
+    if file_size is None:
+        return 400, {'error': 'file_size must be a non-negative number of bytes'}
+    if file_size > max_bytes:
+        return 413, {
+            'error': f'File exceeds the {max_bytes // (1024 * 1024)} MB limit of the {tier} plan',
+            'max_bytes': max_bytes,
+            'tier': tier
+        }
+    return None
+
+# Helper: Sign a presigned POST policy for one upload
+# Unlike a PUT URL the policy is enforced by S3 itself: oversized bodies, other
+# content types and tampered metadata are refused before anything is stored.
+def sign_upload(bucket_name, user_id, doc_id, filename, ingest_mode, max_bytes, expires_in):
+    s3_key = f"uploads/{user_id}/{doc_id}_{filename}"
+    metadata_fields = {
+        'x-amz-meta-doc_id': doc_id,
+        'x-amz-meta-user_id': user_id,
+        'x-amz-meta-filename': filename,
+        'x-amz-meta-ingest_mode': ingest_mode
+    }
+    presigned_post = s3_client.generate_presigned_post(
+        Bucket=bucket_name,
+        Key=s3_key,
+        Fields={'Content-Type': ALLOWED_CONTENT_TYPE, **metadata_fields},
+        Conditions=[
+            ['content-length-range', 1, max_bytes],
+            {'Content-Type': ALLOWED_CONTENT_TYPE},
+            *({name: value} for name, value in metadata_fields.items())
+        ],
+        ExpiresIn=expires_in
+    )
+    return {
+        'upload_post': presigned_post,
+        'doc_id': doc_id,
+        's3_key': s3_key,
+        'ingest_mode': ingest_mode,
+        'max_bytes': max_bytes,
+        'expires_in': expires_in
+    }
+
+# Helper: Seed status items so /status can answer before processing starts
+# update_item keeps an existing item's version climbing, so clients still holding
+# a since/Last-Event-ID from an earlier upload of the same doc_id see the change.
+# A new document's seed expires (TTL on expires_at) if its upload never arrives;
+# process_upload removes the expiry on its first status write.
+def seed_statuses(user_id, uploads):
+    status_table_name = os.environ.get('STATUS_TABLE')
+    if not status_table_name or not uploads:
+        return
+    status_table = dynamodb.Table(status_table_name)
+    now = int(time.time())
+    for upload in uploads:
+        expression = 'SET user_id = :user_id, filename = :filename, #s = :status, updated_at = :now'
+        values = {':user_id': user_id, ':filename': upload['filename'], ':status': 'awaiting_upload',
+                  ':now': now, ':one': 1}
+        if upload['ingest_mode'] == 'create':
+            expression += ', expires_at = :expires_at'
+            values[':expires_at'] = now + AWAITING_UPLOAD_TTL_SECONDS
+        try:
+            status_table.update_item(
+                Key={'doc_id': upload['doc_id']},
+                UpdateExpression=expression + ' ADD #version :one',
+                ExpressionAttributeNames={'#s': 'status', '#version': 'version'},
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            print(f"[PRESIGNED-URL] Could not seed status for {upload['doc_id']}: {e}")
+
+def issue_single(event, body, user_id, tier, bucket_name):
+    max_bytes = max_upload_bytes(tier)
+    filename = body.get('filename', 'document.pdf')
+    rejected = validate_file(body, tier, max_bytes)
+    if rejected:
+        return json_response(*rejected)
+
+    # Passing an existing doc_id uploads a revised version that is re-indexed incrementally
+    update_doc_id = body.get('doc_id') or (event.get('queryStringParameters') or {}).get('doc_id')
+    if update_doc_id and not can_update_document(update_doc_id, user_id):
+        return json_response(404, {'error': 'Document not found'})
+    ingest_mode = 'update' if update_doc_id else 'create'
+
+    # Generate unique document ID and S3 key
+    doc_id = update_doc_id or str(uuid.uuid4())
+    upload = sign_upload(bucket_name, user_id, doc_id, filename, ingest_mode, max_bytes, UPLOAD_URL_EXPIRY)
+    print(f"[PRESIGNED-URL] Generated for doc_id: {doc_id}, key: {upload['s3_key']}")
+
+    seed_statuses(user_id, [{**upload, 'filename': filename}])
+    return json_response(200, {**upload, 'tier': tier})
+
+# POST /presigned-url/batch {"files": [{"filename", "file_size", "content_type"}, ...]}
+# Folder uploads always create new documents. Files are answered in request
+# order; a file that fails validation gets an error entry instead of a policy,
+# so one oversized file does not block the rest of the folder.
+def issue_batch(body, user_id, tier, bucket_name):
+    files = body.get('files')
+    if not isinstance(files, list) or not 1 <= len(files) <= MAX_BATCH_FILES:
+        return json_response(400, {'error': f'files must list 1-{MAX_BATCH_FILES} files'})
+    max_bytes = max_upload_bytes(tier)
+
+    uploads = []
+    for spec in files:
+        filename = spec.get('filename', 'document.pdf')
+        rejected = validate_file(spec, tier, max_bytes)
+        if rejected:
+            status_code, error = rejected
+            uploads.append({'filename': filename, 'status_code': status_code, **error})
+            continue
+        upload = sign_upload(bucket_name, user_id, str(uuid.uuid4()), filename, 'create',
+                             max_bytes, BATCH_UPLOAD_URL_EXPIRY)
+        uploads.append({'filename': filename, **upload})
+
+    signed = [u for u in uploads if 'upload_post' in u]
+    seed_statuses(user_id, signed)
+    print(f"[PRESIGNED-URL] Generated {len(signed)} of {len(files)} batch uploads for {user_id}")
+    return json_response(200, {'uploads': uploads, 'tier': tier})
 
 def lambda_handler(event, context):
     # Handle CORS preflight request
-    if event.get('httpMethod') == 'OPTIONS':
+    http_method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method')
+    if http_method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
@@ -16,68 +178,25 @@ def lambda_handler(event, context):
             },
             'body': ''
         }
-    
+
     try:
-        body = json.loads(event.get('body', '{}'))
-        filename = body.get('filename', 'document.pdf')
-        content_type = body.get('content_type', 'application/pdf')
-        
+        body = json.loads(event.get('body') or '{}')
+
         # Get user ID from auth context
         user_id = event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {}).get('sub', 'anonymous')
-        
-        # Generate unique document ID and S3 key
-        doc_id = str(uuid.uuid4())
-        s3_key = f"uploads/{user_id}/{doc_id}_{filename}"
-        
-        # Create S3 client
-        s3_client = boto3.client('s3')
+        tier = get_user_tier(event)
         bucket_name = os.environ.get('S3_BUCKET', 'pai-pdf-storage')
-        
-        # Generate presigned URL for PUT operation (5 minutes expiry)
-        presigned_url = s3_client.generate_presigned_url(
-            'put_object',
-            Params={
-                'Bucket': bucket_name,
-                'Key': s3_key,
-                'ContentType': content_type,
-                'Metadata': {
-                    'doc_id': doc_id,
-                    'user_id': user_id,
-                    'filename': filename
-                }
-            },
-            ExpiresIn=300  # 5 minutes
-        )
-        
-        print(f"[PRESIGNED-URL] Generated for doc_id: {doc_id}, key: {s3_key}")
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'upload_url': presigned_url,
-                'doc_id': doc_id,
-                's3_key': s3_key,
-                'expires_in': 300
-            })
-        }
-        
+
+        if event.get('rawPath', '').rstrip('/').endswith('/batch'):
+            return issue_batch(body, user_id, tier, bucket_name)
+        return issue_single(event, body, user_id, tier, bucket_name)
+
     except Exception as e:
         import traceback
         print("Presigned URL Exception:", repr(e))
         print(traceback.format_exc())
-        
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'error': 'Failed to generate upload URL',
-                'debug_info': str(e)
-            })
-        }
+
+        return json_response(500, {
+            'error': 'Failed to generate upload URL',
+            'debug_info': str(e)
+        })
@@ -0,0 +1,45 @@
+# Per-user upload size tiers.
+#
+# Shipped identically with presigned-url and multipart-upload. A user's tier comes
+# from the Cognito token: the custom:tier attribute if set, otherwise the first
+# tier-named group in cognito:groups, otherwise DEFAULT_UPLOAD_TIER.
+import os
+
+MIB = 1024 * 1024
+SIZE_TIERS = {
+    'free': 25 * MIB,
+    'pro': 200 * MIB,
+    'enterprise': 1024 * MIB
+}
+# Only PDFs are ever indexed
+ALLOWED_CONTENT_TYPE = 'application/pdf'
+
+def get_claims(event):
+    return event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {})
+
+def get_user_tier(event):
+    claims = get_claims(event)
+    if claims.get('custom:tier') in SIZE_TIERS:
+        return claims['custom:tier']
+    groups = claims.get('cognito:groups') or []
+    if isinstance(groups, str):
+        # HTTP API JWT authorizers pass list claims as "[a b]"
+        groups = groups.strip('[]').replace(',', ' ').split()
+    for group in groups:
+        if group in SIZE_TIERS:
+            return group
+    return os.environ.get('DEFAULT_UPLOAD_TIER', 'free')
+
+def max_upload_bytes(tier):
+    return SIZE_TIERS.get(tier, SIZE_TIERS['free'])
+
+# Helper: Parse the file size a client declared, in bytes
+# Returns None unless it is a non-negative whole number (a JSON number or a numeric string).
+def parse_file_size(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return size if size >= 0 else None
@@ -0,0 +1,218 @@
+# Isolated, budgeted PDF text extraction.
+#
+# PyPDF2 runs in a forked worker process, so a malformed page or a
+# decompression bomb can only hurt the worker, never the invocation that is
+# ingesting a whole batch of uploads. The worker's open step also runs the
+# pre-flight checks (encryption, page count), so even the reader's first parse
+# of an untrusted file happens out of process. The parent enforces:
+#
+#   - PAGE_TIMEOUT_SECONDS per page: a page that takes longer gets its worker
+#     killed, is recorded as skipped, and a fresh worker resumes at the next page
+#   - PAGE_MEMORY_MB of address space above the worker's starting footprint
+#     (RLIMIT_AS): a page that exhausts it raises MemoryError in the worker
+#     (or gets it killed), is skipped, and the worker is replaced so the
+#     fragmented heap is released
+#   - MAX_PAGE_CHARS per page: longer text is truncated, since no real page
+#     holds that much
+#   - a budget for the whole document, capped by the caller's deadline: pages
+#     not reached in time are skipped
+#
+# Skipped pages contribute no text; the rest of the document is still indexed.
+# Only a document that no worker could open at all raises ExtractionError.
+# Every problem is reported in the diagnostics returned alongside the text.
+# Lambda has no /dev/shm, so only Process and Pipe are used (no Pool or Queue).
+import multiprocessing
+import os
+import resource
+import time
+from PyPDF2 import PdfReader
+
+PAGE_TIMEOUT_SECONDS = float(os.environ.get('EXTRACT_PAGE_TIMEOUT_SECONDS', '5'))
+PAGE_MEMORY_MB = int(os.environ.get('EXTRACT_PAGE_MEMORY_MB', '256'))
+DOCUMENT_BUDGET_SECONDS = float(os.environ.get('EXTRACT_DOCUMENT_BUDGET_SECONDS', '20'))
+MAX_PAGE_CHARS = 100000
+# Opening the reader parses the xref table, which can itself be slow on broken files
+OPEN_TIMEOUT_SECONDS = 10
+
+# Only fork shares the parent's in-memory spool with the worker without copying it
+_fork = multiprocessing.get_context('fork')
+
+class ExtractionError(Exception):
+    # code is one of process_upload.REJECTION_CODES
+    def __init__(self, code, detail):
+        super().__init__(f"{code}: {detail}")
+        self.code = code
+
+def _address_space_bytes():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmSize:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def _worker(pdf_file, first_page, last_page, max_pages, conn):
+    # Budget memory relative to what the forked worker already maps
+    try:
+        limit = _address_space_bytes() + PAGE_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (OSError, ValueError):
+        pass
+    try:
+        pdf_file.seek(0)
+        reader = PdfReader(pdf_file)
+        # Many "encrypted" PDFs only restrict printing and open with an empty password
+        if reader.is_encrypted and not reader.decrypt(''):
+            conn.send(('fatal', 'PDF_ENCRYPTED', 'password-protected PDFs cannot be indexed'))
+            return
+        page_count = len(reader.pages)
+    except Exception as e:
+        conn.send(('fatal', 'PDF_UNREADABLE', f"{type(e).__name__}: {e}"))
+        return
+    if page_count == 0:
+        conn.send(('fatal', 'PDF_UNREADABLE', 'document has no pages'))
+        return
+    if max_pages and page_count > max_pages:
+        conn.send(('fatal', 'PDF_TOO_MANY_PAGES', f'{page_count} pages exceeds the limit of {max_pages}'))
+        return
+    conn.send(('open', page_count))
+    end = page_count if last_page is None else min(last_page, page_count)
+    for page_number in range(first_page, end):
+        try:
+            text = reader.pages[page_number].extract_text() or ""
+        except MemoryError:
+            conn.send(('skip', page_number, 'memory', f'exceeded {PAGE_MEMORY_MB} MB'))
+            return  # Leave the fragmented heap behind; the parent starts a new worker
+        except Exception as e:
+            conn.send(('skip', page_number, 'error', f"{type(e).__name__}: {e}"[:200]))
+            continue
+        conn.send(('page', page_number, text[:MAX_PAGE_CHARS], len(text) > MAX_PAGE_CHARS))
+    conn.send(('done', end))
+
+def _start(pdf_file, first_page, last_page, max_pages):
+    parent_conn, child_conn = _fork.Pipe(duplex=False)
+    process = _fork.Process(target=_worker, args=(pdf_file, first_page, last_page, max_pages, child_conn),
+                            daemon=True)
+    process.start()
+    child_conn.close()
+    return process, parent_conn
+
+def _stop(process, conn):
+    conn.close()
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+# Helper: Run only the worker's open step and return the page count
+# Raises ExtractionError for encrypted, empty, oversized or unreadable documents.
+def count_pages(pdf_file, max_pages=None):
+    process, conn = _start(pdf_file, 0, 0, max_pages)
+    try:
+        if not conn.poll(OPEN_TIMEOUT_SECONDS):
+            raise ExtractionError('PDF_UNREADABLE', f'opening exceeded {OPEN_TIMEOUT_SECONDS}s')
+        try:
+            message = conn.recv()
+        except EOFError:
+            raise ExtractionError('PDF_UNREADABLE', 'worker exited while opening')
+    finally:
+        _stop(process, conn)
+        pdf_file.seek(0)
+    if message[0] == 'fatal':
+        raise ExtractionError(message[1], message[2])
+    return message[1]
+
+# Helper: Extract pages [first_page, last_page) in a sandboxed worker
+# deadline (time.monotonic()) caps DOCUMENT_BUDGET_SECONDS, e.g. to what is left
+# of the invocation. Returns (page_texts, diagnostics); page_texts has one entry
+# per page in the range, empty for skipped pages. diagnostics = {'pages_total',
+# 'pages_skipped', 'pages_truncated', 'issues': [{'page', 'reason', 'detail'}]}
+# with 1-based pages.
+def extract_pages(pdf_file, first_page=0, last_page=None, on_page=None, deadline=None, max_pages=None):
+    started = time.monotonic()
+    budget_end = started + DOCUMENT_BUDGET_SECONDS
+    if deadline is not None:
+        budget_end = min(budget_end, deadline)
+    texts = {}
+    issues = []
+    truncated = 0
+    total_pages = None
+    next_page = first_page
+
+    while total_pages is None or next_page < end:
+        process, conn = _start(pdf_file, next_page, last_page, max_pages)
+        opened = False
+        try:
+            while True:
+                # Every new worker re-opens the reader before its first page
+                timeout = min(PAGE_TIMEOUT_SECONDS if opened else OPEN_TIMEOUT_SECONDS, budget_end - time.monotonic())
+                if timeout <= 0 or not conn.poll(timeout):
+                    reason = 'budget' if budget_end <= time.monotonic() else 'timeout'
+                    break
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    # Killed by the kernel (OOM) or crashed in native code
+                    reason = 'crashed'
+                    break
+                kind = message[0]
+                if kind == 'fatal':
+                    if total_pages is None:
+                        raise ExtractionError(message[1], message[2])
+                    reason = message[2]
+                    break
+                if kind == 'open':
+                    opened = True
+                    if total_pages is None:
+                        total_pages = message[1]
+                        end = total_pages if last_page is None else min(last_page, total_pages)
+                    continue
+                if kind == 'done':
+                    reason = None
+                    break
+                page_number = message[1]
+                if kind == 'page':
+                    texts[page_number] = message[2]
+                    truncated += message[3]
+                else:
+                    issues.append({'page': page_number + 1, 'reason': message[2], 'detail': message[3]})
+                next_page = page_number + 1
+                if on_page:
+                    on_page(next_page - first_page, end - first_page)
+                if kind == 'skip' and message[2] == 'memory':
+                    reason = 'restart'
+                    break
+        finally:
+            _stop(process, conn)
+            pdf_file.seek(0)
+
+        if total_pages is None:
+            if reason == 'budget':
+                # The invocation ran out of time, not the document's fault: retry later
+                raise TimeoutError('extraction budget exhausted before the document was opened')
+            # No worker ever opened the document: that is not a page problem
+            raise ExtractionError('PDF_UNREADABLE', f"could not open PDF ({reason})")
+        if reason is None or reason == 'restart':
+            continue
+        if reason == 'budget' or not opened:
+            # Out of time, or a replacement worker could not re-open the file:
+            # keep what was extracted and report the rest
+            detail = (f'extraction budget of {budget_end - started:.0f}s exhausted' if reason == 'budget'
+                      else f'worker could not re-open the document ({reason})')
+            issues.extend({'page': p + 1, 'reason': 'budget', 'detail': detail} for p in range(next_page, end))
+            break
+        # The worker hung or died on next_page: skip it and carry on after it
+        issues.append({'page': next_page + 1, 'reason': reason,
+                       'detail': f'exceeded {PAGE_TIMEOUT_SECONDS:g}s' if reason == 'timeout' else 'worker exited'})
+        next_page += 1
+        if on_page:
+            on_page(next_page - first_page, end - first_page)
+
+    page_texts = [texts.get(p, "") for p in range(first_page, end)]
+    diagnostics = {
+        'pages_total': len(page_texts),
+        'pages_skipped': len(issues),
+        'pages_truncated': truncated,
+        'issues': issues
+    }
+    if issues or truncated:
+        print(f"[EXTRACT] {len(issues)} of {len(page_texts)} pages skipped, {truncated} truncated: {issues[:5]}")
+    return page_texts, diagnostics
@@ -0,0 +1,119 @@
+# Operator tools for the queue-buffered ingestion path (S3 -> SQS -> process_upload).
+#
+#   python ingest_queue.py redrive <dlq_url> <queue_url> [--max N]
+#       Moves messages from the dead-letter queue back to the ingest queue,
+#       e.g. after fixing whatever made them fail.
+#
+#   python ingest_queue.py local <bucket> <key> [<key> ...]
+#       Feeds S3 notifications for existing objects through LocalQueue, a
+#       stand-in with SQS receive/retry/dead-letter semantics, and drives
+#       process_upload.lambda_handler with SQS-shaped batches exactly as the
+#       event source mapping would. S3 and DynamoDB are whatever the usual
+#       boto3 configuration points at (AWS or a local emulator).
+import argparse
+import json
+import uuid
+
+# Keep in step with maxReceiveCount on paiIngestQueue in infra/template.yaml
+MAX_RECEIVE_COUNT = 5
+BATCH_SIZE = 5
+
+def s3_notification(bucket_name, s3_key, etag=None):
+    obj = {'key': s3_key}
+    if etag:
+        obj['eTag'] = etag
+    return {'Records': [{'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+                         's3': {'bucket': {'name': bucket_name}, 'object': obj}}]}
+
+class LocalQueue:
+    """In-memory queue with the parts of SQS the ingest consumer relies on."""
+
+    def __init__(self, max_receive_count=MAX_RECEIVE_COUNT):
+        self.max_receive_count = max_receive_count
+        self.messages = []
+        self.dead_letters = []
+
+    def send(self, body):
+        self.messages.append({'messageId': str(uuid.uuid4()), 'body': json.dumps(body), 'receive_count': 0})
+
+    def receive(self, max_messages):
+        batch, self.messages = self.messages[:max_messages], self.messages[max_messages:]
+        for message in batch:
+            message['receive_count'] += 1
+        return batch
+
+    def settle(self, batch, failed_ids):
+        # Successful messages are deleted; failed ones become visible again or dead-letter
+        for message in batch:
+            if message['messageId'] not in failed_ids:
+                continue
+            if message['receive_count'] >= self.max_receive_count:
+                self.dead_letters.append(message)
+            else:
+                self.messages.append(message)
+
+def to_sqs_event(batch):
+    return {'Records': [{
+        'messageId': m['messageId'],
+        'receiptHandle': m['messageId'],
+        'body': m['body'],
+        'eventSource': 'aws:sqs',
+        'attributes': {'ApproximateReceiveCount': str(m['receive_count'])}
+    } for m in batch]}
+
+def drain(queue, handler, batch_size=BATCH_SIZE):
+    """Deliver batches to handler until the queue is empty; returns the dead-lettered messages."""
+    while queue.messages:
+        batch = queue.receive(batch_size)
+        response = handler(to_sqs_event(batch), None) or {}
+        failed_ids = {f['itemIdentifier'] for f in response.get('batchItemFailures', [])}
+        queue.settle(batch, failed_ids)
+        print(f"[INGEST-QUEUE] Delivered {len(batch)} messages, {len(failed_ids)} failed")
+    return queue.dead_letters
+
+def redrive(sqs_client, dlq_url, queue_url, max_messages=None):
+    moved = 0
+    while max_messages is None or moved < max_messages:
+        wanted = 10 if max_messages is None else min(10, max_messages - moved)
+        response = sqs_client.receive_message(QueueUrl=dlq_url, MaxNumberOfMessages=wanted, WaitTimeSeconds=1)
+        messages = response.get('Messages', [])
+        if not messages:
+            break
+        sqs_client.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(i), 'MessageBody': m['Body']} for i, m in enumerate(messages)]
+        )
+        # Only delete once the copies are safely on the ingest queue
+        sqs_client.delete_message_batch(
+            QueueUrl=dlq_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': m['ReceiptHandle']} for i, m in enumerate(messages)]
+        )
+        moved += len(messages)
+    print(f"[INGEST-QUEUE] Redrove {moved} messages from {dlq_url}")
+    return moved
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue-buffered ingestion tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    redrive_parser = commands.add_parser('redrive', help='move dead-lettered uploads back to the ingest queue')
+    redrive_parser.add_argument('dlq_url')
+    redrive_parser.add_argument('queue_url')
+    redrive_parser.add_argument('--max', type=int, default=None)
+    local_parser = commands.add_parser('local', help='ingest existing objects through a local queue stand-in')
+    local_parser.add_argument('bucket')
+    local_parser.add_argument('keys', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'redrive':
+        import boto3
+        redrive(boto3.client('sqs'), args.dlq_url, args.queue_url, args.max)
+    else:
+        from process_upload import lambda_handler
+        queue = LocalQueue()
+        for key in args.keys:
+            queue.send(s3_notification(args.bucket, key))
+        dead = drain(queue, lambda_handler)
+        print(f"[INGEST-QUEUE] Done, {len(dead)} messages dead-lettered")
+
+if __name__ == '__main__':
+    main()
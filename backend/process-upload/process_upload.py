@@ -1,133 +1,973 @@
 import json
 import os
+import time
+import hashlib
 import boto3
 import urllib.parse
 import io
+import tempfile
+import uuid
 import numpy as np
-from PyPDF2 import PdfReader
 from decimal import Decimal
 from botocore.exceptions import ClientError
+import scheduler
+from extract_sandbox import ExtractionError, count_pages, extract_pages
+from text_cleanup import normalize_pages
+from embeddings import HASH_MODEL_VERSION, LEGACY_VECTOR_METRIC, VECTOR_METRIC, embed_texts, get_model_version, normalize_embeddings
 
-def extract_text_from_pdf(file_content):
-    pdf_stream = io.BytesIO(file_content)
-    reader = PdfReader(pdf_stream)
-    text = "\n".join([page.extract_text() or "" for page in reader.pages])
-    return text
+# Embed this many chunks between progress reports
+EMBED_BATCH_SIZE = 64
+
+# Update mode patches list elements in place only when this few positions changed;
+# beyond that a single put_item is cheaper than a huge UpdateExpression
+MAX_PATCH_POSITIONS = 40
+# DynamoDB BatchGetItem accepts at most 100 keys per call
+CACHE_BATCH_GET_LIMIT = 100
+EMBEDDING_CACHE_TTL_SECONDS = 90 * 24 * 3600
+
+# PDF readers accept the %PDF- marker anywhere in the first 1024 bytes
+PDF_MAGIC = b'%PDF-'
+HEADER_CHECK_BYTES = 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Downloads larger than this spill from memory to /tmp while streaming
+SPOOL_MAX_MEMORY = 32 * 1024 * 1024
+
+# Pre-flight limits: objects beyond these are rejected before the body is
+# downloaded (size) or before any page is extracted (page count). MAX_PDF_BYTES
+# matches the largest upload tier; presigned POST policies enforce the per-user one.
+MAX_PDF_BYTES = int(os.environ.get('MAX_PDF_BYTES', str(1024 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.environ.get('MAX_PDF_PAGES', '2000'))
+# Failures with these prefixes are properties of the file: retrying cannot help
+REJECTION_CODES = ('NOT_A_PDF', 'PDF_TOO_LARGE', 'PDF_TOO_MANY_PAGES', 'PDF_ENCRYPTED', 'PDF_UNREADABLE',
+                   'PDF_NO_TEXT')
+# Scanned or image-only PDFs have no text layer to index
+NO_TEXT_ERROR = 'PDF_NO_TEXT: the document contains no extractable text (scanned or image-only PDF?)'
+
+# At most this many per-page extraction issues are kept on the status item
+MAX_REPORTED_EXTRACTION_ISSUES = 20
+# Invocation time kept back after extraction to chunk, embed and store a document
+POST_EXTRACTION_RESERVE_SECONDS = 8
+# A queued message is only started with at least this much invocation time left;
+# later messages of the batch go back to the queue untouched
+MIN_MESSAGE_SECONDS = 15
+
+# Ingest claims: an unfinished claim is taken over after the lease (well past the
+# function timeout, and shorter than the ingest queue's visibility timeout so a
+# redelivered message can take over a dead owner's claim); finished claims are
+# kept long enough to absorb redeliveries
+CLAIM_LEASE_SECONDS = 5 * 60
+CLAIM_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Map-reduce ingestion: new documents with at least FANOUT_MIN_PAGES pages are split
+# into page-range tasks queued on the ingest queue
+FANOUT_MIN_PAGES = int(os.environ.get('FANOUT_MIN_PAGES', '100'))
+FANOUT_PAGES_PER_TASK = int(os.environ.get('FANOUT_PAGES_PER_TASK', '50'))
+# Partial results live outside the uploads/ prefix so they never trigger ingestion
+PARTS_PREFIX = 'ingest-parts/'
+# SQS SendMessageBatch accepts at most 10 entries
+SQS_BATCH_LIMIT = 10
+
+# Documents too large for one DynamoDB item (400 KB) keep their chunks and vectors
+# in S3 under this prefix; the item holds vectors_key and the metadata only
+DOCUMENT_VECTORS_PREFIX = 'document-vectors/'
+INLINE_ITEM_MAX_BYTES = 300 * 1024
+# Approximate stored size of one Decimal vector component
+DECIMAL_BYTES_ESTIMATE = 12
+
+# Status fields describing one attempt; a 'processed' write removes any it does not set
+ATTEMPT_STATUS_FIELDS = ('error', 'pages_skipped', 'pages_truncated', 'extraction_issues', 'unchanged', 'deduplicated')
+# Per-page and per-batch progress is written at most this often
+PROGRESS_WRITE_INTERVAL_SECONDS = 2
+
+# Helper: Write incremental progress to the compact status item
+# The status item lives in its own table so /status polling never reads
+# the heavy chunks/embeddings item. Every write bumps `version`, which the
+# status endpoint uses to detect changes while long-polling. A 'processed'
+# write clears what an earlier failed or partial attempt left behind.
+def update_status(status_table, doc_id, status, **fields):
+    if status_table is None:
+        return
+    stale = []
+    if status == 'processed':
+        # A byte-identical update keeps the live version's extraction report
+        stale = ['error'] if fields.get('unchanged') else [k for k in ATTEMPT_STATUS_FIELDS if k not in fields]
+    # The upload arrived, so the seeded item's expiry no longer applies
+    stale.append('expires_at')
+    fields['status'] = status
+    fields['updated_at'] = int(time.time())
+    names = {f'#{k}': k for k in list(fields) + stale}
+    values = {f':{k}': v for k, v in fields.items()}
+    values[':one'] = 1
+    expression = 'SET ' + ', '.join(f'#{k} = :{k}' for k in fields) + ' ADD #version :one'
+    if stale:
+        expression += ' REMOVE ' + ', '.join(f'#{k}' for k in stale)
+    try:
+        status_table.update_item(
+            Key={'doc_id': doc_id},
+            UpdateExpression=expression,
+            ExpressionAttributeNames={**names, '#version': 'version'},
+            ExpressionAttributeValues=values
+        )
+    except Exception as e:
+        # Progress reporting must never fail the ingestion itself
+        print(f"[PROCESS-UPLOAD] Status update failed for {doc_id}: {e}")
+
+# Helper: Throttle a progress callback to one call per PROGRESS_WRITE_INTERVAL_SECONDS
+# report(done, total) is skipped between intervals, except for the final call.
+def throttle_progress(report):
+    last_call = None
+    def on_progress(done, total):
+        nonlocal last_call
+        now = time.monotonic()
+        if done < total and last_call is not None and now - last_call < PROGRESS_WRITE_INTERVAL_SECONDS:
+            return
+        last_call = now
+        report(done, total)
+    return on_progress
+
+def get_status_table(dynamodb):
+    status_table_name = os.environ.get('STATUS_TABLE')
+    return dynamodb.Table(status_table_name) if status_table_name else None
+
+def get_registry_table(dynamodb):
+    registry_table_name = os.environ.get('CONTENT_REGISTRY_TABLE')
+    return dynamodb.Table(registry_table_name) if registry_table_name else None
+
+# Helper: Content-addressed registry of already-ingested PDFs
+# Maps the SHA-256 of the uploaded bytes to the doc_id whose item holds the
+# chunks and embeddings, so identical uploads can point at it instead of
+# being extracted and embedded again.
+def find_duplicate(registry_table, content_hash):
+    if registry_table is None:
+        return None
+    try:
+        return registry_table.get_item(Key={'content_sha256': content_hash}).get('Item')
+    except ClientError as e:
+        print(f"[PROCESS-UPLOAD] Registry lookup failed for {content_hash}: {e}")
+        return None
+
+def register_content(registry_table, content_hash, doc_id, chunk_count, text_length):
+    if registry_table is None:
+        return
+    try:
+        # First writer wins; later identical uploads reference this doc
+        registry_table.put_item(
+            Item={
+                'content_sha256': content_hash,
+                'doc_id': doc_id,
+                'chunk_count': chunk_count,
+                'text_length': text_length,
+                'created_at': int(time.time())
+            },
+            ConditionExpression='attribute_not_exists(content_sha256)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"[PROCESS-UPLOAD] Registry write failed for {content_hash}: {e}")
+
+def extract_text_from_pdf(file_content, on_page=None):
+    return "\n".join(extract_pages_from_pdf(file_content, on_page)[0])
+
+# Helper: Stream a get_object body into a seekable spool, hashing on the way
+# The header is checked before anything else is read, so a non-PDF costs one
+# 1 KiB read and the rest of the object is never downloaded.
+# Returns (file object positioned at 0, sha256 hex digest, size in bytes).
+def read_pdf_body(body):
+    header = body.read(HEADER_CHECK_BYTES)
+    if PDF_MAGIC not in header:
+        body.close()
+        raise Exception("NOT_A_PDF: object does not start with a PDF header")
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    digest = hashlib.sha256(header)
+    spool.write(header)
+    size = len(header)
+    for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest(), size
+
+# Helper: Reject PDFs that will never be indexed before any text is extracted
+# The sandbox worker's open step checks encryption and the page count, so the
+# untrusted file is never parsed in this process. Returns the page count.
+def preflight_pdf(pdf_file):
+    try:
+        return count_pages(pdf_file, MAX_PDF_PAGES)
+    except ExtractionError as e:
+        raise Exception(str(e))
+
+# Helper: Extract page texts in the budgeted sandbox (see extract_sandbox.py)
+# deadline is the invocation's end (time.monotonic()); extraction stops early
+# enough to leave POST_EXTRACTION_RESERVE_SECONDS for the rest of the ingest.
+# Returns (page_texts, diagnostics). Pages that hang, crash or exhaust memory
+# come back empty and are listed in diagnostics; a document with no usable page
+# at all is rejected, and so is one the worker's open step refuses.
+def extract_pages_from_pdf(file_content, on_page=None, first_page=0, last_page=None, deadline=None):
+    # Accepts raw bytes or a seekable file object such as read_pdf_body's spool
+    pdf_stream = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    if deadline is not None:
+        deadline -= POST_EXTRACTION_RESERVE_SECONDS
+    try:
+        page_texts, diagnostics = extract_pages(pdf_stream, first_page, last_page, on_page,
+                                                deadline=deadline, max_pages=MAX_PDF_PAGES)
+    except ExtractionError as e:
+        raise Exception(str(e))
+    if page_texts and diagnostics['pages_skipped'] == len(page_texts):
+        raise Exception(f"PDF_UNREADABLE: no page could be extracted ({diagnostics['issues'][0]['reason']})")
+    return page_texts, diagnostics
+
+def extraction_status_fields(diagnostics):
+    if not diagnostics['pages_skipped'] and not diagnostics['pages_truncated']:
+        return {}
+    return {
+        'pages_skipped': diagnostics['pages_skipped'],
+        'pages_truncated': diagnostics['pages_truncated'],
+        'extraction_issues': diagnostics['issues'][:MAX_REPORTED_EXTRACTION_ISSUES]
+    }
 
 def chunk_text(text, chunk_size=500):
     return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
 
+# Chunks never span a page boundary, so editing one page of a revised PDF
+# only changes that page's chunks instead of shifting every chunk after it
+def chunk_pages(page_texts, chunk_size=500):
+    chunks = []
+    for page_text in page_texts:
+        chunks.extend(chunk_text(page_text, chunk_size))
+    return chunks
+
 def get_embeddings(chunks):
-    # Generate embeddings using a consistent text-to-vector approach
-    import hashlib
+    # Same provider as the query function, see embeddings.py; stored unit-length for inner-product search
+    return normalize_embeddings(embed_texts(chunks))
+
+def get_cache_table(dynamodb):
+    cache_table_name = os.environ.get('EMBEDDING_CACHE_TABLE')
+    return dynamodb.Table(cache_table_name) if cache_table_name else None
+
+def embedding_cache_key(chunk):
+    # Model version and metric are part of the key, so switching either never reuses stale vectors
+    return hashlib.sha256(f"{get_model_version()}|{VECTOR_METRIC}\0{chunk}".encode('utf-8')).hexdigest()
+
+def fetch_cached_embeddings(cache_table, keys):
+    found = {}
+    # The resource's client (de)serializes attribute values itself: keys go in as
+    # plain strings and binary vectors come back as boto3 Binary
+    dynamodb = cache_table.meta.client
+    for start in range(0, len(keys), CACHE_BATCH_GET_LIMIT):
+        request = {cache_table.name: {
+            'Keys': [{'chunk_hash': k} for k in keys[start:start + CACHE_BATCH_GET_LIMIT]],
+            'ProjectionExpression': 'chunk_hash, vector'
+        }}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(cache_table.name, []):
+                found[item['chunk_hash']] = np.frombuffer(item['vector'].value, dtype=np.float32)
+            # Throttled keys come back as UnprocessedKeys and are simply retried
+            request = response.get('UnprocessedKeys') or None
+    return found
+
+def store_cached_embeddings(cache_table, vectors_by_key):
+    expires_at = int(time.time()) + EMBEDDING_CACHE_TTL_SECONDS
+    with cache_table.batch_writer() as batch:
+        for key, vector in vectors_by_key.items():
+            batch.put_item(Item={
+                'chunk_hash': key,
+                'vector': np.asarray(vector, dtype=np.float32).tobytes(),
+                'model_version': get_model_version(),
+                'expires_at': expires_at
+            })
+
+# Helper: get_embeddings with a shared chunk-level cache in front of it
+# Chunks are keyed by hash(model version + text), looked up in one batch, and
+# only the misses are embedded. Repeated chunks within the batch are embedded once.
+def get_embeddings_cached(chunks, cache_table):
+    if cache_table is None or not chunks:
+        return get_embeddings(chunks), 0
+    keys = [embedding_cache_key(chunk) for chunk in chunks]
+    unique_keys = list(dict.fromkeys(keys))
+    try:
+        cached = fetch_cached_embeddings(cache_table, unique_keys)
+    except ClientError as e:
+        print(f"[PROCESS-UPLOAD] Embedding cache read failed, embedding everything: {e}")
+        cached = {}
+
+    missing = {}
+    for key, chunk in zip(keys, chunks):
+        if key not in cached and key not in missing:
+            missing[key] = chunk
+    if missing:
+        computed = dict(zip(missing.keys(), get_embeddings(list(missing.values()))))
+        try:
+            store_cached_embeddings(cache_table, computed)
+        except ClientError as e:
+            print(f"[PROCESS-UPLOAD] Embedding cache write failed: {e}")
+        cached.update(computed)
+
+    hits = len(chunks) - len(missing)
+    return np.stack([cached[key] for key in keys]).astype(np.float32), hits
+
+def embed_chunks(chunks, cache_table, on_progress=None):
+    embedding_batches = []
+    cache_hits = 0
+    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+        batch_embeddings, batch_hits = get_embeddings_cached(chunks[start:start + EMBED_BATCH_SIZE], cache_table)
+        embedding_batches.append(batch_embeddings)
+        cache_hits += batch_hits
+        if on_progress:
+            on_progress(min(start + EMBED_BATCH_SIZE, len(chunks)), len(chunks))
+    embeddings = np.concatenate(embedding_batches) if embedding_batches else get_embeddings([])
+    return embeddings, cache_hits
+
+def chunk_hash(chunk):
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+# Helper: Follow a dedup reference to the item holding the chunks and embeddings
+# If the referenced doc was since revised in place, its content hash no longer
+# matches and the registry points at the frozen copy of the original content.
+def resolve_content_item(table, registry_table, item):
+    if not item.get('source_doc_id'):
+        return item
+    source = table.get_item(Key={'doc_id': item['source_doc_id']}, ConsistentRead=True).get('Item')
+    if source and source.get('content_sha256') == item.get('content_sha256'):
+        return source
+    entry = find_duplicate(registry_table, item.get('content_sha256', ''))
+    if entry:
+        return table.get_item(Key={'doc_id': entry['doc_id']}, ConsistentRead=True).get('Item')
+    return None
+
+# Helper: Keep deduplicated references stable when their source is revised
+# Before doc_id's content is replaced, a copy of the old content is written under
+# a content-addressed id and the registry is re-pointed at it.
+def freeze_registered_content(table, registry_table, previous):
+    old_hash = previous.get('content_sha256')
+    if registry_table is None or not old_hash:
+        return
+    entry = find_duplicate(registry_table, old_hash)
+    if not entry or entry['doc_id'] != previous['doc_id']:
+        return
+    frozen_doc_id = f"content-{old_hash}"
+    frozen = {k: v for k, v in previous.items() if k not in ('user_id', 'filename', 's3_key')}
+    frozen['doc_id'] = frozen_doc_id
+    table.put_item(Item=frozen)
+    try:
+        registry_table.update_item(
+            Key={'content_sha256': old_hash},
+            UpdateExpression='SET doc_id = :frozen',
+            ConditionExpression='doc_id = :owner',
+            ExpressionAttributeValues={':frozen': frozen_doc_id, ':owner': previous['doc_id']}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+# Helper: Diff a revised document's chunks against the stored version
+# Returns stored vectors keyed by new chunk position for every chunk whose text
+# is unchanged, plus the positions that need embedding.
+def vectors_are_current(previous):
+    # Untagged items predate model tagging (hash provider) and normalization (L2)
+    return (previous.get('embedding_model', HASH_MODEL_VERSION) == get_model_version()
+            and previous.get('vector_metric', LEGACY_VECTOR_METRIC) == VECTOR_METRIC)
+
+def plan_incremental_update(chunks, previous):
+    reused = {}
+    if vectors_are_current(previous):
+        old_vectors = {}
+        for old_chunk, old_embedding in zip(previous.get('chunks', []), previous.get('embeddings', [])):
+            old_vectors.setdefault(chunk_hash(old_chunk), old_embedding)
+        for i, chunk in enumerate(chunks):
+            vector = old_vectors.get(chunk_hash(chunk))
+            if vector is not None:
+                reused[i] = vector
+    changed = [i for i in range(len(chunks)) if i not in reused]
+    return reused, changed
+
+def to_decimal_vector(vector):
+    # Vectors read back from an item are already Decimal lists; fresh ones are float32 rows
+    return vector if isinstance(vector, list) else [Decimal(str(x)) for x in vector.tolist()]
+
+# Helper: Store a document's chunks and vectors
+# Small documents keep everything in their item. Larger ones would exceed the
+# DynamoDB item limit, so their chunks and float32 vectors go to one compressed
+# .npz object per content version and the item keeps only vectors_key. Objects
+# are content-addressed and never overwritten, so frozen copies and dedup
+# references to an older version stay readable.
+def store_document(table, s3_client, bucket_name, doc_id, chunks, vectors, fields):
+    dimension = len(vectors[0]) if vectors else 0
+    estimate = sum(len(chunk.encode('utf-8')) for chunk in chunks) + len(chunks) * dimension * DECIMAL_BYTES_ESTIMATE
+    if estimate <= INLINE_ITEM_MAX_BYTES:
+        table.put_item(Item={'doc_id': doc_id, 'chunks': chunks,
+                             'embeddings': [to_decimal_vector(v) for v in vectors], **fields})
+        return
+    vectors_key = f"{DOCUMENT_VECTORS_PREFIX}{doc_id}/{fields['content_sha256']}.npz"
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, chunks=np.array(chunks, dtype=str),
+                        embeddings=np.asarray(vectors, dtype=np.float32).reshape(len(chunks), dimension))
+    s3_client.put_object(Bucket=bucket_name, Key=vectors_key, Body=buffer.getvalue())
+    table.put_item(Item={'doc_id': doc_id, 'vectors_key': vectors_key, **fields})
+    print(f"[PROCESS-UPLOAD] Stored {len(chunks)} chunks for {doc_id} in s3://{bucket_name}/{vectors_key}")
+
+# Helper: Fill in the chunks and embeddings of an item stored with vectors_key
+def load_document_content(s3_client, bucket_name, item):
+    if not item or not item.get('vectors_key'):
+        return item
+    body = s3_client.get_object(Bucket=bucket_name, Key=item['vectors_key'])['Body'].read()
+    data = np.load(io.BytesIO(body), allow_pickle=False)
+    return dict(item, chunks=data['chunks'].tolist(), embeddings=list(data['embeddings']))
+
+# Helper: Write a revised document, touching only changed list positions when possible
+# Returns the number of positions written, or None if the document has to be
+# stored whole with store_document.
+def patch_document(table, doc_id, previous, chunks, vectors, fields):
+    old_chunks = previous.get('chunks', [])
+    positions = [i for i in range(len(chunks)) if i >= len(old_chunks) or chunks[i] != old_chunks[i]]
+    in_place = (
+        previous.get('doc_id') == doc_id
+        and not previous.get('source_doc_id')
+        and not previous.get('vectors_key')
+        # Unchanged positions hold vectors of another model or metric otherwise
+        and vectors_are_current(previous)
+        and len(chunks) == len(old_chunks)
+        and len(positions) <= MAX_PATCH_POSITIONS
+    )
+    if not in_place:
+        return None
+
+    names = {f'#{k}': k for k in fields}
+    values = {f':{k}': v for k, v in fields.items()}
+    assignments = [f'#{k} = :{k}' for k in fields]
+    for i in positions:
+        assignments.append(f'chunks[{i}] = :c{i}')
+        assignments.append(f'embeddings[{i}] = :e{i}')
+        values[f':c{i}'] = chunks[i]
+        values[f':e{i}'] = to_decimal_vector(vectors[i])
+    # The update is refused if another writer changed the item since we diffed it
+    values[':expected_count'] = len(old_chunks)
+    table.update_item(
+        Key={'doc_id': doc_id},
+        # Re-embedded versions (see backend/reembed) were computed from the old text
+        UpdateExpression='SET ' + ', '.join(assignments) + ' REMOVE vector_versions',
+        ConditionExpression='size(chunks) = :expected_count',
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+    return len(positions)
+
+# S3 answers a GET pinned to an ETag that is no longer current with 412 and a
+# GET of a deleted object with 404. Either way this event's bytes are gone: a
+# newer version has its own event, and a deleted object has nothing to ingest.
+SUPERSEDED_ERROR_CODES = ('PreconditionFailed', 'NoSuchKey', '412', '404')
+
+def is_superseded(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in SUPERSEDED_ERROR_CODES
+
+def get_claims_table(dynamodb):
+    claims_table_name = os.environ.get('INGEST_CLAIMS_TABLE')
+    return dynamodb.Table(claims_table_name) if claims_table_name else None
+
+# Helper: Exactly-once ingestion claims
+# An object version is identified by bucket, key and ETag. The first delivery
+# claims it with a conditional put; redeliveries and concurrent duplicates find
+# the claim and return immediately. A claim whose owner died is taken over once
+# its lease expires, and failed ingests release their claim so a retry can run.
+# claim_ingest returns 'acquired', 'done' (nothing left to do) or 'in_progress'
+# (another delivery is working on it and may still fail, so retry later).
+def ingest_claim_id(bucket_name, s3_key, etag):
+    return f"{bucket_name}/{s3_key}#{etag}"
+
+def claim_ingest(claims_table, claim_id, owner):
+    now = int(time.time())
+    try:
+        claims_table.put_item(
+            Item={
+                'claim_id': claim_id,
+                'state': 'in_progress',
+                'owner': owner,
+                'lease_expires': now + CLAIM_LEASE_SECONDS,
+                'expires_at': now + CLAIM_RETENTION_SECONDS
+            },
+            ConditionExpression='attribute_not_exists(claim_id) OR (#s = :in_progress AND lease_expires < :now)',
+            ExpressionAttributeNames={'#s': 'state'},
+            ExpressionAttributeValues={':in_progress': 'in_progress', ':now': now}
+        )
+        return 'acquired'
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    existing = claims_table.get_item(Key={'claim_id': claim_id}, ConsistentRead=True).get('Item')
+    # A claim released between the put and the read counts as in progress: the retry will take it
+    return 'done' if existing and existing.get('state') == 'done' else 'in_progress'
+
+def finish_claim(claims_table, claim_id, owner, completed):
+    try:
+        if completed:
+            claims_table.update_item(
+                Key={'claim_id': claim_id},
+                UpdateExpression='SET #s = :done, completed_at = :now',
+                ConditionExpression='#o = :owner',
+                ExpressionAttributeNames={'#s': 'state', '#o': 'owner'},
+                ExpressionAttributeValues={':done': 'done', ':now': int(time.time()), ':owner': owner}
+            )
+        else:
+            claims_table.delete_item(
+                Key={'claim_id': claim_id},
+                ConditionExpression='#o = :owner',
+                ExpressionAttributeNames={'#o': 'owner'},
+                ExpressionAttributeValues={':owner': owner}
+            )
+    except ClientError as e:
+        # A lost claim only means a redelivery may redo the work
+        print(f"[PROCESS-UPLOAD] Could not finish claim {claim_id}: {e}")
+
+def document_fields(user_id, filename, s3_key, content_hash, chunk_count, text_length):
+    return {
+        'user_id': user_id,
+        'filename': filename,
+        's3_key': s3_key,
+        'status': 'processed',
+        'text_length': text_length,
+        'chunk_count': chunk_count,
+        'content_sha256': content_hash,
+        'embedding_model': get_model_version(),
+        'vector_metric': VECTOR_METRIC,
+        # Sort key of the user-documents-index catalog
+        'updated_at': int(time.time())
+    }
+
+# Helper: Map-reduce ingestion of large PDFs
+# The coordinator (a normal ingest) uses the pre-flight page count and queues one
+# task per page range on the ingest queue, so range work is capped by the queue's
+# MaximumConcurrency and counts against the owner's ingest leases like any other
+# bulk upload. Each task extracts, chunks and embeds its range, writes the result
+# to S3 under PARTS_PREFIX and adds its range start to the status item's
+# parts_done set. Set adds are idempotent, so redelivered tasks never
+# double-count. The task that completes the set claims the reduce step
+# conditionally, concatenates the parts in page order and stores the document
+# with store_document. Revisions (update mode) always take the single-invocation
+# path so they can be diffed incrementally.
+def fan_out_enabled():
+    return bool(os.environ.get('INGEST_QUEUE_URL'))
+
+def should_fan_out(page_count):
+    return fan_out_enabled() and page_count >= FANOUT_MIN_PAGES
+
+def part_key(task, start):
+    return f"{PARTS_PREFIX}{task['doc_id']}/{task['content_hash']}/{start:06d}.json"
+
+def dispatch_page_ranges(status_table, page_count, task):
+    starts = list(range(0, page_count, FANOUT_PAGES_PER_TASK))
+    update_status(status_table, task['doc_id'], 'extracting', user_id=task['user_id'], filename=task['filename'],
+                  pages_total=page_count, pages_extracted=0, chunks_embedded=0, fanout_tasks=len(starts))
+    bodies = [json.dumps(dict(task, action='ingest_range', start=start,
+                              end=min(start + FANOUT_PAGES_PER_TASK, page_count),
+                              page_count=page_count, starts=starts))
+              for start in starts]
+    sqs_client = boto3.client('sqs')
+    for offset in range(0, len(bodies), SQS_BATCH_LIMIT):
+        response = sqs_client.send_message_batch(
+            QueueUrl=os.environ['INGEST_QUEUE_URL'],
+            Entries=[{'Id': str(i), 'MessageBody': body} for i, body in enumerate(bodies[offset:offset + SQS_BATCH_LIMIT])]
+        )
+        # A retried coordinator re-queues every range; duplicates are harmless
+        if response.get('Failed'):
+            raise Exception(f"Could not queue {len(response['Failed'])} page-range tasks for {task['doc_id']}")
+    print(f"[PROCESS-UPLOAD] Fanned out {task['doc_id']} ({page_count} pages) to {len(starts)} queued tasks")
+
+def ingest_range(task, resources, deadline=None):
+    s3_client, table, status_table, registry_table, cache_table, _ = resources
+    doc_id = task['doc_id']
+    try:
+        get_kwargs = {'Bucket': task['bucket'], 'Key': task['key']}
+        if task.get('etag'):
+            get_kwargs['IfMatch'] = task['etag'] if task['etag'].startswith('"') else f'"{task["etag"]}"'
+        try:
+            response = s3_client.get_object(**get_kwargs)
+        except ClientError as e:
+            if not is_superseded(e):
+                raise
+            print(f"[PROCESS-UPLOAD] {task['key']} changed since {doc_id} fanned out, dropping range {task['start']}")
+            return
+        pdf_file, _, _ = read_pdf_body(response['Body'])
+        page_texts, diagnostics = extract_pages_from_pdf(pdf_file, first_page=task['start'], last_page=task['end'],
+                                                         deadline=deadline)
+        # Repeated headers and footers are detected within the range, which spans many pages
+        page_texts, cleanup = normalize_pages(page_texts)
+        chunks = chunk_pages(page_texts)
+        embeddings, cache_hits = embed_chunks(chunks, cache_table)
+        s3_client.put_object(
+            Bucket=task['bucket'],
+            Key=part_key(task, task['start']),
+            Body=json.dumps({'chunks': chunks, 'embeddings': embeddings.tolist(),
+                             'text_length': len("\n".join(page_texts)),
+                             'extraction': diagnostics,
+                             'text_removed_chars': cleanup['chars_before'] - cleanup['chars_after']}).encode('utf-8')
+        )
+        response = status_table.update_item(
+            Key={'doc_id': doc_id},
+            UpdateExpression='ADD parts_done :part, #version :one SET #s = :embedding, updated_at = :now',
+            ExpressionAttributeNames={'#s': 'status', '#version': 'version'},
+            ExpressionAttributeValues={':part': {str(task['start'])}, ':one': 1, ':embedding': 'embedding',
+                                       ':now': int(time.time())},
+            ReturnValues='ALL_NEW'
+        )
+        print(f"[PROCESS-UPLOAD] {doc_id} pages {task['start']}-{task['end']}: {len(chunks)} chunks ({cache_hits} cached)")
+        if len(response['Attributes'].get('parts_done', ())) == len(task['starts']):
+            reduce_document(task, resources)
+    except Exception as e:
+        print(f"[PROCESS-UPLOAD] Range {task['start']}-{task['end']} of {doc_id} failed: {e}")
+        update_status(status_table, doc_id, 'failed', error=str(e)[:500])
+        raise
+
+# Helper: Reject a fanned-out document whose parts produced no text at all
+# Retrying cannot help, so the reduce claim is kept and the parts are deleted.
+def fail_reduced_document(task, resources):
+    s3_client, table, status_table, _, _, _ = resources
+    update_status(status_table, task['doc_id'], 'failed', error=NO_TEXT_ERROR)
+    table.put_item(Item={'doc_id': task['doc_id'], 'user_id': task['user_id'], 'filename': task['filename'],
+                         's3_key': task['key'], 'status': 'failed', 'error': NO_TEXT_ERROR,
+                         'updated_at': int(time.time())})
+    s3_client.delete_objects(
+        Bucket=task['bucket'],
+        Delete={'Objects': [{'Key': part_key(task, start)} for start in task['starts']], 'Quiet': True}
+    )
+    print(f"[PROCESS-UPLOAD] {task['doc_id']} has no extractable text in any of its {task['page_count']} pages")
+
+def reduce_document(task, resources):
+    s3_client, table, status_table, registry_table, _, _ = resources
+    doc_id = task['doc_id']
+    try:
+        # Only one worker may merge, even if the last two parts land together
+        status_table.update_item(
+            Key={'doc_id': doc_id},
+            UpdateExpression='SET reduce_owner = :owner',
+            ConditionExpression='attribute_not_exists(reduce_owner)',
+            ExpressionAttributeValues={':owner': str(uuid.uuid4())}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return
+        raise
+
+    try:
+        chunks, vectors, text_length, text_removed = [], [], 0, 0
+        diagnostics = {'pages_skipped': 0, 'pages_truncated': 0, 'issues': []}
+        for start in task['starts']:
+            part = json.loads(s3_client.get_object(Bucket=task['bucket'], Key=part_key(task, start))['Body'].read())
+            chunks.extend(part['chunks'])
+            vectors.extend(np.asarray(part['embeddings'], dtype=np.float32))
+            text_length += part['text_length']
+            text_removed += part.get('text_removed_chars', 0)
+            extraction = part.get('extraction', {})
+            diagnostics['pages_skipped'] += extraction.get('pages_skipped', 0)
+            diagnostics['pages_truncated'] += extraction.get('pages_truncated', 0)
+            diagnostics['issues'] += extraction.get('issues', [])
+        # Pages are joined with newlines in the single-invocation path too
+        text_length += len(task['starts']) - 1
+        if not chunks:
+            fail_reduced_document(task, resources)
+            return
+
+        fields = document_fields(task['user_id'], task['filename'], task['key'], task['content_hash'],
+                                 len(chunks), text_length)
+        store_document(table, s3_client, task['bucket'], doc_id, chunks, vectors, fields)
+    except Exception:
+        # Give the retried invocation a chance to merge
+        status_table.update_item(Key={'doc_id': doc_id}, UpdateExpression='REMOVE reduce_owner')
+        raise
+    register_content(registry_table, task['content_hash'], doc_id, len(chunks), text_length)
+    update_status(status_table, doc_id, 'processed', chunks_total=len(chunks), chunks_embedded=len(chunks),
+                  pages_extracted=task['page_count'], text_length=text_length, text_removed_chars=text_removed,
+                  **extraction_status_fields(diagnostics))
+    s3_client.delete_objects(
+        Bucket=task['bucket'],
+        Delete={'Objects': [{'Key': part_key(task, start)} for start in task['starts']], 'Quiet': True}
+    )
+    print(f"[PROCESS-UPLOAD] Reduced {len(task['starts'])} parts into doc_id {doc_id}: {len(chunks)} chunks")
+
+# Helper: Ingest one uploaded object
+# Returns True once the object is fully handled (processed, unchanged or
+# deduplicated) and False when it failed and a later delivery may retry it.
+# deadline (time.monotonic()) is when the invocation times out, if known.
+def ingest_object(s3_client, table, status_table, registry_table, cache_table, bucket_name, s3_key, etag=None,
+                  deadline=None):
+    print(f"[PROCESS-UPLOAD] Processing file: {s3_key}")
     
-    embeddings = []
-    for chunk in chunks:
-        # Use text content to generate a deterministic embedding
-        text_bytes = chunk.encode('utf-8')
-        hash_obj = hashlib.sha256(text_bytes)
-        
-        # Generate 768 dimensions (common embedding size)
-        embedding = []
-        seed = hash_obj.hexdigest()
-        
-        for i in range(768):
-            # Use different parts of the hash to generate different values
-            char_idx = i % len(seed)
-            value = ord(seed[char_idx]) / 255.0  # Normalize to 0-1
-            # Add some variation based on position
-            value = (value + (i * 0.001)) % 1.0
-            embedding.append(value)
-        
-        embeddings.append(embedding)
+    # One GET serves both the metadata and the body. Pinning the event's ETag means a
+    # claim always covers the bytes that were ingested; a newer overwrite has its own event.
+    try:
+        get_kwargs = {'Bucket': bucket_name, 'Key': s3_key}
+        if etag:
+            get_kwargs['IfMatch'] = etag if etag.startswith('"') else f'"{etag}"'
+        response = s3_client.get_object(**get_kwargs)
+        metadata = response.get('Metadata', {})
+        doc_id = metadata.get('doc_id')
+        user_id = metadata.get('user_id', 'unknown')
+        filename = metadata.get('filename', s3_key.split('/')[-1])
+        ingest_mode = metadata.get('ingest_mode', 'create')
+        
+        if not doc_id:
+            # Extract doc_id from s3_key if not in metadata
+            doc_id = s3_key.split('/')[-1].split('_')[0]
+        
+        print(f"[PROCESS-UPLOAD] Doc ID: {doc_id}, User: {user_id}, File: {filename}")
+        
+    except Exception as e:
+        if is_superseded(e):
+            print(f"[PROCESS-UPLOAD] {s3_key} ({etag}) was overwritten or deleted since this event, nothing to do")
+            return True
+        print(f"[PROCESS-UPLOAD] Error getting metadata: {e}")
+        return False
     
-    return np.array(embeddings, dtype=np.float32)
+    # Download and process the PDF
+    try:
+        if response.get('ContentLength', 0) > MAX_PDF_BYTES:
+            response['Body'].close()
+            raise Exception(f"PDF_TOO_LARGE: {response['ContentLength']} bytes exceeds the limit of {MAX_PDF_BYTES}")
+        file_content, content_hash, file_size = read_pdf_body(response['Body'])
+        
+        print(f"[PROCESS-UPLOAD] Downloaded file, size: {file_size} bytes")
+        
+        previous = None
+        if ingest_mode == 'update':
+            previous = table.get_item(Key={'doc_id': doc_id}, ConsistentRead=True).get('Item')
+            if previous and previous.get('content_sha256') == content_hash:
+                update_status(status_table, doc_id, 'processed', unchanged=True)
+                print(f"[PROCESS-UPLOAD] Update for {doc_id} is byte-identical, nothing to do")
+                return True
+        
+        duplicate = None if previous else find_duplicate(registry_table, content_hash)
+        if duplicate and duplicate['doc_id'] != doc_id:
+            # Same bytes already ingested: store a reference instead of reprocessing
+            table.put_item(
+                Item={
+                    'doc_id': doc_id,
+                    'user_id': user_id,
+                    'filename': filename,
+                    's3_key': s3_key,
+                    'content_sha256': content_hash,
+                    'source_doc_id': duplicate['doc_id'],
+                    'status': 'processed',
+                    'updated_at': int(time.time()),
+                    'text_length': duplicate.get('text_length', 0),
+                    'chunk_count': duplicate.get('chunk_count', 0)
+                }
+            )
+            update_status(status_table, doc_id, 'processed', user_id=user_id, filename=filename,
+                          chunks_total=duplicate.get('chunk_count', 0),
+                          chunks_embedded=duplicate.get('chunk_count', 0),
+                          deduplicated=True)
+            print(f"[PROCESS-UPLOAD] Duplicate of doc_id {duplicate['doc_id']}, stored reference for {doc_id}")
+            return True
+        
+        if previous is None and status_table is not None and fan_out_enabled():
+            # Otherwise the same checks run in the extraction worker's open step
+            page_count = preflight_pdf(file_content)
+            if should_fan_out(page_count):
+                dispatch_page_ranges(status_table, page_count, {
+                    'bucket': bucket_name, 'key': s3_key, 'etag': etag, 'doc_id': doc_id,
+                    'user_id': user_id, 'filename': filename, 'content_hash': content_hash
+                })
+                return True
+        
+        update_status(status_table, doc_id, 'extracting', user_id=user_id, filename=filename,
+                      pages_extracted=0, chunks_embedded=0)
+        
+        # Extract text and generate embeddings
+        page_texts, diagnostics = extract_pages_from_pdf(
+            file_content,
+            on_page=throttle_progress(lambda done, total: update_status(
+                status_table, doc_id, 'extracting', pages_extracted=done, pages_total=total)),
+            deadline=deadline
+        )
+        # Strip running headers, footers and boilerplate so they don't become near-identical chunks
+        page_texts, cleanup = normalize_pages(page_texts)
+        text = "\n".join(page_texts)
+        chunks = chunk_pages(page_texts)
+        if not chunks:
+            raise Exception(NO_TEXT_ERROR)
+        print(f"[PROCESS-UPLOAD] Normalized text: removed {cleanup['chars_before'] - cleanup['chars_after']} of "
+              f"{cleanup['chars_before']} chars ({cleanup['lines_removed']} repeated lines, "
+              f"{cleanup['page_numbers_removed']} page numbers, {cleanup['hyphenations_joined']} hyphenations)")
+        
+        previous_content = load_document_content(
+            s3_client, bucket_name, resolve_content_item(table, registry_table, previous)) if previous else None
+        if previous_content:
+            reused, changed = plan_incremental_update(chunks, previous_content)
+        else:
+            reused, changed = {}, list(range(len(chunks)))
+        update_status(status_table, doc_id, 'embedding', chunks_total=len(chunks),
+                      chunks_embedded=len(reused), chunks_reused=len(reused))
+        
+        new_embeddings, cache_hits = embed_chunks(
+            [chunks[i] for i in changed], cache_table,
+            on_progress=throttle_progress(lambda done, total: update_status(
+                status_table, doc_id, 'embedding', chunks_embedded=len(reused) + done))
+        )
+        
+        print(f"[PROCESS-UPLOAD] Extracted {len(chunks)} chunks, embedded {len(changed)} ({cache_hits} from cache), reused {len(reused)}")
+        
+        # Reused vectors keep their stored form; store_document converts as needed
+        vectors = [None] * len(chunks)
+        for i, vector in reused.items():
+            vectors[i] = vector
+        for i, row in zip(changed, new_embeddings):
+            vectors[i] = row
+        
+        fields = document_fields(user_id, filename, s3_key, content_hash, len(chunks), len(text))
+        if previous:
+            # Revising in place: keep any dedup references to the old content intact
+            freeze_registered_content(table, registry_table, previous)
+            written = patch_document(table, doc_id, previous_content or {}, chunks, vectors, fields)
+            if written is None:
+                store_document(table, s3_client, bucket_name, doc_id, chunks, vectors, fields)
+                written = len(chunks)
+            print(f"[PROCESS-UPLOAD] Updated doc_id {doc_id}, rewrote {written} of {len(chunks)} chunk positions")
+        else:
+            store_document(table, s3_client, bucket_name, doc_id, chunks, vectors, fields)
+        register_content(registry_table, content_hash, doc_id, len(chunks), len(text))
+        
+        update_status(status_table, doc_id, 'processed', chunks_total=len(chunks),
+                      chunks_embedded=len(chunks), text_length=len(text),
+                      text_removed_chars=cleanup['chars_before'] - cleanup['chars_after'],
+                      **extraction_status_fields(diagnostics))
+        print(f"[PROCESS-UPLOAD] Successfully processed and stored doc_id: {doc_id}")
+        return True
+        
+    except Exception as e:
+        print(f"[PROCESS-UPLOAD] Error processing file {s3_key}: {e}")
+        import traceback
+        print(traceback.format_exc())
+        
+        update_status(status_table, doc_id, 'failed', error=str(e)[:500])
+        # A rejected file is fully handled; only transient failures go back to the queue
+        rejected = str(e).startswith(REJECTION_CODES)
+        
+        # Store error status in DynamoDB, but never clobber the live version of a document being revised
+        if ingest_mode == 'update':
+            return rejected
+        try:
+            table.put_item(
+                Item={
+                    'doc_id': doc_id,
+                    'user_id': user_id,
+                    'filename': filename,
+                    's3_key': s3_key,
+                    'status': 'failed',
+                    'error': str(e),
+                    'updated_at': int(time.time())
+                }
+            )
+        except:
+            pass  # Don't fail if we can't store error status
+        return rejected
+
+# Helper: Ingest a list of S3 notification records
+# Returns the records that failed and may be retried.
+def ingest_records(s3_records, resources, owner, deadline=None):
+    s3_client, table, status_table, registry_table, cache_table, claims_table = resources
+    failed = []
+    for record in s3_records:
+        bucket_name = record['s3']['bucket']['name']
+        s3_key = urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')
+        etag = record['s3']['object'].get('eTag')
+        
+        # S3 may deliver the same event more than once; only one delivery does the work
+        claim_id = ingest_claim_id(bucket_name, s3_key, etag) if claims_table is not None and etag else None
+        claim = claim_ingest(claims_table, claim_id, owner) if claim_id else 'acquired'
+        if claim == 'done':
+            print(f"[PROCESS-UPLOAD] {s3_key} ({etag}) already ingested, skipping duplicate event")
+            continue
+        if claim == 'in_progress':
+            # The other delivery may still fail; keep this one until the claim settles
+            print(f"[PROCESS-UPLOAD] {s3_key} ({etag}) is being ingested elsewhere, retrying later")
+            failed.append(record)
+            continue
+        
+        completed = ingest_object(s3_client, table, status_table, registry_table, cache_table,
+                                  bucket_name, s3_key, etag, deadline)
+        if claim_id:
+            finish_claim(claims_table, claim_id, owner, completed)
+        if not completed:
+            failed.append(record)
+    return failed
+
+# Helper: Consume a batch from the ingest queue
+# Each SQS message carries one S3 notification or one page-range task of a
+# fanned-out document. Messages that failed are reported back individually, so
+# only they return to the queue and, after maxReceiveCount attempts, move to the
+# dead-letter queue. Messages from a tenant already at its concurrency limit for
+# the message's lane are re-queued with a delay (see scheduler.py) so they never
+# hold up other tenants. Page-range tasks are always bulk-lane. Messages that cannot be
+# started with MIN_MESSAGE_SECONDS of the invocation left are returned unprocessed.
+def handle_queue_batch(sqs_records, resources, owner, deadline=None):
+    leases_table_name = os.environ.get('INGEST_LEASES_TABLE')
+    queue_url = os.environ.get('INGEST_QUEUE_URL')
+    leases_table = boto3.resource('dynamodb').Table(leases_table_name) if leases_table_name and queue_url else None
+    sqs_client = boto3.client('sqs') if leases_table is not None else None
+
+    batch_item_failures = []
+    for message in sqs_records:
+        if deadline is not None and deadline - time.monotonic() < MIN_MESSAGE_SECONDS:
+            batch_item_failures.append({'itemIdentifier': message['messageId']})
+            continue
+        try:
+            notification = json.loads(message['body'])
+            # S3 sends a test event when the notification is first configured
+            if notification.get('Event') == 's3:TestEvent':
+                continue
+            range_task = notification.get('action') == 'ingest_range'
+            lane = 'bulk' if range_task else scheduler.choose_lane(notification)
+            user_id = notification['user_id'] if range_task else scheduler.tenant_of(notification)
+            lease_id = None
+            if leases_table is not None:
+                lease_id = scheduler.acquire(leases_table, user_id, lane)
+                if lease_id is None:
+                    deferrals = scheduler.defer(sqs_client, queue_url, message, notification)
+                    scheduler.emit_metrics(lane, user_id, IngestDeferrals=1)
+                    print(f"[PROCESS-UPLOAD] {user_id} is at its {lane}-lane limit, deferred message (deferral {deferrals})")
+                    continue
+            scheduler.emit_metrics(lane, user_id,
+                                   IngestWaitSeconds=round(time.time() - scheduler.first_seen(message, notification), 3))
+            try:
+                if range_task:
+                    # Raises on failure; completed ranges are idempotent on redelivery
+                    ingest_range(notification, resources, deadline)
+                elif ingest_records(notification.get('Records', []), resources, owner, deadline):
+                    batch_item_failures.append({'itemIdentifier': message['messageId']})
+            finally:
+                if lease_id:
+                    scheduler.release(leases_table, user_id, lease_id, lane)
+        except Exception as e:
+            print(f"[PROCESS-UPLOAD] Message {message.get('messageId')} failed: {e}")
+            batch_item_failures.append({'itemIdentifier': message['messageId']})
+    if batch_item_failures:
+        print(f"[PROCESS-UPLOAD] {len(batch_item_failures)} of {len(sqs_records)} messages will be retried")
+    return {'batchItemFailures': batch_item_failures}
 
 def lambda_handler(event, context):
+    records = event.get('Records', [])
+    if event.get('action') == 'ingest_range':
+        # Re-running a single range by hand; queued range tasks arrive as SQS messages
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata'))
+        return ingest_range(event, (boto3.client('s3'), table, get_status_table(dynamodb),
+                                    get_registry_table(dynamodb), get_cache_table(dynamodb), None))
+    queued = bool(records) and records[0].get('eventSource') == 'aws:sqs'
     try:
         s3_client = boto3.client('s3')
         dynamodb = boto3.resource('dynamodb')
         table_name = os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata')
         table = dynamodb.Table(table_name)
+        resources = (s3_client, table, get_status_table(dynamodb), get_registry_table(dynamodb),
+                     get_cache_table(dynamodb), get_claims_table(dynamodb))
+        owner = getattr(context, 'aws_request_id', None) or str(time.time())
+        deadline = (time.monotonic() + context.get_remaining_time_in_millis() / 1000
+                    if hasattr(context, 'get_remaining_time_in_millis') else None)
         
-        # Process each S3 event record
-        for record in event['Records']:
-            bucket_name = record['s3']['bucket']['name']
-            s3_key = urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8')
-            
-            print(f"[PROCESS-UPLOAD] Processing file: {s3_key}")
-            
-            # Get object metadata
-            try:
-                metadata_response = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
-                metadata = metadata_response.get('Metadata', {})
-                doc_id = metadata.get('doc_id')
-                user_id = metadata.get('user_id', 'unknown')
-                filename = metadata.get('filename', s3_key.split('/')[-1])
-                
-                if not doc_id:
-                    # Extract doc_id from s3_key if not in metadata
-                    doc_id = s3_key.split('/')[-1].split('_')[0]
-                
-                print(f"[PROCESS-UPLOAD] Doc ID: {doc_id}, User: {user_id}, File: {filename}")
-                
-            except Exception as e:
-                print(f"[PROCESS-UPLOAD] Error getting metadata: {e}")
-                continue
-            
-            # Download and process the PDF
-            try:
-                response = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
-                file_content = response['Body'].read()
-                
-                print(f"[PROCESS-UPLOAD] Downloaded file, size: {len(file_content)} bytes")
-                
-                # Extract text and generate embeddings
-                text = extract_text_from_pdf(file_content)
-                chunks = chunk_text(text)
-                embeddings = get_embeddings(chunks)
-                
-                print(f"[PROCESS-UPLOAD] Extracted {len(chunks)} chunks, {len(embeddings)} embeddings")
-                
-                # Convert embeddings to Decimal for DynamoDB
-                embeddings_decimal = [[Decimal(str(x)) for x in emb] for emb in embeddings.tolist()]
-                
-                # Store in DynamoDB
-                table.put_item(
-                    Item={
-                        'doc_id': doc_id,
-                        'user_id': user_id,
-                        'filename': filename,
-                        's3_key': s3_key,
-                        'chunks': chunks,
-                        'embeddings': embeddings_decimal,
-                        'status': 'processed',
-                        'text_length': len(text),
-                        'chunk_count': len(chunks)
-                    }
-                )
-                
-                print(f"[PROCESS-UPLOAD] Successfully processed and stored doc_id: {doc_id}")
-                
-            except Exception as e:
-                print(f"[PROCESS-UPLOAD] Error processing file {s3_key}: {e}")
-                import traceback
-                print(traceback.format_exc())
-                
-                # Store error status in DynamoDB
-                try:
-                    table.put_item(
-                        Item={
-                            'doc_id': doc_id,
-                            'user_id': user_id,
-                            'filename': filename,
-                            's3_key': s3_key,
-                            'status': 'failed',
-                            'error': str(e)
-                        }
-                    )
-                except:
-                    pass  # Don't fail if we can't store error status
+        # Queue-buffered deployments deliver SQS batches; direct S3 notifications still work
+        if queued:
+            return handle_queue_batch(records, resources, owner, deadline)
+        ingest_records(records, resources, owner, deadline)
         
         return {
             'statusCode': 200,
@@ -139,6 +979,9 @@ def lambda_handler(event, context):
         import traceback
         print(traceback.format_exc())
         
+        if queued:
+            # Nothing in the batch was handled: let every message be retried
+            return {'batchItemFailures': [{'itemIdentifier': r['messageId']} for r in records]}
         return {
             'statusCode': 500,
             'body': json.dumps(f'Processing failed: {str(e)}')
@@ -0,0 +1,163 @@
+# Fair-share scheduling for queue-buffered ingestion.
+#
+# Every upload lands on the same SQS queue, so without help one user's bulk
+# upload would occupy every consumer until it is drained. The consumer asks this
+# module before ingesting a message:
+#
+#   - fast lane: notifications whose objects are all at most FAST_LANE_MAX_BYTES
+#     take seconds, so they get their own per-tenant pool of leases
+#     (max_fast_concurrency, seeded from USER_MAX_FAST_LANE_INGESTS) and never
+#     wait behind their tenant's large files; interactive uploads stay queryable
+#     during a backfill, while a flood of small files still cannot take every
+#     consumer
+#   - bulk lane: larger objects need a lease from the tenant's max_concurrency
+#     pool (seeded from USER_MAX_CONCURRENT_INGESTS)
+#
+# Both caps are adjustable per tenant on its row in the leases table. A tenant
+# at a lane's limit has the message re-sent with a delay instead of blocking a
+# consumer, so the remaining consumers keep serving other tenants.
+#
+# Leases expire after LEASE_SECONDS so a crashed consumer cannot strand a slot.
+# Queue wait and deferrals are logged as CloudWatch embedded metrics
+# (namespace PAI/Ingestion); queue depth comes from the queue's own
+# ApproximateNumberOfMessagesVisible metric.
+import json
+import os
+import random
+import time
+import urllib.parse
+import uuid
+from botocore.exceptions import ClientError
+
+FAST_LANE_MAX_BYTES = int(os.environ.get('FAST_LANE_MAX_BYTES', str(2 * 1024 * 1024)))
+USER_MAX_CONCURRENT_INGESTS = int(os.environ.get('USER_MAX_CONCURRENT_INGESTS', '2'))
+USER_MAX_FAST_LANE_INGESTS = int(os.environ.get('USER_MAX_FAST_LANE_INGESTS', '2'))
+# Longer than one consumer invocation can run
+LEASE_SECONDS = 5 * 60
+DEFER_MIN_SECONDS = 5
+DEFER_MAX_SECONDS = 20
+METRICS_NAMESPACE = 'PAI/Ingestion'
+
+# Lease pool of each lane on a tenant row: (leases map, cap attribute, default cap)
+_POOLS = {
+    'bulk': ('leases', 'max_concurrency', USER_MAX_CONCURRENT_INGESTS),
+    'fast': ('fast_leases', 'max_fast_concurrency', USER_MAX_FAST_LANE_INGESTS),
+}
+
+def tenant_of(notification):
+    # Upload keys are uploads/<user_id>/<doc_id>_<filename>
+    for record in notification.get('Records', []):
+        parts = urllib.parse.unquote_plus(record['s3']['object']['key']).split('/')
+        if len(parts) >= 3 and parts[0] == 'uploads':
+            return parts[1]
+    return 'unknown'
+
+def choose_lane(notification):
+    sizes = [record['s3']['object'].get('size') for record in notification.get('Records', [])]
+    if sizes and all(size is not None and size <= FAST_LANE_MAX_BYTES for size in sizes):
+        return 'fast'
+    return 'bulk'
+
+def _sweep(leases_table, user_id, lane):
+    """Drop a lane's expired leases, creating the tenant row or pool on first use. Returns True if a retry may succeed."""
+    leases_attr, cap_attr, default_cap = _POOLS[lane]
+    item = leases_table.get_item(Key={'user_id': user_id}, ConsistentRead=True).get('Item')
+    if item is None:
+        row = {'user_id': user_id}
+        for pool_attr, pool_cap_attr, pool_default_cap in _POOLS.values():
+            row[pool_attr] = {}
+            row[pool_cap_attr] = pool_default_cap
+        try:
+            leases_table.put_item(Item=row, ConditionExpression='attribute_not_exists(user_id)')
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        return True
+    if leases_attr not in item:
+        # Rows created before the fast-lane pool existed
+        leases_table.update_item(
+            Key={'user_id': user_id},
+            UpdateExpression='SET #pool = if_not_exists(#pool, :empty), #cap = if_not_exists(#cap, :cap)',
+            ExpressionAttributeNames={'#pool': leases_attr, '#cap': cap_attr},
+            ExpressionAttributeValues={':empty': {}, ':cap': default_cap}
+        )
+        return True
+    now = int(time.time())
+    expired = [lease_id for lease_id, expiry in item[leases_attr].items() if int(expiry) < now]
+    if not expired:
+        return False
+    names = {f'#l{i}': lease_id for i, lease_id in enumerate(expired)}
+    names['#pool'] = leases_attr
+    leases_table.update_item(
+        Key={'user_id': user_id},
+        UpdateExpression='REMOVE ' + ', '.join(f'#pool.#l{i}' for i in range(len(expired))),
+        ExpressionAttributeNames=names
+    )
+    print(f"[SCHEDULER] Reclaimed {len(expired)} expired {lane}-lane leases for {user_id}")
+    return True
+
+def acquire(leases_table, user_id, lane='bulk'):
+    """Take one of the tenant's slots in a lane. Returns a lease id, or None if the tenant is at its limit."""
+    leases_attr, cap_attr, _ = _POOLS[lane]
+    lease_id = str(uuid.uuid4())
+    for _ in range(2):
+        try:
+            leases_table.update_item(
+                Key={'user_id': user_id},
+                UpdateExpression='SET #pool.#lease = :expiry',
+                ConditionExpression='size(#pool) < #cap',
+                ExpressionAttributeNames={'#pool': leases_attr, '#cap': cap_attr, '#lease': lease_id},
+                ExpressionAttributeValues={':expiry': int(time.time()) + LEASE_SECONDS}
+            )
+            return lease_id
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('ConditionalCheckFailedException', 'ValidationException'):
+                raise
+        if not _sweep(leases_table, user_id, lane):
+            return None
+    return None
+
+def release(leases_table, user_id, lease_id, lane='bulk'):
+    try:
+        leases_table.update_item(
+            Key={'user_id': user_id},
+            UpdateExpression='REMOVE #pool.#lease',
+            ExpressionAttributeNames={'#pool': _POOLS[lane][0], '#lease': lease_id}
+        )
+    except ClientError as e:
+        # The lease simply expires on its own
+        print(f"[SCHEDULER] Could not release lease for {user_id}: {e}")
+
+def first_seen(message, notification):
+    """Epoch seconds at which the upload first entered the queue, across deferrals."""
+    if 'pai_first_seen' in notification:
+        return float(notification['pai_first_seen'])
+    sent_ms = message.get('attributes', {}).get('SentTimestamp')
+    return int(sent_ms) / 1000.0 if sent_ms else time.time()
+
+def defer(sqs_client, queue_url, message, notification):
+    notification = dict(notification, pai_first_seen=first_seen(message, notification),
+                        pai_deferrals=int(notification.get('pai_deferrals', 0)) + 1)
+    sqs_client.send_message(
+        QueueUrl=queue_url,
+        MessageBody=json.dumps(notification),
+        DelaySeconds=random.randint(DEFER_MIN_SECONDS, DEFER_MAX_SECONDS)
+    )
+    return notification['pai_deferrals']
+
+def emit_metrics(lane, user_id, **values):
+    """Log values as CloudWatch embedded metrics, dimensioned by lane."""
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Lane']],
+                'Metrics': [{'Name': name, 'Unit': 'Seconds' if name.endswith('Seconds') else 'Count'}
+                            for name in values]
+            }]
+        },
+        'Lane': lane,
+        'user_id': user_id,
+        **values
+    }))
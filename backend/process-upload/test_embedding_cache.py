@@ -0,0 +1,79 @@
+# Run from this directory: python -m unittest test_embedding_cache
+#
+# The cache table is a real boto3 resource whose HTTP requests are answered by a
+# small in-memory DynamoDB, so request serialization and response parsing are
+# exercised exactly as in Lambda.
+import json
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import boto3
+import numpy as np
+from botocore.awsrequest import AWSResponse
+
+import process_upload
+
+class _InMemoryDynamoDB:
+    def __init__(self):
+        self.items = {}
+
+    def __call__(self, request, **kwargs):
+        operation = request.headers['X-Amz-Target'].decode().split('.')[-1]
+        body = json.loads(request.body)
+        try:
+            status, result = 200, getattr(self, operation)(body)
+        except ValueError as e:
+            status, result = 400, {'__type': 'com.amazonaws.dynamodb.v20120810#ValidationException',
+                                   'message': str(e)}
+        response = AWSResponse(request.url, status, {}, None)
+        response._content = json.dumps(result).encode()
+        return response
+
+    @staticmethod
+    def _hash_key(key):
+        value = key['chunk_hash']
+        if set(value) != {'S'} or not isinstance(value['S'], str):
+            raise ValueError(f'invalid key attribute value {value}')
+        return value['S']
+
+    def BatchWriteItem(self, body):
+        for table_name, writes in body['RequestItems'].items():
+            for write in writes:
+                item = write['PutRequest']['Item']
+                self.items[(table_name, self._hash_key(item))] = item
+        return {'UnprocessedItems': {}}
+
+    def BatchGetItem(self, body):
+        responses = {}
+        for table_name, request in body['RequestItems'].items():
+            for key in request['Keys']:
+                item = self.items.get((table_name, self._hash_key(key)))
+                if item is not None:
+                    responses.setdefault(table_name, []).append(
+                        {name: item[name] for name in ('chunk_hash', 'vector')})
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb_backend = _InMemoryDynamoDB()
+        self.cache_table = boto3.resource('dynamodb').Table('pai-embedding-cache')
+        self.cache_table.meta.client.meta.events.register('before-send.dynamodb', self.dynamodb_backend)
+
+    def test_second_ingest_of_same_text_hits_cache(self):
+        chunks = process_upload.chunk_pages(["first page " * 80, "second page " * 80])
+
+        first, first_hits = process_upload.embed_chunks(chunks, self.cache_table)
+        with mock.patch.object(process_upload, 'get_embeddings', side_effect=AssertionError('embedded again')):
+            second, second_hits = process_upload.embed_chunks(chunks, self.cache_table)
+
+        self.assertEqual(first_hits, 0)
+        self.assertEqual(second_hits, len(chunks))
+        np.testing.assert_array_equal(first, second)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# Page text normalization before chunking.
+#
+# Shipped identically with process-upload and upload. PDF text comes out with
+# running headers, footers, page numbers and per-page boilerplate, each of which
+# would otherwise become near-identical chunks and vectors. normalize_pages:
+#
+#   - drops page numbers at the top or bottom of a page: any number with a
+#     "page"/"p." prefix ("Page 3 of 40", "p. iv"), lowercase roman numerals
+#     ("- iv -"), and bare numbers ("12", "3 / 40") only when they count up with
+#     the pages on at least MIN_PAGES_FOR_REPEATS pages, so a stray "2024" stays
+#   - drops lines repeated on at least REPEAT_PAGE_RATIO of the pages: within
+#     the first/last EDGE_LINES lines with digits masked (so "Chapter 2 - p. 17"
+#     matches "Chapter 2 - p. 18"), anywhere else only when identical and at
+#     least BOILERPLATE_MIN_CHARS long (copyright and confidentiality notices).
+#     Pages of at most 2 * EDGE_LINES lines have no body to tell edges from, so
+#     masked edge matching skips them; otherwise templated forms, invoices and
+#     slides, whose lines differ only in their digits, would lose all their text
+#   - joins words hyphenated across line breaks and collapses whitespace
+#
+# Repeated lines never empty a page: a page left with nothing but removed
+# repeats keeps them, and a document left with no text at all is returned
+# whitespace-normalized only. Pages stay separate, so chunks still never span a
+# page boundary.
+import re
+
+EDGE_LINES = 3
+REPEAT_PAGE_RATIO = 0.5
+# Repetition means nothing in very short documents
+MIN_PAGES_FOR_REPEATS = 3
+BOILERPLATE_MIN_CHARS = 40
+# Longer lines are body text, however often they recur
+MAX_REPEATED_LINE_CHARS = 200
+
+_ROMAN = r'(?=[ivxlcdm])m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3})'
+_DECORATION = r'[\s\-–—|.]*'
+_PREFIXED_NUMBER = re.compile(rf'^{_DECORATION}(?:page|p\.)\s*(?:[0-9]+|{_ROMAN})(?:\s*(?:of|/)\s*[0-9]+)?{_DECORATION}$',
+                              re.IGNORECASE)
+# Well-formed and lowercase only, so words such as "Civil" or "ill" never match
+_ROMAN_NUMBER = re.compile(rf'^{_DECORATION}{_ROMAN}{_DECORATION}$')
+_BARE_NUMBER = re.compile(rf'^{_DECORATION}([0-9]+)(?:\s*(?:of|/)\s*[0-9]+)?{_DECORATION}$', re.IGNORECASE)
+_HYPHEN_BREAK = re.compile(r'(\w)-\n([a-z])')
+_SPACES = re.compile(r'[ \t\f\v\u00a0]+')
+
+def _mask(line):
+    return re.sub(r'\d+', '#', line.lower())
+
+def _edge_indexes(lines):
+    return set(range(min(EDGE_LINES, len(lines)))) | set(range(max(0, len(lines) - EDGE_LINES), len(lines)))
+
+def _header_footer_indexes(lines):
+    """Return the edge lines eligible for masked repeat matching."""
+    return _edge_indexes(lines) if len(lines) > 2 * EDGE_LINES else set()
+
+def _numbered_lines(pages):
+    """Return the (page, line) positions of bare numbers that count up with the pages."""
+    # Numbers in one sequence share their offset from the page index
+    sequences = {}
+    for page, lines in enumerate(pages):
+        for i in _edge_indexes(lines):
+            match = _BARE_NUMBER.match(lines[i])
+            if match:
+                sequences.setdefault(int(match.group(1)) - page, []).append((page, i))
+    return {position for positions in sequences.values()
+            if len({page for page, _ in positions}) >= MIN_PAGES_FOR_REPEATS
+            for position in positions}
+
+def _repeated_lines(pages):
+    """Return (edge keys, exact lines) that recur on enough pages to be boilerplate."""
+    if len(pages) < MIN_PAGES_FOR_REPEATS:
+        return set(), set()
+    edge_counts, line_counts = {}, {}
+    for lines in pages:
+        # Bare numbers are left to _numbered_lines: masked, every one of them looks alike
+        edges = {_mask(lines[i]) for i in _header_footer_indexes(lines)
+                 if len(lines[i]) <= MAX_REPEATED_LINE_CHARS and not _BARE_NUMBER.match(lines[i])}
+        exact = {line for line in lines if BOILERPLATE_MIN_CHARS <= len(line) <= MAX_REPEATED_LINE_CHARS}
+        for key in edges:
+            edge_counts[key] = edge_counts.get(key, 0) + 1
+        for line in exact:
+            line_counts[line] = line_counts.get(line, 0) + 1
+    threshold = max(MIN_PAGES_FOR_REPEATS, len(pages) * REPEAT_PAGE_RATIO)
+    return ({key for key, n in edge_counts.items() if n >= threshold},
+            {line for line, n in line_counts.items() if n >= threshold})
+
+# Helper: Normalize extracted page texts
+# Returns (page_texts, report) where report counts what was removed:
+# {'chars_before', 'chars_after', 'lines_removed', 'page_numbers_removed',
+# 'hyphenations_joined', 'pages_kept_whole'}.
+def normalize_pages(page_texts):
+    pages = [[_SPACES.sub(' ', line).strip() for line in text.splitlines()] for text in page_texts]
+    pages = [[line for line in lines if line] for lines in pages]
+    edge_keys, boilerplate = _repeated_lines(pages)
+    numbered = _numbered_lines(pages)
+
+    report = {'chars_before': sum(len(text) for text in page_texts), 'chars_after': 0,
+              'lines_removed': 0, 'page_numbers_removed': 0, 'hyphenations_joined': 0,
+              'pages_kept_whole': 0}
+    cleaned = []
+    for page, lines in enumerate(pages):
+        edges = _edge_indexes(lines)
+        header_footer = _header_footer_indexes(lines)
+        kept, repeated = [], []
+        for i, line in enumerate(lines):
+            if i in edges and ((page, i) in numbered or _PREFIXED_NUMBER.match(line) or _ROMAN_NUMBER.match(line)):
+                report['page_numbers_removed'] += 1
+            elif (i in header_footer and _mask(line) in edge_keys) or line in boilerplate:
+                repeated.append(line)
+            else:
+                kept.append(line)
+        if not kept and repeated:
+            # Everything on the page recurs elsewhere: it is the content, not a header
+            kept = repeated
+            report['pages_kept_whole'] += 1
+        else:
+            report['lines_removed'] += len(repeated)
+        text, joined = _HYPHEN_BREAK.subn(r'\1\2', '\n'.join(kept))
+        report['hyphenations_joined'] += joined
+        report['chars_after'] += len(text)
+        cleaned.append(text)
+    if not report['chars_after'] and any(pages):
+        # Nothing but page numbers: keep the text rather than an empty document
+        cleaned = ['\n'.join(lines) for lines in pages]
+        report.update(chars_after=sum(len(text) for text in cleaned), page_numbers_removed=0, hyphenations_joined=0)
+    return cleaned, report
@@ -0,0 +1,105 @@
+# Single-flight coalescing of identical concurrent queries.
+#
+# The first invocation for a (doc_id, question, options) key claims a short-lived
+# in-flight marker with a conditional put and does the work; identical requests
+# arriving meanwhile poll the marker and return the leader's response instead of
+# repeating retrieval and the Gemini call. The finished response stays readable
+# for RESULT_TTL_SECONDS so near-simultaneous stragglers are served from it too.
+# If the leader fails, it deletes its marker and waiters go ahead on their own.
+import hashlib
+import json
+import time
+from botocore.exceptions import ClientError
+
+# How long a claim stays valid if its leader dies without releasing it
+INFLIGHT_TTL_SECONDS = 35
+RESULT_TTL_SECONDS = 30
+POLL_INTERVAL_SECONDS = 0.25
+
+def request_key(doc_id, question, options):
+    normalized = ' '.join(question.lower().split())
+    raw = json.dumps([doc_id, normalized, options], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def try_acquire(table, key, owner):
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item={'request_key': key, 'state': 'pending', 'owner': owner,
+                  'expires_at': now + INFLIGHT_TTL_SECONDS},
+            ConditionExpression='attribute_not_exists(request_key) OR expires_at < :now',
+            ExpressionAttributeValues={':now': now}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def publish(table, key, owner, response):
+    table.put_item(
+        Item={'request_key': key, 'state': 'done', 'owner': owner,
+              'response': json.dumps(response),
+              'expires_at': int(time.time()) + RESULT_TTL_SECONDS},
+        ConditionExpression='#o = :owner',
+        ExpressionAttributeNames={'#o': 'owner'},
+        ExpressionAttributeValues={':owner': owner}
+    )
+
+def release(table, key, owner):
+    try:
+        table.delete_item(
+            Key={'request_key': key},
+            ConditionExpression='#o = :owner',
+            ExpressionAttributeNames={'#o': 'owner'},
+            ExpressionAttributeValues={':owner': owner}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+# Helper: Wait for the leader's response
+# Returns the response dict, or None when there is no live leader any more and
+# the caller should try to acquire (or just do the work) itself.
+def wait_for_leader(table, key, timeout_seconds):
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        item = table.get_item(Key={'request_key': key}, ConsistentRead=True).get('Item')
+        if item is None or int(item['expires_at']) < int(time.time()):
+            return None
+        if item['state'] == 'done':
+            return json.loads(item['response'])
+        time.sleep(POLL_INTERVAL_SECONDS)
+    return None
+
+def coalesce(table, key, owner, compute, wait_seconds, shareable):
+    """Run compute() once per key across concurrent callers.
+
+    `shareable(response)` decides whether a leader's response may be handed to
+    waiters (errors specific to one caller should not be). `wait_seconds` bounds
+    the total time spent waiting on leaders, so the caller keeps enough time to
+    compute() itself afterwards.
+    Returns (response, coalesced_flag).
+    """
+    wait_deadline = time.time() + wait_seconds
+    for _ in range(2):
+        if try_acquire(table, key, owner):
+            try:
+                response = compute()
+            except Exception:
+                release(table, key, owner)
+                raise
+            if shareable(response):
+                try:
+                    publish(table, key, owner, response)
+                except ClientError as e:
+                    print(f"[COALESCE] Could not publish result for {key}: {e}")
+                    release(table, key, owner)
+            else:
+                release(table, key, owner)
+            return response, False
+        response = wait_for_leader(table, key, wait_deadline - time.time())
+        if response is not None:
+            return response, True
+    # The leader vanished twice or took too long: answer independently
+    return compute(), False
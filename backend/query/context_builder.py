@@ -0,0 +1,94 @@
+# Token-budgeted context assembly for the Gemini prompt.
+#
+# search_faiss over-fetches candidates ranked by relevance; build_context then
+# drops near-duplicate chunks, merges chunks that sit next to each other in the
+# document into one passage, and keeps adding passages in relevance order until
+# the token budget is spent. The prompt-token count it reports is a local
+# estimate used for budgeting; Gemini's usageMetadata gives the exact figure.
+import math
+import re
+
+PROMPT_TEMPLATE = "Context:\n{context}\n\nQuestion: {question}\nAnswer:"
+# Prepended for follow-up questions in a session
+HISTORY_TEMPLATE = "Conversation so far:\n{history}\n\n"
+# Gemini tokenizes English prose at roughly four characters per token
+CHARS_PER_TOKEN = 4
+NEAR_DUPLICATE_THRESHOLD = 0.85
+SHINGLE_SIZE = 3
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def render_prompt(context, question, history=''):
+    prefix = HISTORY_TEMPLATE.format(history=history) if history else ''
+    return prefix + PROMPT_TEMPLATE.format(context=context, question=question)
+
+def _shingles(text):
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def _is_near_duplicate(shingles, kept_shingles):
+    for other in kept_shingles:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+# Helper: Select chunk ids for the prompt
+# `ranked_ids` are chunk positions ordered best-first. Returns the selected ids
+# grouped into passages of adjacent chunks, ordered by their best member's rank.
+def select_passages(chunks, ranked_ids, budget_tokens, question, history=''):
+    overhead = estimate_tokens(render_prompt('', question, history))
+    remaining = budget_tokens - overhead
+    selected = {}
+    kept_shingles = []
+    for rank, chunk_id in enumerate(ranked_ids):
+        if chunk_id in selected or not 0 <= chunk_id < len(chunks):
+            continue
+        chunk = chunks[chunk_id]
+        shingles = _shingles(chunk)
+        if _is_near_duplicate(shingles, kept_shingles):
+            continue
+        # +1 for the newline joining this chunk to the rest of the context
+        cost = estimate_tokens(chunk) + 1
+        if cost > remaining:
+            # Always answer from at least the best chunk, otherwise try smaller ones
+            if selected:
+                continue
+            cost = remaining
+        selected[chunk_id] = rank
+        kept_shingles.append(shingles)
+        remaining -= cost
+        if remaining <= 0:
+            break
+
+    passages = []
+    for chunk_id in sorted(selected):
+        if passages and passages[-1]['chunk_ids'][-1] == chunk_id - 1:
+            passages[-1]['chunk_ids'].append(chunk_id)
+            passages[-1]['rank'] = min(passages[-1]['rank'], selected[chunk_id])
+        else:
+            passages.append({'chunk_ids': [chunk_id], 'rank': selected[chunk_id]})
+    passages.sort(key=lambda p: p['rank'])
+    return passages
+
+def build_context(chunks, ranked_ids, question, budget_tokens, history=''):
+    passages = select_passages(chunks, ranked_ids, budget_tokens, question, history)
+    # Adjacent chunks are contiguous text, so they are joined without a separator
+    texts = [''.join(chunks[i] for i in p['chunk_ids']) for p in passages]
+    context = '\n'.join(texts)
+    prompt_budget_chars = budget_tokens * CHARS_PER_TOKEN
+    prompt = render_prompt(context, question, history)
+    if len(prompt) > prompt_budget_chars:
+        # Only the single oversized best chunk can get here; trim it to fit
+        overflow = len(prompt) - prompt_budget_chars
+        context = context[:max(0, len(context) - overflow)]
+        prompt = render_prompt(context, question, history)
+    return {
+        'prompt': prompt,
+        'chunk_ids': [i for p in passages for i in p['chunk_ids']],
+        'passages': len(passages),
+        'prompt_tokens_estimate': estimate_tokens(prompt)
+    }
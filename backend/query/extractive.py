@@ -0,0 +1,77 @@
+# Local extractive answering, used when Gemini is unavailable or when the client
+# asks for mode="fast".
+#
+# It works on the chunks retrieval already ranked for the question: every sentence
+# of the top chunks is scored by the IDF-weighted question terms it contains (IDF
+# computed over those sentences only), with a small bonus for higher-ranked
+# chunks. The best sentences are returned in document order together with the
+# character spans of the matched terms and the chunk each one came from, so the
+# client can highlight and cite them. No model calls, a few milliseconds per query.
+import math
+import re
+
+MAX_CHUNKS = 5
+MAX_SENTENCES = 3
+RANK_BONUS = 0.1
+STOPWORDS = frozenset((
+    'a', 'about', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for',
+    'from', 'how', 'i', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'this',
+    'to', 'was', 'were', 'what', 'when', 'where', 'which', 'who', 'why', 'with', 'you'
+))
+
+_SENTENCE = re.compile(r'\S[^.!?]*(?:[.!?]+|$)')
+_WORD = re.compile(r'\w+')
+
+# Crude suffix stripping so "lasts" matches "last" and "covered" matches "cover"
+def _stem(word):
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def _terms(text):
+    return [_stem(w) for w in _WORD.findall(text.lower()) if len(w) > 1 and w not in STOPWORDS]
+
+def split_sentences(text):
+    """Return (start, end) offsets of the sentences in text."""
+    return [(m.start(), m.end()) for m in _SENTENCE.finditer(text) if _WORD.search(m.group())]
+
+def _match_spans(sentence, question_terms):
+    return [[m.start(), m.end()] for m in _WORD.finditer(sentence) if _stem(m.group().lower()) in question_terms]
+
+def extract_answer(chunks, ranked_ids, question, max_sentences=MAX_SENTENCES):
+    question_terms = set(_terms(question))
+    candidates = []
+    for rank, chunk_id in enumerate([i for i in ranked_ids if 0 <= i < len(chunks)][:MAX_CHUNKS]):
+        chunk = chunks[chunk_id]
+        for start, end in split_sentences(chunk):
+            candidates.append({'chunk_id': chunk_id, 'rank': rank, 'start': start, 'end': end,
+                               'text': chunk[start:end].strip(), 'terms': set(_terms(chunk[start:end]))})
+    if not candidates:
+        return {'answer': '', 'highlights': []}
+
+    document_frequency = {}
+    for candidate in candidates:
+        for term in candidate['terms'] & question_terms:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    for candidate in candidates:
+        matched = candidate['terms'] & question_terms
+        relevance = sum(math.log(1 + len(candidates) / document_frequency[t]) for t in matched)
+        # Dampen long sentences so they do not win on length alone
+        relevance /= math.sqrt(max(1, len(candidate['terms'])))
+        candidate['score'] = relevance + (RANK_BONUS / (1 + candidate['rank']) if matched else 0)
+
+    best = sorted(candidates, key=lambda c: -c['score'])[:max_sentences]
+    best = [c for c in best if c['score'] > 0] or [candidates[0]]
+    best.sort(key=lambda c: (c['chunk_id'], c['start']))
+
+    highlights = [{
+        'chunk_id': c['chunk_id'],
+        'text': c['text'],
+        'start': c['start'],
+        'end': c['end'],
+        'spans': _match_spans(c['text'], question_terms),
+        'score': round(c['score'], 4)
+    } for c in best]
+    answer = ' '.join(f"{h['text']} [chunk {h['chunk_id']}]" for h in highlights)
+    return {'answer': answer, 'highlights': highlights}
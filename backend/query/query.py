@@ -1,11 +1,62 @@
+import io
 import json
 import os
+import time
 import boto3
 import uuid
 import requests
 from botocore.exceptions import ClientError
 import faiss
 import numpy as np
+from embeddings import HASH_MODEL_VERSION, LEGACY_VECTOR_METRIC, VECTOR_METRIC, embed_texts, get_model_version, normalize_embeddings
+from context_builder import build_context
+from coalescing import coalesce, request_key
+from rate_limiter import RateLimited, acquire
+from retry_policy import RetryBudget, call_with_hedging
+from extractive import extract_answer
+from sessions import history_text, load_session, new_session, record_turn, retrieval_text
+
+# Candidates fetched from FAISS before the context builder trims them to the token budget
+CANDIDATE_K = int(os.environ.get('CANDIDATE_K', '20'))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '1500'))
+# Maximal marginal relevance trade-off: 1.0 is pure relevance, lower values favour diversity
+MMR_LAMBDA = float(os.environ.get('MMR_LAMBDA', '0.7'))
+# Inner-product documents at least this large get an HNSW index, cached per container
+HNSW_MIN_VECTORS = int(os.environ.get('HNSW_MIN_VECTORS', '2000'))
+HNSW_M = 32
+INDEX_CACHE_SIZE = 8
+
+_index_cache = {}
+
+# Identical concurrent queries wait at most this long in total for the first one's answer
+COALESCE_WAIT_SECONDS = float(os.environ.get('COALESCE_WAIT_SECONDS', '12'))
+# Invocation time a waiter keeps back to answer on its own if the leader fails
+COALESCE_COMPUTE_RESERVE_SECONDS = float(os.environ.get('COALESCE_COMPUTE_RESERVE_SECONDS', '15'))
+MAX_CONTEXT_TOKEN_BUDGET = 8000
+# Smaller budgets would leave the prompt without a single passage
+MIN_CONTEXT_TOKEN_BUDGET = 200
+# Longest a query queues for a Gemini token before falling back
+RATE_LIMIT_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_WAIT_SECONDS', '8'))
+# Gemini retry/hedging policy, see retry_policy.py
+GEMINI_FIRST_ATTEMPT_TIMEOUT = float(os.environ.get('GEMINI_FIRST_ATTEMPT_TIMEOUT', '10'))
+GEMINI_HEDGE_AFTER = float(os.environ.get('GEMINI_HEDGE_AFTER', '6'))
+GEMINI_MAX_ATTEMPTS = int(os.environ.get('GEMINI_MAX_ATTEMPTS', '3'))
+# Time kept back from the Lambda timeout to build the response
+RESPONSE_MARGIN_SECONDS = 2
+
+_retry_budget = RetryBudget()
+
+# Parsed documents kept per container for session follow-ups, keyed by vectors handle
+DOC_CACHE_SIZE = 4
+_doc_cache = {}
+
+# Helper: Read chunks and vectors that ingestion stored in S3
+# Documents too large for one DynamoDB item keep them in a compressed .npz
+# object named by the item's vectors_key.
+def load_stored_vectors(vectors_key):
+    body = boto3.client('s3').get_object(Bucket=os.environ['S3_BUCKET'], Key=vectors_key)['Body'].read()
+    data = np.load(io.BytesIO(body), allow_pickle=False)
+    return data['chunks'].tolist(), data['embeddings']
 
 # Helper: Retrieve document chunks and embeddings from DynamoDB
 
@@ -33,58 +84,181 @@ def get_doc_chunks(doc_id):
         
         if not item:
             raise Exception('Document not found')
+        
+        # Deduplicated uploads point at the doc that holds the shared chunks and embeddings
+        if item.get('source_doc_id'):
+            source = dynamodb.Table(table).get_item(Key={'doc_id': item['source_doc_id']}).get('Item')
+            if source and source.get('content_sha256') != item.get('content_sha256'):
+                # The source was revised in place; the registry points at a frozen copy of the original
+                source = None
+                registry_table = os.environ.get('CONTENT_REGISTRY_TABLE')
+                if registry_table:
+                    entry = dynamodb.Table(registry_table).get_item(
+                        Key={'content_sha256': item.get('content_sha256', '')}
+                    ).get('Item')
+                    if entry:
+                        source = dynamodb.Table(table).get_item(Key={'doc_id': entry['doc_id']}).get('Item')
+            if not source:
+                raise Exception('Document not found')
+            item = source
             
         # Log the correction if applied
         if corrected_doc_id != original_doc_id:
             print(f"[DOC-ID-CORRECTION] Applied correction: {original_doc_id} -> {corrected_doc_id}")
             
-        return item.get('chunks', []), item.get('embeddings', []), corrected_doc_id
+        # Documents written before model tagging were all embedded with the hash provider
+        served_model = get_model_version()
+        if item.get('embedding_model', HASH_MODEL_VERSION) == served_model:
+            # Untagged documents predate normalization and hold raw vectors searched with L2
+            vector_metric = item.get('vector_metric', LEGACY_VECTOR_METRIC)
+            vectors_key = item.get('vectors_key')
+        else:
+            # A re-embedding job (backend/reembed) may have stored this model's vectors alongside
+            version = item.get('vector_versions', {}).get(served_model)
+            if not version or version.get('content_sha256') != item.get('content_sha256', ''):
+                raise Exception(f"EMBEDDING_MODEL_MISMATCH: document embedded with {item.get('embedding_model', HASH_MODEL_VERSION)}, queries use {served_model}")
+            vector_metric = version['vector_metric']
+            vectors_key = version['vectors_key']
+        index_key = f"{item['doc_id']}:{item.get('content_sha256', '')}:{served_model}"
+        if vectors_key:
+            chunks, embeddings = load_stored_vectors(vectors_key)
+        else:
+            chunks, embeddings = item.get('chunks', []), item.get('embeddings', [])
+        return chunks, embeddings, corrected_doc_id, vector_metric, index_key
     except ClientError as e:
         raise Exception(f"DynamoDB get_item failed: {e}")
 
+# Helper: Reuse a session's document from the container cache
+# The handle is the index key of the item holding the vectors
+# ("<doc_id>:<content_sha256>:<served model>"). Vectors of one content version
+# and model never change, so small projected reads confirming that neither the
+# queried document nor the item holding its vectors was revised since are
+# enough, without fetching its chunks and embeddings again.
+def get_cached_doc(doc_id, vectors_handle):
+    if not vectors_handle or vectors_handle not in _doc_cache:
+        return None
+    holder_doc_id, content_sha256, served_model = vectors_handle.split(':', 2)
+    if served_model != get_model_version():
+        _doc_cache.pop(vectors_handle, None)
+        return None
+    table = boto3.resource('dynamodb').Table(os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata'))
+    try:
+        item = table.get_item(Key={'doc_id': doc_id}, ProjectionExpression='content_sha256, source_doc_id').get('Item')
+        if not item or item.get('content_sha256', '') != content_sha256:
+            valid = False
+        elif item.get('source_doc_id'):
+            # A dedup reference: its source (or the frozen copy of the original) must still hold that content
+            holder = table.get_item(Key={'doc_id': holder_doc_id}, ProjectionExpression='content_sha256').get('Item')
+            valid = holder_doc_id != doc_id and bool(holder) and holder.get('content_sha256', '') == content_sha256
+        else:
+            # A reference revised in update mode holds its own vectors and no longer has source_doc_id
+            valid = holder_doc_id == doc_id
+    except ClientError as e:
+        print(f"[SESSION] Version check failed for {doc_id}: {e}")
+        return None
+    if not valid:
+        _doc_cache.pop(vectors_handle, None)
+        return None
+    return _doc_cache[vectors_handle]
+
+def remember_doc(vectors_handle, chunks, embeddings_np, vector_metric):
+    if vectors_handle not in _doc_cache and len(_doc_cache) >= DOC_CACHE_SIZE:
+        _doc_cache.pop(next(iter(_doc_cache)))
+    _doc_cache[vectors_handle] = (chunks, embeddings_np, vector_metric)
+
+# Helper: Look up ingestion progress for a document that has no chunks yet
+
+def get_processing_status(doc_id):
+    status_table = os.environ.get('STATUS_TABLE')
+    if not status_table:
+        return None
+    try:
+        response = boto3.resource('dynamodb').Table(status_table).get_item(
+            Key={'doc_id': doc_id},
+            ProjectionExpression='#s, pages_extracted, pages_total, chunks_embedded, chunks_total, expires_at',
+            ExpressionAttributeNames={'#s': 'status'}
+        )
+    except ClientError as e:
+        print(f"[QUERY] Status lookup failed for {doc_id}: {e}")
+        return None
+    item = response.get('Item')
+    if not item:
+        return None
+    # TTL deletion lags; a seed whose upload never arrived means there is no document
+    expires_at = item.pop('expires_at', None)
+    if item.get('status') == 'awaiting_upload' and expires_at is not None and expires_at <= time.time():
+        return None
+    return {k: int(v) if k != 'status' else v for k, v in item.items()}
+
 # Helper: Search with FAISS
 
-def search_faiss(query_embedding, embeddings):
-    dim = len(query_embedding)
-    index = faiss.IndexFlatL2(dim)
+def build_index(embeddings, vector_metric):
+    dim = embeddings.shape[1]
+    if vector_metric != VECTOR_METRIC:
+        index = faiss.IndexFlatL2(dim)
+    elif len(embeddings) >= HNSW_MIN_VECTORS:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexFlatIP(dim)
     index.add(embeddings)
-    D, I = index.search(np.array([query_embedding]), k=3)
-    return I[0]
+    return index
+
+# Stored vectors are unit-length for 'ip' documents, so only the question is normalized here
+def search_faiss(query_embedding, embeddings, k=CANDIDATE_K, vector_metric=LEGACY_VECTOR_METRIC, index_key=None):
+    if vector_metric == VECTOR_METRIC:
+        query_embedding = normalize_embeddings(query_embedding)
+    index = _index_cache.get(index_key) if index_key else None
+    if index is None:
+        index = build_index(embeddings, vector_metric)
+        # HNSW graphs are costly to build, so keep recent ones for warm invocations
+        if index_key and isinstance(index, faiss.IndexHNSWFlat):
+            if len(_index_cache) >= INDEX_CACHE_SIZE:
+                _index_cache.pop(next(iter(_index_cache)))
+            _index_cache[index_key] = index
+    D, I = index.search(np.array([query_embedding], dtype='float32'), k=min(k, len(embeddings)))
+    return [int(i) for i in I[0] if i >= 0]
 
-# Helper: Generate embeddings using a simple text-to-vector approach
-# Since Gemini's embedding API might have issues, we'll use a consistent hashing approach
+# Helper: Maximal marginal relevance re-ranking of FAISS candidates
+# Greedily picks the candidate maximizing
+#   lambda * sim(query, c) - (1 - lambda) * max(sim(c, already picked))
+# with cosine similarities computed once over the candidate matrix, so repeated
+# headers and boilerplate stop filling every context slot.
+def mmr_rerank(query_embedding, embeddings, candidate_ids, mmr_lambda=MMR_LAMBDA, normalized=False):
+    if len(candidate_ids) <= 1 or mmr_lambda >= 1.0:
+        return list(candidate_ids)
+    candidates = embeddings[candidate_ids]
+    if not normalized:
+        candidates = normalize_embeddings(candidates)
+    query = normalize_embeddings(query_embedding)
+    query_sim = candidates @ query
+    pairwise_sim = candidates @ candidates.T
+
+    order = [int(np.argmax(query_sim))]
+    remaining = np.ones(len(candidate_ids), dtype=bool)
+    remaining[order[0]] = False
+    # Running max similarity of every candidate to the picked set
+    max_sim_to_picked = pairwise_sim[order[0]].copy()
+    while remaining.any():
+        scores = mmr_lambda * query_sim - (1.0 - mmr_lambda) * max_sim_to_picked
+        scores[~remaining] = -np.inf
+        pick = int(np.argmax(scores))
+        order.append(pick)
+        remaining[pick] = False
+        np.maximum(max_sim_to_picked, pairwise_sim[pick], out=max_sim_to_picked)
+    return [candidate_ids[i] for i in order]
+
+# Helper: Embed the question with the same provider ingestion used (see embeddings.py)
 def generate_embedding(text):
-    # Create a consistent 768-dimensional embedding using text hashing
-    # This ensures compatibility between upload and query functions
-    import hashlib
-    
-    # Use text content to generate a deterministic embedding
-    text_bytes = text.encode('utf-8')
-    hash_obj = hashlib.sha256(text_bytes)
-    
-    # Generate 768 dimensions (common embedding size)
-    embedding = []
-    seed = hash_obj.hexdigest()
-    
-    for i in range(768):
-        # Use different parts of the hash to generate different values
-        char_idx = i % len(seed)
-        value = ord(seed[char_idx]) / 255.0  # Normalize to 0-1
-        # Add some variation based on position
-        value = (value + (i * 0.001)) % 1.0
-        embedding.append(value)
-    
-    return embedding
+    return embed_texts([text])[0].tolist()
 
 # Helper: Call Gemini API with proper error handling
 
-def ask_gemini(context_chunks, question):
+# Returns the answer text and Gemini's usageMetadata (exact prompt/answer token counts)
+def ask_gemini(prompt, timeout=30):
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
         raise Exception("GEMINI_API_KEY not configured")
     
-    prompt = f"Context:\n{chr(10).join(context_chunks)}\n\nQuestion: {question}\nAnswer:"
-    
     url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={api_key}"
     headers = {'Content-Type': 'application/json'}
     payload = {
@@ -94,14 +268,14 @@ def ask_gemini(context_chunks, question):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = requests.post(url, headers=headers, json=payload, timeout=timeout)
         
         if response.status_code == 200:
             data = response.json()
             if 'candidates' in data and len(data['candidates']) > 0:
                 candidate = data['candidates'][0]
                 if 'content' in candidate and 'parts' in candidate['content'] and len(candidate['content']['parts']) > 0:
-                    return candidate['content']['parts'][0]['text']
+                    return candidate['content']['parts'][0]['text'], data.get('usageMetadata', {})
                 else:
                     raise Exception("GEMINI_EMPTY_RESPONSE")
             else:
@@ -131,9 +305,114 @@ def ask_gemini(context_chunks, question):
     except requests.exceptions.RequestException as e:
         raise Exception(f"GEMINI_REQUEST_ERROR: {str(e)}")
 
+# Helper: Call Gemini under the retry/hedging policy, reusing the built prompt
+# Returns (text, usageMetadata, attempts).
+def ask_gemini_with_retries(prompt, lambda_context, priority):
+    remaining = 30.0
+    if hasattr(lambda_context, 'get_remaining_time_in_millis'):
+        remaining = lambda_context.get_remaining_time_in_millis() / 1000.0
+    deadline = time.time() + max(1.0, remaining - RESPONSE_MARGIN_SECONDS)
+
+    def admit_extra():
+        # Extra requests only go out if the shared limiter has a token right now
+        try:
+            admit_gemini_call(priority, max_wait_seconds=0)
+            return True
+        except Exception as e:
+            if 'QUOTA_EXCEEDED' not in str(e):
+                raise
+            return False
+
+    (answer, usage), attempts = call_with_hedging(
+        lambda timeout: ask_gemini(prompt, timeout=timeout),
+        deadline=deadline,
+        first_timeout=GEMINI_FIRST_ATTEMPT_TIMEOUT,
+        hedge_after=GEMINI_HEDGE_AFTER,
+        max_attempts=GEMINI_MAX_ATTEMPTS,
+        budget=_retry_budget,
+        admit_extra=admit_extra
+    )
+    return answer, usage, attempts
+
+# Helper: Wait for a token from the shared Gemini rate limiter
+# Running out of tokens is reported as QUOTA_EXCEEDED so it takes the same
+# fallback path as a real 429, just without spending a request on it.
+def admit_gemini_call(priority, max_wait_seconds=RATE_LIMIT_WAIT_SECONDS):
+    table_name = os.environ.get('RATE_LIMIT_TABLE')
+    if not table_name:
+        return
+    try:
+        acquire(boto3.resource('dynamodb').Table(table_name), max_wait_seconds, priority)
+    except RateLimited as e:
+        raise Exception(f"QUOTA_EXCEEDED: {e}")
+    except ClientError as e:
+        # Never block answers on the limiter itself
+        print(f"[RATE-LIMIT] Limiter table unavailable, calling Gemini directly: {e}")
+
 # Lambda handler
 
+def caller_id(event):
+    return event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {}).get('sub', 'anonymous')
+
+# Helper: Open a session from a first turn's answer
+# A first turn has no history, so it is answered (and coalesced) like a
+# stateless question; each caller then gets its own session holding the turn.
+def start_session(event, body, response):
+    sessions_table = os.environ.get('SESSIONS_TABLE')
+    if not sessions_table or response['statusCode'] != 200:
+        return response
+    data = json.loads(response['body'])
+    session = new_session(body['doc_id'], caller_id(event))
+    try:
+        # No vectors handle: the first follow-up loads the document and records it
+        record_turn(boto3.resource('dynamodb').Table(sessions_table), session, body['question'],
+                    data['answer'], data.get('context', {}).get('chunk_ids', []), None)
+    except ClientError as e:
+        print(f"[SESSION] Could not open session for {body['doc_id']}: {e}")
+        return response
+    data['session_id'] = session['session_id']
+    return dict(response, body=json.dumps(data))
+
 def lambda_handler(event, context):
+    inflight_table = os.environ.get('INFLIGHT_TABLE')
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except (TypeError, ValueError):
+        body = {}
+    if event.get('httpMethod') == 'OPTIONS' or not inflight_table or not body.get('doc_id') or not body.get('question'):
+        return process_query(event, context)
+    if body.get('session_id'):
+        # Follow-ups depend on their own history and are answered individually
+        return process_query(event, context)
+    opens_session = bool(body.pop('session', None))
+    if opens_session:
+        event = dict(event, body=json.dumps(body))
+
+    # Coalesce on everything that changes the answer
+    options = {k: body.get(k) for k in ('context_tokens', 'mmr_lambda', 'diversify', 'mode')}
+    key = request_key(body['doc_id'], body['question'], options)
+    owner = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+    wait_seconds = COALESCE_WAIT_SECONDS
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        remaining = context.get_remaining_time_in_millis() / 1000.0
+        wait_seconds = max(0.0, min(wait_seconds, remaining - COALESCE_COMPUTE_RESERVE_SECONDS))
+    try:
+        response, coalesced = coalesce(
+            boto3.resource('dynamodb').Table(inflight_table), key, owner,
+            compute=lambda: process_query(event, context),
+            wait_seconds=wait_seconds,
+            # Answers and quota fallbacks are the same for every caller; other errors are retried independently
+            shareable=lambda r: r['statusCode'] == 200
+        )
+    except ClientError as e:
+        print(f"[COALESCE] In-flight table unavailable, answering directly: {e}")
+        response, coalesced = process_query(event, context), False
+    if coalesced:
+        print(f"[COALESCE] Served {key[:12]} from a concurrent identical request")
+        response = dict(response, headers=dict(response.get('headers', {}), **{'X-Coalesced': 'true'}))
+    return start_session(event, body, response) if opens_session else response
+
+def process_query(event, lambda_context):
     # Handle CORS preflight request
     if event.get('httpMethod') == 'OPTIONS':
         return {
@@ -146,6 +425,7 @@ def lambda_handler(event, context):
             'body': ''
         }
     
+    retrieved = None
     try:
         body = json.loads(event.get('body', '{}'))
         doc_id = body.get('doc_id')
@@ -169,20 +449,40 @@ def lambda_handler(event, context):
                 },
                 'body': json.dumps({'error': 'Missing question'})
             }
+        try:
+            mmr_lambda = float(body.get('mmr_lambda', MMR_LAMBDA))
+            context_tokens = int(body.get('context_tokens', CONTEXT_TOKEN_BUDGET))
+        except (TypeError, ValueError):
+            mmr_lambda = context_tokens = None
+        # The range check also rejects NaN
+        if context_tokens is None or not 0.0 <= mmr_lambda <= 1.0:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'context_tokens must be an integer and mmr_lambda a number between 0 and 1'})
+            }
+        budget = max(MIN_CONTEXT_TOKEN_BUDGET, min(context_tokens, MAX_CONTEXT_TOKEN_BUDGET))
+
+        session = None
+        sessions_table = os.environ.get('SESSIONS_TABLE')
+        if sessions_table and (body.get('session') or body.get('session_id')):
+            session_store = boto3.resource('dynamodb').Table(sessions_table)
+            session = load_session(session_store, body.get('session_id'), doc_id, caller_id(event))
 
         # Generate embedding for the user's question
-        query_embedding = generate_embedding(question)
+        query_embedding = generate_embedding(retrieval_text(session, question) if session else question)
 
-        # Get document chunks with auto-correction
-        result = get_doc_chunks(doc_id)
-        if len(result) == 3:
-            chunks, embeddings, corrected_doc_id = result
-            doc_id_corrected = corrected_doc_id != doc_id
+        # Get document chunks with auto-correction, or the session's cached copy
+        cached = get_cached_doc(doc_id, session['vectors_handle']) if session else None
+        if cached:
+            chunks, embeddings, vector_metric = cached
+            corrected_doc_id, index_key = doc_id, session['vectors_handle']
         else:
-            # Fallback for backward compatibility
-            chunks, embeddings = result
-            corrected_doc_id = doc_id
-            doc_id_corrected = False
+            chunks, embeddings, corrected_doc_id, vector_metric, index_key = get_doc_chunks(doc_id)
+        doc_id_corrected = corrected_doc_id != doc_id
             
         if chunks is None or embeddings is None:
             return {
@@ -202,7 +502,7 @@ def lambda_handler(event, context):
                 },
                 'body': json.dumps({'error': 'No chunks found for this doc_id'})
             }
-        if not isinstance(embeddings, list) or len(embeddings) == 0:
+        if not isinstance(embeddings, (list, np.ndarray)) or len(embeddings) == 0:
             return {
                 'statusCode': 404,
                 'headers': {
@@ -212,7 +512,7 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'No embeddings found for this doc_id'})
             }
         # Convert to numpy arrays for FAISS
-        embeddings_np = np.array(embeddings, dtype='float32')
+        embeddings_np = np.asarray(embeddings, dtype='float32')
         query_embedding_np = np.array(query_embedding, dtype='float32')
         # Ensure correct shape for FAISS
         if embeddings_np.ndim == 1:
@@ -228,12 +528,45 @@ def lambda_handler(event, context):
                 },
                 'body': json.dumps({'error': f'Embedding dimension mismatch: embeddings shape {embeddings_np.shape}, query shape {query_embedding_np.shape}'})
             }
-        idxs = search_faiss(query_embedding_np.flatten(), embeddings_np)
-        context_chunks = [chunks[i] for i in idxs if i < len(chunks)]
-        answer = ask_gemini(context_chunks, question)
-        
-        # Prepare response with correction information
-        response_data = {'answer': answer}
+        if session:
+            remember_doc(index_key, chunks, embeddings_np, vector_metric)
+        idxs = search_faiss(query_embedding_np.flatten(), embeddings_np,
+                            vector_metric=vector_metric, index_key=index_key)
+        if body.get('diversify', True):
+            idxs = mmr_rerank(query_embedding_np.flatten(), embeddings_np, idxs, mmr_lambda,
+                              normalized=vector_metric == VECTOR_METRIC)
+        if session:
+            # Chunks the previous turn was answered from stay available to follow-ups
+            idxs = idxs + [i for i in session['recent_chunk_ids'] if i not in idxs]
+        # Kept for the extractive fallback if Gemini turns out to be unavailable
+        retrieved = (chunks, idxs)
+
+        if body.get('mode') == 'fast':
+            # Latency-sensitive clients skip Gemini and get the extractive answer
+            extracted = extract_answer(chunks, idxs, question)
+            response_data = {
+                'answer': extracted['answer'],
+                'mode': 'fast',
+                'highlights': extracted['highlights'],
+                'context': {'chunk_ids': sorted({h['chunk_id'] for h in extracted['highlights']})}
+            }
+        else:
+            context = build_context(chunks, idxs, question, budget,
+                                    history=history_text(session) if session else '')
+            priority = 'batch' if body.get('priority') == 'batch' else 'interactive'
+            admit_gemini_call(priority)
+            answer, usage, attempts = ask_gemini_with_retries(context['prompt'], lambda_context, priority)
+
+            response_data = {
+                'answer': answer,
+                'context': {
+                    'chunk_ids': context['chunk_ids'],
+                    'passages': context['passages'],
+                    'prompt_tokens': usage.get('promptTokenCount', context['prompt_tokens_estimate']),
+                    'prompt_tokens_exact': 'promptTokenCount' in usage
+                },
+                'gemini_attempts': attempts
+            }
         
         if doc_id_corrected:
             response_data['doc_id_corrected'] = True
@@ -241,6 +574,14 @@ def lambda_handler(event, context):
             response_data['corrected_doc_id'] = corrected_doc_id
             response_data['correction_message'] = f"Document ID was automatically corrected from {doc_id} to {corrected_doc_id}"
             print(f"[DOC-ID-CORRECTION] Notifying user of correction: {doc_id} -> {corrected_doc_id}")
+
+        if session:
+            try:
+                record_turn(session_store, session, question, response_data['answer'],
+                            response_data['context']['chunk_ids'], index_key)
+                response_data['session_id'] = session['session_id']
+            except ClientError as e:
+                print(f"[SESSION] Could not save turn for {session['session_id']}: {e}")
         
         return {
             'statusCode': 200,
@@ -261,19 +602,11 @@ def lambda_handler(event, context):
         if "QUOTA_EXCEEDED" in error_str:
             status_code = 429
             error_message = "API quota exceeded. Please try again later."
-            # Provide a fallback response based on the context
+            # Answer extractively from the chunks already retrieved for this question
             try:
-                # If we have context chunks, provide a basic response
-                result = get_doc_chunks(body.get('doc_id', ''))
-                if len(result) == 3:
-                    chunks, embeddings, _ = result
-                else:
-                    chunks, embeddings = result
-                    
-                if chunks and len(chunks) > 0:
-                    # Create a simple response using the first few chunks
-                    context_preview = "\n".join(chunks[:2])[:500] + "..."
-                    fallback_response = f"I found relevant content in your document:\n\n{context_preview}\n\nNote: Full AI analysis is temporarily unavailable due to API limits. Please try again later for a detailed response."
+                if retrieved:
+                    extracted = extract_answer(*retrieved, body.get('question', ''))
+                    fallback_response = f"I found relevant content in your document:\n\n{extracted['answer']}\n\nNote: Full AI analysis is temporarily unavailable due to API limits. Please try again later for a detailed response."
                     return {
                         'statusCode': 200,  # Return success with fallback
                         'headers': {
@@ -282,11 +615,12 @@ def lambda_handler(event, context):
                         },
                         'body': json.dumps({
                             'answer': fallback_response,
-                            'is_fallback': True
+                            'is_fallback': True,
+                            'highlights': extracted['highlights']
                         })
                     }
-            except:
-                pass  # Continue with the error response if fallback fails
+            except Exception as fallback_error:
+                print(f"[FALLBACK] Extractive answer failed: {fallback_error}")
         elif "GEMINI_SERVER_ERROR" in error_str:
             status_code = 502  # Bad Gateway - upstream server error
             error_message = "AI service temporarily unavailable. Please try again."
@@ -300,8 +634,27 @@ def lambda_handler(event, context):
             status_code = 400  # Bad Request
             error_message = f"AI service error: {error_str.split('GEMINI_API_ERROR: ')[1] if 'GEMINI_API_ERROR: ' in error_str else 'Invalid request'}"
         elif "Document not found" in error_str:
+            processing = get_processing_status(body.get('doc_id', ''))
+            if processing and processing.get('status') not in ('processed', 'failed'):
+                # Still ingesting: tell the client to wait on /status instead of retrying /query
+                return {
+                    'statusCode': 409,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Retry-After': '5'
+                    },
+                    'body': json.dumps({
+                        'error': 'Document is still being processed. Please wait until processing completes.',
+                        'error_type': 'DOCUMENT_PROCESSING',
+                        'processing': processing
+                    })
+                }
             status_code = 404
             error_message = "Document not found. Please check the document ID."
+        elif "EMBEDDING_MODEL_MISMATCH" in error_str:
+            status_code = 409
+            error_message = "This document was indexed with a different embedding model and must be re-embedded before it can be queried."
         elif "No chunks found" in error_str or "No embeddings found" in error_str:
             status_code = 404
             error_message = "Document content not available. Please re-upload the document."
@@ -0,0 +1,72 @@
+# Token-bucket admission control for Gemini calls, shared by every query container.
+#
+# The bucket lives in one DynamoDB item (tokens, updated_at). Each caller reads it,
+# refills it for the elapsed time, and takes a token with a conditional update on
+# the updated_at it read, so concurrent containers never double-spend. Callers
+# that find the bucket empty sleep until the next token is due instead of firing
+# a request Gemini would reject with 429.
+#
+# Interactive queries may drain the bucket; batch work may only take tokens while
+# more than BATCH_RESERVE_FRACTION of the burst capacity is left, which keeps
+# headroom for users even during background jobs.
+import os
+import random
+import time
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+GEMINI_BUCKET = 'gemini'
+# Gemini's free tier allows 15 requests per minute
+REQUESTS_PER_MINUTE = float(os.environ.get('GEMINI_RPM', '15'))
+BURST_CAPACITY = float(os.environ.get('GEMINI_BURST', '5'))
+BATCH_RESERVE_FRACTION = 0.5
+MAX_CONFLICT_RETRIES = 10
+
+class RateLimited(Exception):
+    pass
+
+def _try_take(table, bucket, priority):
+    """Take one token if allowed. Returns 0 on success, else seconds until one is due."""
+    rate = REQUESTS_PER_MINUTE / 60.0
+    reserve = BURST_CAPACITY * BATCH_RESERVE_FRACTION if priority == 'batch' else 0.0
+    for _ in range(MAX_CONFLICT_RETRIES):
+        now = time.time()
+        item = table.get_item(Key={'bucket_id': bucket}, ConsistentRead=True).get('Item')
+        if item:
+            previous = item['updated_at']
+            tokens = min(BURST_CAPACITY, float(item['tokens']) + (now - float(previous)) * rate)
+        else:
+            previous = None
+            tokens = BURST_CAPACITY
+        if tokens - 1 < reserve:
+            return (reserve + 1 - tokens) / rate
+
+        condition = 'attribute_not_exists(updated_at)' if previous is None else 'updated_at = :previous'
+        values = {':tokens': Decimal(str(round(tokens - 1, 6))), ':now': Decimal(str(round(now, 6)))}
+        if previous is not None:
+            values[':previous'] = previous
+        try:
+            table.update_item(
+                Key={'bucket_id': bucket},
+                UpdateExpression='SET tokens = :tokens, updated_at = :now',
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            return 0
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Another container took a token first; re-read and try again
+    return 1.0 / rate
+
+def acquire(table, max_wait_seconds, priority='interactive', bucket=GEMINI_BUCKET):
+    """Block until a Gemini call is admitted, or raise RateLimited after max_wait_seconds."""
+    deadline = time.time() + max_wait_seconds
+    while True:
+        wait = _try_take(table, bucket, priority)
+        if wait == 0:
+            return
+        if time.time() + wait > deadline:
+            raise RateLimited(f"no {priority} Gemini capacity within {max_wait_seconds:.0f}s")
+        # Jitter spreads out containers that were all waiting for the same token
+        time.sleep(wait + random.uniform(0, 0.25))
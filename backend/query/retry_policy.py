@@ -0,0 +1,109 @@
+# Retry and hedging policy for Gemini calls.
+#
+# The prompt is built once per query; call_with_hedging only re-sends that
+# prompt, so retries never repeat the DynamoDB read, embedding or FAISS search.
+#
+#   - the first attempt gets a short deadline (GEMINI_FIRST_ATTEMPT_TIMEOUT);
+#     the response arrives in one piece, so this bounds time to first token
+#   - if it has not answered after hedge_after seconds, a second identical
+#     request is raced against it and the first success wins
+#   - transient failures (5xx, timeouts, connection errors) are retried with
+#     full-jitter exponential backoff until the overall deadline
+#   - every hedge and retry is paid for from a per-container RetryBudget, so an
+#     outage cannot multiply Gemini traffic beyond a fixed ratio
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+RETRYABLE_ERRORS = ('GEMINI_SERVER_ERROR', 'GEMINI_TIMEOUT', 'GEMINI_CONNECTION_ERROR')
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 4.0
+
+def is_retryable(error):
+    return any(code in str(error) for code in RETRYABLE_ERRORS)
+
+class RetryBudget:
+    """Token budget for extra requests, shared by all queries in one container.
+
+    Every first attempt earns `ratio` tokens and every hedge or retry spends one,
+    so extra requests stay below roughly `ratio` of total traffic once the
+    initial `min_tokens` are used up.
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=3.0, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+def backoff_delay(retry_number):
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** retry_number))
+
+def call_with_hedging(attempt, deadline, first_timeout, hedge_after, max_attempts, budget, admit_extra):
+    """Run attempt(timeout_seconds) until one succeeds or the policy gives up.
+
+    `deadline` is an absolute time.time() value. `admit_extra()` is asked before
+    each hedge or retry and may veto it (e.g. when the rate limiter is empty).
+    Returns (result, attempts_made); re-raises the last error on failure.
+    """
+    budget.earn()
+    # Losing requests are left to finish on their own; the pool is not waited on
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        pending = {executor.submit(attempt, max(0.1, min(first_timeout, deadline - time.time())))}
+        attempts = 1
+        hedged = False
+        retries = 0
+        last_error = None
+        while True:
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                raise last_error or Exception("GEMINI_TIMEOUT")
+            timeout = min(hedge_after, remaining) if not hedged else remaining
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    return future.result(), attempts
+                if not is_retryable(error):
+                    raise error
+                last_error = error
+
+            if not done:
+                if not hedged and attempts < max_attempts and budget.try_spend() and admit_extra():
+                    print(f"[GEMINI] No answer after {hedge_after:.1f}s, sending hedged request")
+                    pending.add(executor.submit(attempt, max(0.1, deadline - time.time())))
+                    attempts += 1
+                # Only one hedge per call; after that just wait for the racers
+                hedged = True
+                continue
+
+            if pending:
+                # The other racer is still running; give it the chance to succeed
+                continue
+            if attempts >= max_attempts or not budget.try_spend():
+                raise last_error
+            delay = backoff_delay(retries)
+            if time.time() + delay >= deadline or not admit_extra():
+                raise last_error
+            print(f"[GEMINI] Retrying after {last_error} (backoff {delay:.2f}s)")
+            time.sleep(delay)
+            retries += 1
+            attempts += 1
+            hedged = True
+            pending = {executor.submit(attempt, max(0.1, deadline - time.time()))}
+    finally:
+        executor.shutdown(wait=False)
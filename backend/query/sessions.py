@@ -0,0 +1,48 @@
+# Server-side conversation memory for /query.
+#
+# A session holds just enough state to make follow-up questions work: the last
+# MAX_TURNS question/answer pairs (answers truncated), the chunk ids the previous
+# turn was answered from, and the handle of the vectors it searched
+# (vectors_handle, the same key query.py uses for its per-container caches).
+# Follow-ups are retrieved with the previous question folded into the search
+# text, may reuse the previous turn's chunks when there is budget left, and see
+# the recent turns in the prompt. Sessions expire SESSION_TTL_SECONDS after the
+# last turn.
+import time
+import uuid
+
+MAX_TURNS = 6
+ANSWER_SNIPPET_CHARS = 300
+SESSION_TTL_SECONDS = 24 * 3600
+
+def new_session(doc_id, user_id):
+    return {'session_id': str(uuid.uuid4()), 'doc_id': doc_id, 'user_id': user_id,
+            'turns': [], 'recent_chunk_ids': [], 'vectors_handle': None}
+
+def load_session(table, session_id, doc_id, user_id):
+    """Return the stored session, or a fresh one if it is missing, expired, foreign or for another document."""
+    if session_id:
+        item = table.get_item(Key={'session_id': session_id}, ConsistentRead=True).get('Item')
+        if (item and item.get('user_id') == user_id and item.get('doc_id') == doc_id
+                and int(item.get('expires_at', 0)) >= int(time.time())):
+            item['recent_chunk_ids'] = [int(i) for i in item.get('recent_chunk_ids', [])]
+            return item
+    return new_session(doc_id, user_id)
+
+def retrieval_text(session, question):
+    # Short follow-ups ("what about section 4?") rarely match on their own
+    if session['turns']:
+        return f"{session['turns'][-1]['question']} {question}"
+    return question
+
+def history_text(session):
+    return '\n'.join(f"User: {t['question']}\nAssistant: {t['answer']}" for t in session['turns'])
+
+def record_turn(table, session, question, answer, chunk_ids, vectors_handle):
+    turns = session['turns'] + [{'question': question, 'answer': answer[:ANSWER_SNIPPET_CHARS]}]
+    session['turns'] = turns[-MAX_TURNS:]
+    session['recent_chunk_ids'] = [int(i) for i in chunk_ids]
+    session['vectors_handle'] = vectors_handle
+    session['updated_at'] = int(time.time())
+    session['expires_at'] = session['updated_at'] + SESSION_TTL_SECONDS
+    table.put_item(Item=session)
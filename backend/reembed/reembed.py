@@ -0,0 +1,236 @@
+import io
+import json
+import os
+import re
+import time
+import uuid
+import boto3
+import numpy as np
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from embeddings import VECTOR_METRIC, embed_texts, get_model_version, normalize_embeddings
+
+# Background job that re-embeds every stored document with the provider configured
+# on this function (EMBEDDING_PROVIDER / ONNX_MODEL_DIR), next to its current vectors.
+#
+#   {"action": "start", "total_segments": 8}  -> fans out one worker per Scan segment
+#   {"action": "status", "job_id": "..."}     -> aggregated progress from checkpoints
+#
+# The action is required, so a stray or empty invocation never starts a job.
+# Workers scan their segment a page at a time, re-embed each document's chunks in
+# large batches and store the result as a new vector version: a compressed .npz
+# object under document-vectors/, registered in the item's vector_versions map
+# under the target model version together with the content hash it was computed
+# from. The active vectors and model tag are never modified, so queries keep
+# answering with the old model for the whole job. Before the Lambda timeout a
+# worker saves its Scan position to the checkpoint table and re-invokes itself,
+# so a job survives any number of timeouts and can be resumed by re-sending the
+# worker event.
+# Switch ingestion and query to the new provider only once status reports the job
+# finished: query then serves documents not yet re-ingested from their matching
+# version. Re-running the job afterwards picks up anything ingested with the old
+# model in the meantime.
+
+DEFAULT_SEGMENTS = 4
+SCAN_PAGE_SIZE = int(os.environ.get('REEMBED_SCAN_PAGE_SIZE', '25'))
+REEMBED_BATCH_SIZE = int(os.environ.get('REEMBED_BATCH_SIZE', '256'))
+# Throughput cap per worker, to keep embedding and DynamoDB write load predictable
+MAX_CHUNKS_PER_SECOND = float(os.environ.get('REEMBED_MAX_CHUNKS_PER_SECOND', '200'))
+# Stop picking up new pages when less time than this is left in the invocation
+TIME_MARGIN_MS = 60 * 1000
+
+# Same prefix as process-upload's store_document
+DOCUMENT_VECTORS_PREFIX = 'document-vectors/'
+
+dynamodb = boto3.resource('dynamodb')
+lambda_client = boto3.client('lambda')
+s3_client = boto3.client('s3')
+
+def get_tables():
+    table = dynamodb.Table(os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata'))
+    checkpoints = dynamodb.Table(os.environ.get('CHECKPOINT_TABLE', 'pai-reembed-checkpoints'))
+    return table, checkpoints
+
+def load_checkpoint(checkpoints, job_id, segment):
+    item = checkpoints.get_item(Key={'job_id': job_id, 'segment': segment}, ConsistentRead=True).get('Item')
+    return item or {'job_id': job_id, 'segment': segment, 'docs_done': 0, 'docs_skipped': 0,
+                    'chunks_done': 0, 'finished': False}
+
+def save_checkpoint(checkpoints, checkpoint, last_key):
+    checkpoint['last_key'] = json.dumps(last_key) if last_key else None
+    checkpoint['updated_at'] = int(time.time())
+    checkpoints.put_item(Item=checkpoint)
+
+def load_chunks(item):
+    # Documents too large for one item keep their chunks in S3 with the active vectors
+    if item.get('vectors_key'):
+        body = s3_client.get_object(Bucket=os.environ['S3_BUCKET'], Key=item['vectors_key'])['Body'].read()
+        return np.load(io.BytesIO(body), allow_pickle=False)['chunks'].tolist()
+    return item.get('chunks', [])
+
+def reembed_chunks(chunks):
+    vectors = []
+    for start in range(0, len(chunks), REEMBED_BATCH_SIZE):
+        vectors.append(normalize_embeddings(embed_texts(chunks[start:start + REEMBED_BATCH_SIZE])))
+    return np.vstack(vectors).astype(np.float32)
+
+def version_key(item, target_model):
+    # Model versions look like "onnx:<model dir>@<model hash>"
+    slug = re.sub(r'[^A-Za-z0-9._-]', '_', target_model)
+    return f"{DOCUMENT_VECTORS_PREFIX}{item['doc_id']}/{item.get('content_sha256', 'legacy')}/{slug}.npz"
+
+# Helper: Register re-embedded vectors as a version next to the active ones
+# The condition guarantees the version matches the content we embedded: if the
+# document was revised or deleted meanwhile, it is skipped.
+def add_version(table, item, chunks, vectors, target_model):
+    bucket_name = os.environ['S3_BUCKET']
+    vectors_key = version_key(item, target_model)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, chunks=np.array(chunks, dtype=str), embeddings=vectors)
+    s3_client.put_object(Bucket=bucket_name, Key=vectors_key, Body=buffer.getvalue())
+
+    if 'content_sha256' in item:
+        condition, values = 'content_sha256 = :hash', {':hash': item['content_sha256']}
+    else:
+        condition, values = 'attribute_exists(doc_id) AND attribute_not_exists(content_sha256)', {}
+    version = {'vectors_key': vectors_key, 'vector_metric': VECTOR_METRIC, 'chunk_count': len(chunks),
+               'content_sha256': item.get('content_sha256', ''), 'created_at': int(time.time())}
+    try:
+        # The map must exist before a nested SET can add to it
+        table.update_item(
+            Key={'doc_id': item['doc_id']},
+            UpdateExpression='SET vector_versions = if_not_exists(vector_versions, :empty)',
+            ConditionExpression=condition,
+            ExpressionAttributeValues=dict(values, **{':empty': {}})
+        )
+        table.update_item(
+            Key={'doc_id': item['doc_id']},
+            UpdateExpression='SET vector_versions.#model = :version',
+            ConditionExpression=condition,
+            ExpressionAttributeNames={'#model': target_model},
+            ExpressionAttributeValues=dict(values, **{':version': version})
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            print(f"[REEMBED] {item['doc_id']} changed while re-embedding, skipped")
+            s3_client.delete_object(Bucket=bucket_name, Key=vectors_key)
+            return False
+        raise
+
+def run_segment(event, context):
+    table, checkpoints = get_tables()
+    job_id = event['job_id']
+    segment = int(event['segment'])
+    total_segments = int(event['total_segments'])
+    target_model = get_model_version()
+
+    checkpoint = load_checkpoint(checkpoints, job_id, segment)
+    if checkpoint.get('finished'):
+        return {'job_id': job_id, 'segment': segment, 'finished': True}
+    last_key = json.loads(checkpoint['last_key']) if checkpoint.get('last_key') else None
+
+    while True:
+        scan_kwargs = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'Limit': SCAN_PAGE_SIZE,
+            # Dedup references carry no vectors; their source documents are migrated instead
+            'FilterExpression': '(attribute_exists(chunks) OR attribute_exists(vectors_key)) '
+                                'AND attribute_not_exists(source_doc_id) '
+                                'AND (attribute_not_exists(embedding_model) OR embedding_model <> :target '
+                                'OR attribute_not_exists(vector_metric) OR vector_metric <> :metric) '
+                                'AND attribute_not_exists(vector_versions.#target)',
+            'ProjectionExpression': 'doc_id, chunks, vectors_key, embedding_model, content_sha256',
+            'ExpressionAttributeNames': {'#target': target_model},
+            'ExpressionAttributeValues': {':target': target_model, ':metric': VECTOR_METRIC}
+        }
+        if last_key:
+            scan_kwargs['ExclusiveStartKey'] = last_key
+        page = table.scan(**scan_kwargs)
+
+        for item in page.get('Items', []):
+            started = time.time()
+            chunks = load_chunks(item)
+            if chunks and add_version(table, item, chunks, reembed_chunks(chunks), target_model):
+                checkpoint['docs_done'] += 1
+                checkpoint['chunks_done'] += len(chunks)
+            else:
+                checkpoint['docs_skipped'] += 1
+            # Throughput control: never exceed MAX_CHUNKS_PER_SECOND on this worker
+            min_duration = len(chunks) / MAX_CHUNKS_PER_SECOND if MAX_CHUNKS_PER_SECOND > 0 else 0
+            elapsed = time.time() - started
+            if elapsed < min_duration:
+                time.sleep(min_duration - elapsed)
+
+        last_key = page.get('LastEvaluatedKey')
+        if not last_key:
+            checkpoint['finished'] = True
+            save_checkpoint(checkpoints, checkpoint, None)
+            print(f"[REEMBED] Job {job_id} segment {segment} finished: {checkpoint['docs_done']} docs")
+            return {'job_id': job_id, 'segment': segment, 'finished': True}
+
+        save_checkpoint(checkpoints, checkpoint, last_key)
+        if context.get_remaining_time_in_millis() < TIME_MARGIN_MS:
+            # Continue in a fresh invocation from the saved Scan position
+            lambda_client.invoke(
+                FunctionName=context.function_name,
+                InvocationType='Event',
+                Payload=json.dumps({'action': 'segment', 'job_id': job_id,
+                                    'segment': segment, 'total_segments': total_segments})
+            )
+            print(f"[REEMBED] Job {job_id} segment {segment} continuing in a new invocation")
+            return {'job_id': job_id, 'segment': segment, 'finished': False}
+
+def start_job(event, context):
+    _, checkpoints = get_tables()
+    job_id = event.get('job_id') or str(uuid.uuid4())
+    total_segments = int(event.get('total_segments', DEFAULT_SEGMENTS))
+    for segment in range(total_segments):
+        # Create every checkpoint up front so status reflects all segments immediately
+        checkpoints.put_item(
+            Item={'job_id': job_id, 'segment': segment, 'total_segments': total_segments,
+                  'target_model': get_model_version(), 'docs_done': 0, 'docs_skipped': 0,
+                  'chunks_done': 0, 'finished': False, 'updated_at': int(time.time())},
+            ConditionExpression='attribute_not_exists(job_id)'
+        )
+        lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'action': 'segment', 'job_id': job_id,
+                                'segment': segment, 'total_segments': total_segments})
+        )
+    print(f"[REEMBED] Started job {job_id} with {total_segments} segments, target model {get_model_version()}")
+    return {'job_id': job_id, 'total_segments': total_segments, 'target_model': get_model_version()}
+
+def job_status(event):
+    _, checkpoints = get_tables()
+    items = checkpoints.query(KeyConditionExpression=Key('job_id').eq(event['job_id'])).get('Items', [])
+    finished = sum(1 for i in items if i.get('finished'))
+    return {
+        'job_id': event['job_id'],
+        'target_model': items[0].get('target_model') if items else None,
+        # Ingestion and query may switch to target_model once this is true
+        'finished': bool(items) and finished == len(items),
+        'segments': len(items),
+        'segments_finished': finished,
+        'docs_done': int(sum(i.get('docs_done', 0) for i in items)),
+        'docs_skipped': int(sum(i.get('docs_skipped', 0) for i in items)),
+        'chunks_done': int(sum(i.get('chunks_done', 0) for i in items))
+    }
+
+def lambda_handler(event, context):
+    action = event.get('action')
+    try:
+        if action == 'start':
+            return start_job(event, context)
+        if action == 'segment':
+            return run_segment(event, context)
+        if action == 'status':
+            return job_status(event)
+        raise ValueError(f"Unknown or missing action {action!r}: expected 'start', 'segment' or 'status'")
+    except Exception as e:
+        import traceback
+        print("Reembed Exception:", repr(e))
+        print(traceback.format_exc())
+        raise
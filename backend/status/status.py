@@ -0,0 +1,172 @@
+import json
+import os
+import time
+import boto3
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+# API Gateway HTTP APIs cut integrations off at 30 s, so keep long-polls well below that
+MAX_WAIT_SECONDS = 20
+POLL_INTERVAL_SECONDS = 1.0
+TERMINAL_STATUSES = ('processed', 'failed')
+
+# Only the compact progress attributes are ever read
+STATUS_PROJECTION = ('#s, #v, pages_extracted, pages_total, chunks_embedded, chunks_total, filename, user_id, updated_at, #e, '
+                     'pages_skipped, pages_truncated, extraction_issues, text_length, text_removed_chars')
+STATUS_ATTRIBUTE_NAMES = {'#s': 'status', '#v': 'version', '#e': 'error'}
+
+def _to_json(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Helper: Read a status item on behalf of user_id
+# Items of other users' documents read as missing, so callers can't tell them apart.
+def get_status(table, doc_id, user_id):
+    try:
+        response = table.get_item(
+            Key={'doc_id': doc_id},
+            ProjectionExpression=STATUS_PROJECTION,
+            ExpressionAttributeNames=STATUS_ATTRIBUTE_NAMES,
+            ConsistentRead=True
+        )
+    except ClientError as e:
+        raise Exception(f"DynamoDB get_item failed: {e}")
+    item = response.get('Item')
+    if item is not None and item.get('user_id') != user_id:
+        return None
+    if item is not None:
+        item['doc_id'] = doc_id
+        item['version'] = int(item.get('version', 0))
+    return item
+
+# Helper: Poll the status item until its version moves past `since`,
+# the document reaches a terminal status, or the wait budget runs out.
+# Every distinct version seen is returned so SSE clients get each step.
+def wait_for_change(table, doc_id, user_id, since, wait_seconds, collect_all=False):
+    deadline = time.time() + wait_seconds
+    seen = []
+    while True:
+        item = get_status(table, doc_id, user_id)
+        if item is not None and item['version'] > since:
+            seen.append(item)
+            since = item['version']
+        terminal = item is not None and item.get('status') in TERMINAL_STATUSES
+        if terminal or time.time() >= deadline:
+            return item, seen
+        # Long-poll clients only need the first change; SSE clients keep collecting
+        if seen and not collect_all:
+            return item, seen
+        time.sleep(min(POLL_INTERVAL_SECONDS, max(0.0, deadline - time.time())))
+
+def format_sse(items, retry_ms):
+    lines = [f"retry: {retry_ms}"]
+    for item in items:
+        lines.append(f"id: {item['version']}")
+        lines.append("event: status")
+        lines.append(f"data: {json.dumps(item, default=_to_json)}")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+def lambda_handler(event, context):
+    # Handle CORS preflight request
+    http_method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method')
+    if http_method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization,Last-Event-ID',
+                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+            },
+            'body': ''
+        }
+
+    try:
+        doc_id = (event.get('pathParameters') or {}).get('doc_id')
+        if not doc_id:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Missing doc_id'})
+            }
+
+        query_params = event.get('queryStringParameters') or {}
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        use_sse = 'text/event-stream' in headers.get('accept', '')
+
+        # EventSource reconnects send Last-Event-ID, long-poll clients pass ?since=
+        since = int(headers.get('last-event-id') or query_params.get('since') or -1)
+        wait_seconds = min(float(query_params.get('wait', 0)), MAX_WAIT_SECONDS)
+
+        table = boto3.resource('dynamodb').Table(os.environ.get('STATUS_TABLE', 'pai-document-status'))
+        user_id = event.get('requestContext', {}).get('authorizer', {}).get('jwt', {}).get('claims', {}).get('sub', 'anonymous')
+
+        if wait_seconds > 0:
+            item, changes = wait_for_change(table, doc_id, user_id, since, wait_seconds, collect_all=use_sse)
+        else:
+            item = get_status(table, doc_id, user_id)
+            changes = [item] if item is not None and item['version'] > since else []
+
+        if item is None:
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'No processing status for this doc_id'})
+            }
+
+        if use_sse:
+            # Lambda behind API Gateway can't hold a stream open, so each invocation
+            # flushes the events from one wait window and EventSource reconnects.
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'text/event-stream',
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': format_sse(changes, retry_ms=0 if item.get('status') not in TERMINAL_STATUSES else 60000)
+            }
+
+        item['changed'] = bool(changes)
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(item, default=_to_json)
+        }
+
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': 'wait and since must be numbers'})
+        }
+    except Exception as e:
+        import traceback
+        print("Status Exception:", repr(e))
+        print(traceback.format_exc())
+
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': 'Failed to read processing status',
+                'debug_info': str(e)
+            })
+        }
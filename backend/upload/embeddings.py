@@ -0,0 +1,131 @@
+# Embedding provider shared by ingestion and query.
+#
+# Every function that writes or searches vectors ships an identical copy of this
+# module (process-upload, upload, query, reembed), so documents and questions are always
+# embedded the same way. The provider is picked with EMBEDDING_PROVIDER:
+#
+#   hash  - deterministic SHA-256 pseudo-embedding (default, no extra dependencies)
+#   onnx  - local CPU sentence encoder: ONNX_MODEL_DIR must contain model.onnx and
+#           tokenizer.json (e.g. an exported all-MiniLM-L6-v2), and the layer must
+#           provide onnxruntime and tokenizers
+#
+# Each stored document records get_model_version(), so vectors from different
+# providers or models are never compared with each other. For onnx the version
+# is EMBEDDING_MODEL_VERSION when set, otherwise derived from a hash of
+# model.onnx, so replacing the model files in place always changes it.
+#
+# Stored vectors are L2-normalized once at ingest and tagged with
+# vector_metric = VECTOR_METRIC ('ip'), so query can search them by inner product
+# (cosine) without normalizing the whole matrix per request. Documents stored
+# before normalization have no tag and are searched with L2 as before.
+import hashlib
+import os
+import numpy as np
+
+HASH_DIMENSION = 768
+HASH_MODEL_VERSION = 'sha256-768-v1'
+ONNX_MAX_TOKENS = 256
+ONNX_DIGEST_CHARS = 16
+VECTOR_METRIC = 'ip'
+LEGACY_VECTOR_METRIC = 'l2'
+
+_onnx_model = None
+_onnx_model_digests = {}
+
+def get_provider_name():
+    return os.environ.get('EMBEDDING_PROVIDER', 'hash').lower()
+
+def get_batch_size():
+    return max(1, int(os.environ.get('EMBEDDING_BATCH_SIZE', '32')))
+
+# Helper: Hash the ONNX model file once per container
+def _onnx_model_digest(model_path):
+    if model_path not in _onnx_model_digests:
+        digest = hashlib.sha256()
+        try:
+            with open(model_path, 'rb') as model_file:
+                for block in iter(lambda: model_file.read(1024 * 1024), b''):
+                    digest.update(block)
+        except OSError as e:
+            raise Exception(f"EMBEDDING_PROVIDER=onnx needs EMBEDDING_MODEL_VERSION or a readable {model_path}: {e}")
+        _onnx_model_digests[model_path] = digest.hexdigest()[:ONNX_DIGEST_CHARS]
+    return _onnx_model_digests[model_path]
+
+def get_model_version():
+    if get_provider_name() == 'onnx':
+        explicit = os.environ.get('EMBEDDING_MODEL_VERSION', '').strip()
+        if explicit:
+            return f"onnx:{explicit}"
+        model_dir = os.environ.get('ONNX_MODEL_DIR', '/opt/models/embedding')
+        model_name = os.path.basename(os.path.normpath(model_dir))
+        return f"onnx:{model_name}@{_onnx_model_digest(os.path.join(model_dir, 'model.onnx'))}"
+    return HASH_MODEL_VERSION
+
+# Helper: Deterministic text-to-vector hashing, vectorized with NumPy
+# Produces exactly the values of the original per-character loop, so vectors
+# stored before this module existed stay compatible.
+def _hash_embed(texts):
+    positions = np.arange(HASH_DIMENSION)
+    offsets = positions * 0.001
+    embeddings = np.empty((len(texts), HASH_DIMENSION), dtype=np.float32)
+    for row, text in enumerate(texts):
+        seed = np.frombuffer(hashlib.sha256(text.encode('utf-8')).hexdigest().encode('ascii'), dtype=np.uint8)
+        values = seed[positions % len(seed)] / 255.0
+        embeddings[row] = (values + offsets) % 1.0
+    return embeddings
+
+# Helper: Load the ONNX encoder once per container and reuse it across invocations
+def _load_onnx_model():
+    global _onnx_model
+    if _onnx_model is None:
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise Exception(f"EMBEDDING_PROVIDER=onnx requires onnxruntime and tokenizers: {e}")
+        model_dir = os.environ.get('ONNX_MODEL_DIR', '/opt/models/embedding')
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, 'model.onnx'),
+            sess_options=options,
+            providers=['CPUExecutionProvider']
+        )
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        tokenizer.enable_truncation(max_length=ONNX_MAX_TOKENS)
+        tokenizer.enable_padding()
+        input_names = {i.name for i in session.get_inputs()}
+        _onnx_model = (session, tokenizer, input_names)
+        print(f"[EMBEDDINGS] Loaded ONNX model from {model_dir}")
+    return _onnx_model
+
+def _onnx_embed(texts):
+    session, tokenizer, input_names = _load_onnx_model()
+    batches = []
+    batch_size = get_batch_size()
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer.encode_batch(texts[start:start + batch_size])
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        token_embeddings = session.run(None, feeds)[0]
+        # Mean-pool over real tokens, then L2-normalize as sentence-transformers does
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        batches.append(pooled.astype(np.float32))
+    return np.concatenate(batches)
+
+def embed_texts(texts):
+    if not texts:
+        return np.zeros((0, HASH_DIMENSION), dtype=np.float32)
+    if get_provider_name() == 'onnx':
+        return _onnx_embed(list(texts))
+    return _hash_embed(list(texts))
+
+def normalize_embeddings(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
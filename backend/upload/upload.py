@@ -1,7 +1,9 @@
 import json
 import base64
 import os
+import time
 import uuid
+import hashlib
 import io
 import requests
 import boto3
@@ -9,6 +11,8 @@ import numpy as np
 from PyPDF2 import PdfReader
 from decimal import Decimal
 from botocore.exceptions import ClientError
+from embeddings import VECTOR_METRIC, embed_texts, get_model_version, normalize_embeddings
+from text_cleanup import normalize_pages
 
 def upload_pdf_to_s3(file_content, filename, user_id):
     """Upload PDF file to S3 bucket"""
@@ -21,41 +25,53 @@ def upload_pdf_to_s3(file_content, filename, user_id):
     except ClientError as e:
         raise Exception(f"S3 upload failed: {e}")
 
+def find_duplicate(content_hash):
+    """Look up an already-ingested PDF with identical bytes in the content registry"""
+    registry_table = os.environ.get('CONTENT_REGISTRY_TABLE')
+    if not registry_table:
+        return None
+    try:
+        return boto3.resource('dynamodb').Table(registry_table).get_item(
+            Key={'content_sha256': content_hash}
+        ).get('Item')
+    except ClientError as e:
+        print(f"Registry lookup failed for {content_hash}: {e}")
+        return None
+
+def register_content(content_hash, doc_id, chunk_count, text_length):
+    """Record doc_id as the owner of the chunks/embeddings for these bytes (first writer wins)"""
+    registry_table = os.environ.get('CONTENT_REGISTRY_TABLE')
+    if not registry_table:
+        return
+    try:
+        boto3.resource('dynamodb').Table(registry_table).put_item(
+            Item={
+                'content_sha256': content_hash,
+                'doc_id': doc_id,
+                'chunk_count': chunk_count,
+                'text_length': text_length,
+                'created_at': int(time.time())
+            },
+            ConditionExpression='attribute_not_exists(content_sha256)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"Registry write failed for {content_hash}: {e}")
+
 def extract_text_from_pdf(file_content):
     pdf_stream = io.BytesIO(file_content)
     reader = PdfReader(pdf_stream)
-    text = "\n".join([page.extract_text() or "" for page in reader.pages])
-    return text
+    # Strip running headers, footers and boilerplate so they don't become near-identical chunks
+    page_texts, cleanup = normalize_pages([page.extract_text() or "" for page in reader.pages])
+    print(f"Normalized text: removed {cleanup['chars_before'] - cleanup['chars_after']} of {cleanup['chars_before']} chars")
+    return "\n".join(page_texts)
 
 def chunk_text(text, chunk_size=500):
     return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
 
 def get_embeddings(chunks):
-    # Generate embeddings using a consistent text-to-vector approach
-    # This ensures compatibility between upload and query functions
-    import hashlib
-    
-    embeddings = []
-    for chunk in chunks:
-        # Use text content to generate a deterministic embedding
-        text_bytes = chunk.encode('utf-8')
-        hash_obj = hashlib.sha256(text_bytes)
-        
-        # Generate 768 dimensions (common embedding size)
-        embedding = []
-        seed = hash_obj.hexdigest()
-        
-        for i in range(768):
-            # Use different parts of the hash to generate different values
-            char_idx = i % len(seed)
-            value = ord(seed[char_idx]) / 255.0  # Normalize to 0-1
-            # Add some variation based on position
-            value = (value + (i * 0.001)) % 1.0
-            embedding.append(value)
-        
-        embeddings.append(embedding)
-    
-    return np.array(embeddings, dtype=np.float32)
+    """Embed chunks with the provider shared with the query function (see embeddings.py)"""
+    return normalize_embeddings(embed_texts(chunks))
 
 def lambda_handler(event, context):
     try:
@@ -101,9 +117,44 @@ def lambda_handler(event, context):
         print(f"[UPLOAD-TRACE] Filename: {filename}")
         s3_key = upload_pdf_to_s3(file_content, filename, user_id)
         print(f"S3 upload successful, key: {s3_key}")
+        
+        content_hash = hashlib.sha256(file_content).hexdigest()
+        duplicate = find_duplicate(content_hash)
+        if duplicate:
+            # Same bytes already ingested: reference the existing chunks and embeddings
+            try:
+                boto3.resource('dynamodb').Table(os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata')).put_item(
+                    Item={
+                        'doc_id': doc_id,
+                        'user_id': user_id,
+                        'filename': filename,
+                        's3_key': s3_key,
+                        'content_sha256': content_hash,
+                        'source_doc_id': duplicate['doc_id'],
+                        'chunk_count': duplicate.get('chunk_count', 0),
+                        'updated_at': int(time.time())
+                    }
+                )
+            except ClientError as db_error:
+                raise Exception(f"Database storage failed: {db_error.response['Error']['Code']}")
+            print(f"[UPLOAD-TRACE] Duplicate of doc_id {duplicate['doc_id']}, stored reference for {doc_id}")
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, Authorization, x-filename'
+                },
+                'body': json.dumps({'doc_id': doc_id, 's3_key': s3_key, 'deduplicated': True})
+            }
+        
         text = extract_text_from_pdf(file_content)
         print(f"Text extraction successful, length: {len(text)}")
         chunks = chunk_text(text)
+        if not chunks:
+            # Scanned or image-only PDFs have no text layer to index
+            raise Exception("PDF_NO_TEXT: the document contains no extractable text")
         embeddings = get_embeddings(chunks)
         # Store all data in DynamoDB in a single operation
         table = os.environ.get('DYNAMODB_TABLE', 'pai-embeddings-metadata')
@@ -125,10 +176,17 @@ def lambda_handler(event, context):
                     'filename': filename,
                     's3_key': s3_key,
                     'chunks': chunks,
-                    'embeddings': embeddings_decimal
+                    'embeddings': embeddings_decimal,
+                    'content_sha256': content_hash,
+                    'embedding_model': get_model_version(),
+                    'vector_metric': VECTOR_METRIC,
+                    'chunk_count': len(chunks),
+                    'text_length': len(text),
+                    'updated_at': int(time.time())
                 }
             )
             print(f"DynamoDB put_item successful: {response}")
+            register_content(content_hash, doc_id, len(chunks), len(text))
             print(f"About to return doc_id: {doc_id}")
         except ClientError as db_error:
             error_code = db_error.response['Error']['Code']
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 
 export default function Chat() {
   const [docId, setDocId] = useState('');
@@ -7,6 +7,33 @@ export default function Chat() {
   const [loading, setLoading] = useState(false);
   const [retryAttempt, setRetryAttempt] = useState(0);
   const [chatHistory, setChatHistory] = useState([]);
+  // Fast mode answers with extracted sentences instead of calling Gemini
+  const [fastMode, setFastMode] = useState(false);
+  // Server-side conversation memory; follow-up questions are answered in context
+  const [sessionId, setSessionId] = useState(null);
+  // The user's documents from /documents, fetched a page at a time
+  const [documents, setDocuments] = useState([]);
+  const [documentsCursor, setDocumentsCursor] = useState(null);
+
+  const loadDocuments = async (cursor = null) => {
+    const params = new URLSearchParams({ limit: '20' });
+    if (cursor) params.set('cursor', cursor);
+    try {
+      const response = await fetch(`${process.env.REACT_APP_API_URL}/documents?${params}`, {
+        headers: { 'Authorization': localStorage.getItem('token') }
+      });
+      if (!response.ok) return;
+      const data = await response.json();
+      setDocuments(prev => (cursor ? [...prev, ...data.documents] : data.documents));
+      setDocumentsCursor(data.next_cursor);
+    } catch (err) {
+      console.error('Failed to load documents:', err);
+    }
+  };
+
+  useEffect(() => {
+    loadDocuments();
+  }, []);
 
   // Helper function for exponential backoff retry
   const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
@@ -53,8 +80,8 @@ export default function Chat() {
         return { success: true, data };
         
       } catch (error) {
-        if (error.message === 'QUOTA_EXCEEDED') {
-          throw error; // Don't retry quota errors
+        if (error.message === 'QUOTA_EXCEEDED' || error.statusCode === 409) {
+          throw error; // Don't retry quota errors or conflicts (still processing, model mismatch)
         }
         
         if (attempt === maxRetries - 1) {
@@ -113,8 +140,16 @@ export default function Chat() {
             'Content-Type': 'application/json',
             'Authorization': token,
           },
-          body: JSON.stringify({ doc_id: correctedDocId, question }),
-        }
+          body: JSON.stringify({
+            doc_id: correctedDocId,
+            question,
+            ...(sessionId ? { session_id: sessionId } : { session: true }),
+            ...(fastMode ? { mode: 'fast' } : {})
+          }),
+        },
+        // The backend already retries and hedges Gemini calls; one extra attempt
+        // covers gateway hiccups without re-running retrieval several times
+        2
       );
       
       // Handle server-side doc_id correction notification
@@ -132,12 +167,16 @@ export default function Chat() {
         console.log('Server applied doc_id correction:', result.data.original_doc_id, '->', result.data.corrected_doc_id);
       }
       
+      if (result.data.session_id) {
+        setSessionId(result.data.session_id);
+      }
+
       // Add AI response to chat history
       const aiMessage = { 
         type: 'ai', 
         content: result.data.answer, 
         timestamp: new Date(),
-        isFallback: result.data.is_fallback || false
+        isFallback: result.data.is_fallback || result.data.mode === 'fast' || false
       };
       setChatHistory(prev => [...prev, aiMessage]);
       
@@ -152,6 +191,11 @@ export default function Chat() {
       } else if (err.statusCode === 429) {
         errorMessage = '⚠️ Too many requests. Please wait a moment before trying again.';
         canRetry = false;
+      } else if (err.errorType === 'EMBEDDING_MODEL_MISMATCH') {
+        errorMessage = '🔄 This document was indexed with a different embedding model and must be re-embedded before it can be queried.';
+        canRetry = false;
+      } else if (err.errorType === 'DOCUMENT_PROCESSING') {
+        errorMessage = '⏳ This document is still being processed. Please wait for the upload page to show it as ready.';
       } else if (err.statusCode === 404) {
         errorMessage = '📄 Document not found. Please check your document ID or re-upload the document.';
         canRetry = false;
@@ -184,6 +228,7 @@ export default function Chat() {
 
   const clearChat = () => {
     setChatHistory([]);
+    setSessionId(null);
     setError('');
   };
 
@@ -268,10 +313,48 @@ export default function Chat() {
           }}>
             Document ID
           </label>
+          {documents.length > 0 && (
+            <div style={{ display: 'flex', gap: '8px', marginBottom: '10px' }}>
+              <select
+                value={documents.some(d => d.doc_id === docId) ? docId : ''}
+                onChange={e => { setDocId(e.target.value); setSessionId(null); }}
+                style={{
+                  flex: '1',
+                  padding: '10px 12px',
+                  border: '2px solid #e5e7eb',
+                  borderRadius: '10px',
+                  fontSize: '14px'
+                }}
+              >
+                <option value="">Choose one of your documents…</option>
+                {documents.map(d => (
+                  <option key={d.doc_id} value={d.doc_id} disabled={d.status === 'failed'}>
+                    {d.filename || d.doc_id}{d.status === 'failed' ? ' (failed)' : ''}
+                  </option>
+                ))}
+              </select>
+              {documentsCursor && (
+                <button
+                  type="button"
+                  onClick={() => loadDocuments(documentsCursor)}
+                  style={{
+                    padding: '10px 14px',
+                    border: '2px solid #e5e7eb',
+                    borderRadius: '10px',
+                    background: 'white',
+                    cursor: 'pointer',
+                    fontSize: '13px'
+                  }}
+                >
+                  More
+                </button>
+              )}
+            </div>
+          )}
           <input
             type="text"
             value={docId}
-            onChange={e => setDocId(e.target.value)}
+            onChange={e => { setDocId(e.target.value); setSessionId(null); }}
             placeholder="Enter document ID (e.g., 69eee061-9574-446a-8ee4-cbaf7463b534)"
             required
             style={{
@@ -294,6 +377,22 @@ export default function Chat() {
               e.target.style.boxShadow = 'none';
             }}
           />
+          <label style={{
+            display: 'flex',
+            alignItems: 'center',
+            gap: '8px',
+            marginTop: '10px',
+            fontSize: '13px',
+            color: '#4b5563',
+            cursor: 'pointer'
+          }}>
+            <input
+              type="checkbox"
+              checked={fastMode}
+              onChange={e => setFastMode(e.target.checked)}
+            />
+            ⚡ Fast mode (quote the most relevant sentences instead of generating an answer)
+          </label>
         </div>
 
         {/* Chat Messages */}
@@ -1,14 +1,90 @@
 import React, { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { MULTIPART_THRESHOLD, uploadMultipart } from '../multipartUpload';
+import { uploadFolder } from '../folderUpload';
+
+const STATUS_WAIT_SECONDS = 20;
+
+// Long-poll /status/{doc_id} until processing finishes, reporting each change
+const waitForProcessing = async (docId, token, onProgress) => {
+  let since = -1;
+  for (;;) {
+    const res = await fetch(
+      `${process.env.REACT_APP_API_URL}/status/${encodeURIComponent(docId)}?wait=${STATUS_WAIT_SECONDS}&since=${since}`,
+      { headers: { 'Authorization': token } }
+    );
+    if (!res.ok) {
+      throw new Error(`Status check failed: HTTP ${res.status}`);
+    }
+    const status = await res.json();
+    since = status.version;
+    onProgress(status);
+    if (status.status === 'processed' || status.status === 'failed') {
+      return status;
+    }
+  }
+};
+
+const describeProgress = (status) => {
+  switch (status.status) {
+    case 'awaiting_upload':
+      return 'Waiting for processing to start...';
+    case 'extracting':
+      return status.pages_total
+        ? `Extracting text: page ${status.pages_extracted} of ${status.pages_total}...`
+        : 'Extracting text...';
+    case 'embedding':
+      return `Embedding chunks: ${status.chunks_embedded || 0} of ${status.chunks_total}...`;
+    default:
+      return `Processing (${status.status})...`;
+  }
+};
 
 export default function Upload() {
   const [file, setFile] = useState(null);
+  const [updateDocId, setUpdateDocId] = useState('');
   const [message, setMessage] = useState('');
   const [uploading, setUploading] = useState(false);
   const navigate = useNavigate();
 
   const handleFileChange = (e) => setFile(e.target.files[0]);
 
+  // Folder uploads start as soon as the folder is picked and don't wait for processing
+  const handleFolderChange = async (e) => {
+    const files = Array.from(e.target.files);
+    e.target.value = '';
+    if (files.length === 0) {
+      return;
+    }
+    const token = localStorage.getItem('token');
+    if (!token) {
+      setMessage('Please login first');
+      navigate('/login');
+      return;
+    }
+
+    setUploading(true);
+    setMessage('Preparing folder upload...');
+    try {
+      const { results, skipped } = await uploadFolder(files, token, ({ done, failed, total }) => {
+        setMessage(`Uploading folder: ${done + failed} of ${total} files${failed ? ` (${failed} failed)` : ''}...`);
+      });
+      const failures = results.filter(r => r.error);
+      const skippedNote = skipped ? ` ${skipped} non-PDF files skipped.` : '';
+      if (failures.length) {
+        console.error('Folder upload failures:', failures);
+        setMessage(`Error: ${failures.length} of ${results.length} files failed (first: ${failures[0].filename}: ${failures[0].error}).${skippedNote}`);
+      } else {
+        setMessage(`Uploaded ${results.length} files. Processing in background...${skippedNote}`);
+      }
+    } catch (error) {
+      console.error('Folder upload error:', error);
+      setMessage(`Error: ${error.message || 'Folder upload failed'}`);
+    } finally {
+      setUploading(false);
+    }
+  };
+
   const handleUpload = async (e) => {
     e.preventDefault();
     if (!file) {
@@ -31,46 +107,77 @@ export default function Upload() {
       console.log('API URL:', process.env.REACT_APP_API_URL);
       console.log('Token exists:', !!token);
       
-      // Step 1: Get presigned URL
-      setMessage('Getting upload URL...');
-      const presignedUrl = `${process.env.REACT_APP_API_URL}/presigned-url?filename=${encodeURIComponent(file.name)}&auth=${encodeURIComponent(token)}`;
+      let docId;
+      if (file.size > MULTIPART_THRESHOLD) {
+        // Large files: parallel, resumable multipart upload
+        setMessage('Uploading to S3 in parts...');
+        const result = await uploadMultipart(file, token, ({ uploadedBytes, totalBytes, resumed }) => {
+          const percent = Math.floor((uploadedBytes / totalBytes) * 100);
+          setMessage(`${resumed ? 'Resuming upload' : 'Uploading to S3'}... ${percent}%`);
+        }, updateDocId.trim() || null);
+        docId = result.doc_id;
+      } else {
+        // Step 1: Get a presigned POST policy
+        setMessage('Getting upload URL...');
+        const presignedRes = await fetch(`${process.env.REACT_APP_API_URL}/presigned-url`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': token,
+          },
+          body: JSON.stringify({
+            filename: file.name,
+            content_type: file.type || 'application/pdf',
+            file_size: file.size,
+            ...(updateDocId.trim() ? { doc_id: updateDocId.trim() } : {}),
+          })
+        });
       
-      const presignedRes = await fetch(presignedUrl, {
-        method: 'GET',
-        headers: {
-          'Content-Type': 'application/json',
+        if (!presignedRes.ok) {
+          if (presignedRes.status === 401) {
+            setMessage('Authentication failed. Please login again.');
+            localStorage.removeItem('token');
+            navigate('/login');
+            return;
+          }
+          const errorData = await presignedRes.json().catch(() => ({}));
+          throw new Error(errorData.error || `Failed to get upload URL: HTTP ${presignedRes.status}`);
         }
-      });
       
-      if (!presignedRes.ok) {
-        if (presignedRes.status === 401) {
-          setMessage('Authentication failed. Please login again.');
-          localStorage.removeItem('token');
-          navigate('/login');
-          return;
-        }
-        throw new Error(`Failed to get upload URL: HTTP ${presignedRes.status}`);
-      }
+        const presignedData = await presignedRes.json();
+        console.log('Presigned URL response:', presignedData);
       
-      const presignedData = await presignedRes.json();
-      console.log('Presigned URL response:', presignedData);
+        // Step 2: Upload directly to S3. The policy fields must precede the file.
+        setMessage('Uploading to S3...');
+        const formData = new FormData();
+        Object.entries(presignedData.upload_post.fields).forEach(([name, value]) => formData.append(name, value));
+        formData.append('file', file);
+        const s3Response = await fetch(presignedData.upload_post.url, {
+          method: 'POST',
+          body: formData
+        });
       
-      // Step 2: Upload directly to S3
-      setMessage('Uploading to S3...');
-      const s3Response = await fetch(presignedData.upload_url, {
-        method: 'PUT',
-        headers: {
-          'Content-Type': 'application/pdf',
-        },
-        body: file
-      });
+        if (!s3Response.ok) {
+          // S3 answers 400 EntityTooLarge / AccessDenied when the policy is violated
+          throw new Error(`S3 upload failed: HTTP ${s3Response.status}`);
+        }
       
-      if (!s3Response.ok) {
-        throw new Error(`S3 upload failed: HTTP ${s3Response.status}`);
+        docId = presignedData.doc_id;
       }
       
       console.log('S3 upload successful');
-      setMessage(`Upload successful! Document ID: ${presignedData.doc_id}. Processing in background...`);
+      setMessage(`Upload successful! Document ID: ${docId}. Processing in background...`);
+      
+      // Step 3: Wait until the document is queryable
+      const finalStatus = await waitForProcessing(docId, token, (status) => {
+        setMessage(`Document ID: ${docId}. ${describeProgress(status)}`);
+      });
+      if (finalStatus.status === 'failed') {
+        throw new Error(`Processing failed: ${finalStatus.error || 'unknown error'}`);
+      }
+      // Pages the extraction sandbox had to give up on are indexed without text
+      const skippedNote = finalStatus.pages_skipped ? ` ${finalStatus.pages_skipped} unreadable pages were skipped.` : '';
+      setMessage(`Document ready! Document ID: ${docId} (${finalStatus.chunks_total} chunks).${skippedNote} You can now ask questions in Chat.`);
       
     } catch (error) {
       console.error('Upload error details:', error);
@@ -207,13 +314,59 @@ export default function Upload() {
                     Click to browse or drag & drop
                   </div>
                   <div style={{ fontSize: '14px', color: '#6b7280' }}>
-                    PDF files only • Up to 100MB supported
+                    PDF files only • Large files upload in resumable parts
                   </div>
                 </div>
               )}
             </div>
           </div>
 
+          <div style={{ marginBottom: '24px', textAlign: 'center' }}>
+            <input
+              id="folderInput"
+              type="file"
+              webkitdirectory=""
+              multiple
+              onChange={handleFolderChange}
+              style={{ display: 'none' }}
+            />
+            <button
+              type="button"
+              disabled={uploading}
+              onClick={() => document.getElementById('folderInput').click()}
+              style={{
+                padding: '8px 16px',
+                fontSize: '14px',
+                color: '#667eea',
+                background: 'none',
+                border: '1px solid #667eea',
+                borderRadius: '8px',
+                cursor: uploading ? 'not-allowed' : 'pointer'
+              }}
+            >
+              📁 Upload a whole folder
+            </button>
+          </div>
+
+          <div style={{ marginBottom: '24px' }}>
+            <input
+              type="text"
+              value={updateDocId}
+              onChange={e => setUpdateDocId(e.target.value)}
+              placeholder="Replacing a revised document? Enter its Document ID (optional)"
+              style={{
+                width: '100%',
+                padding: '12px 16px',
+                border: '2px solid #e5e7eb',
+                borderRadius: '10px',
+                fontSize: '14px',
+                fontFamily: 'monospace',
+                outline: 'none',
+                boxSizing: 'border-box'
+              }}
+            />
+          </div>
+
           <button 
             type="submit" 
             disabled={uploading || !file}
@@ -0,0 +1,95 @@
+// Folder uploads: many PDFs with bounded parallelism.
+//
+// Upload policies come from /presigned-url/batch, SIGN_BATCH_SIZE files per
+// request, signed just ahead of the workers that use them. Files above
+// MULTIPART_THRESHOLD take the resumable multipart path as usual. Each file
+// succeeds or fails on its own; the result lists both.
+import { MULTIPART_THRESHOLD, uploadMultipart } from './multipartUpload';
+
+const FILE_CONCURRENCY = 4;
+// Keep at most MAX_BATCH_FILES in backend/presigned-url/presigned_url.py
+const SIGN_BATCH_SIZE = 25;
+
+const isPdf = (file) => file.type === 'application/pdf' || file.name.toLowerCase().endsWith('.pdf');
+
+const signBatch = async (files, token) => {
+  const res = await fetch(`${process.env.REACT_APP_API_URL}/presigned-url/batch`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': token,
+    },
+    body: JSON.stringify({
+      files: files.map(file => ({
+        filename: file.name,
+        content_type: 'application/pdf',
+        file_size: file.size,
+      })),
+    }),
+  });
+  const data = await res.json();
+  if (!res.ok) {
+    throw new Error(data.error || `Failed to get upload URLs: HTTP ${res.status}`);
+  }
+  return data.uploads;
+};
+
+const postToS3 = async (file, uploadPost) => {
+  // The policy fields must precede the file
+  const formData = new FormData();
+  Object.entries(uploadPost.fields).forEach(([name, value]) => formData.append(name, value));
+  formData.append('file', file);
+  const res = await fetch(uploadPost.url, { method: 'POST', body: formData });
+  if (!res.ok) {
+    throw new Error(`S3 upload failed: HTTP ${res.status}`);
+  }
+};
+
+// onProgress receives { done, failed, total } after each file finishes
+export async function uploadFolder(files, token, onProgress = () => {}) {
+  const pdfs = Array.from(files).filter(isPdf);
+  const small = pdfs.filter(file => file.size <= MULTIPART_THRESHOLD);
+  const results = [];
+  let done = 0;
+  let failed = 0;
+
+  // Small files share batch-signed policies; a batch is requested when the first worker needs it
+  const batches = {};
+  const policyFor = async (file) => {
+    const index = small.indexOf(file);
+    const batchIndex = Math.floor(index / SIGN_BATCH_SIZE);
+    if (!batches[batchIndex]) {
+      batches[batchIndex] = signBatch(small.slice(batchIndex * SIGN_BATCH_SIZE, (batchIndex + 1) * SIGN_BATCH_SIZE), token);
+    }
+    return (await batches[batchIndex])[index % SIGN_BATCH_SIZE];
+  };
+
+  const uploadOne = async (file) => {
+    if (file.size > MULTIPART_THRESHOLD) {
+      return (await uploadMultipart(file, token)).doc_id;
+    }
+    const upload = await policyFor(file);
+    if (!upload.upload_post) {
+      throw new Error(upload.error);
+    }
+    await postToS3(file, upload.upload_post);
+    return upload.doc_id;
+  };
+
+  let next = 0;
+  const worker = async () => {
+    while (next < pdfs.length) {
+      const file = pdfs[next++];
+      try {
+        results.push({ filename: file.name, doc_id: await uploadOne(file) });
+        done++;
+      } catch (error) {
+        results.push({ filename: file.name, error: error.message });
+        failed++;
+      }
+      onProgress({ done, failed, total: pdfs.length });
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(FILE_CONCURRENCY, pdfs.length) }, worker));
+  return { results, skipped: files.length - pdfs.length };
+}
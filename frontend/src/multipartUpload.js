@@ -0,0 +1,171 @@
+// Resumable, parallel multipart uploads to S3 via presigned part URLs.
+//
+// The upload session (upload_id, s3_key, doc_id) is kept in localStorage keyed
+// by the file's name/size/mtime, so re-selecting the same file after a dropped
+// connection or page reload asks the backend which parts S3 already has and
+// only sends the missing ones.
+
+export const MULTIPART_THRESHOLD = 16 * 1024 * 1024;
+const PART_CONCURRENCY = 4;
+const PART_RETRIES = 4;
+const SIGN_BATCH_SIZE = 20;
+const SESSION_PREFIX = 'pai-multipart:';
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+const sessionKey = (file) => `${SESSION_PREFIX}${file.name}:${file.size}:${file.lastModified}`;
+
+const callApi = async (action, token, body) => {
+  const res = await fetch(`${process.env.REACT_APP_API_URL}/multipart-upload/${action}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': token,
+    },
+    body: JSON.stringify(body),
+  });
+  const data = await res.json();
+  if (!res.ok) {
+    const error = new Error(data.error || `Multipart ${action} failed: HTTP ${res.status}`);
+    error.statusCode = res.status;
+    error.errorType = data.error_type;
+    throw error;
+  }
+  return data;
+};
+
+const loadSession = async (file, token) => {
+  const saved = localStorage.getItem(sessionKey(file));
+  if (!saved) {
+    return null;
+  }
+  const session = JSON.parse(saved);
+  try {
+    const { parts } = await callApi('list-parts', token, {
+      upload_id: session.upload_id,
+      s3_key: session.s3_key,
+    });
+    // Only trust parts whose size matches what we would send now
+    session.completed = new Set(
+      parts
+        .filter(p => p.Size === Math.min(session.part_size, file.size - (p.PartNumber - 1) * session.part_size))
+        .map(p => p.PartNumber)
+    );
+    return session;
+  } catch (error) {
+    if (error.errorType === 'NO_SUCH_UPLOAD') {
+      localStorage.removeItem(sessionKey(file));
+      return null;
+    }
+    throw error;
+  }
+};
+
+const uploadPart = async (file, session, partNumber, url) => {
+  const start = (partNumber - 1) * session.part_size;
+  const blob = file.slice(start, Math.min(start + session.part_size, file.size));
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const res = await fetch(url, { method: 'PUT', body: blob });
+      if (res.ok) {
+        return blob.size;
+      }
+      // Expired or otherwise rejected signature: let the caller re-sign
+      if (res.status === 403) {
+        throw Object.assign(new Error('Part URL rejected'), { resign: true });
+      }
+      throw new Error(`Part ${partNumber} failed: HTTP ${res.status}`);
+    } catch (error) {
+      if (error.resign || attempt >= PART_RETRIES - 1) {
+        throw error;
+      }
+      // Jittered exponential backoff: 1s, 2s, 4s... plus up to 1s
+      await sleep(Math.pow(2, attempt) * 1000 + Math.random() * 1000);
+    }
+  }
+};
+
+// Pass updateDocId to upload a revised version of an existing document
+export async function uploadMultipart(file, token, onProgress = () => {}, updateDocId = null) {
+  let session = await loadSession(file, token);
+  if (!session) {
+    const created = await callApi('create', token, {
+      filename: file.name,
+      content_type: file.type || 'application/pdf',
+      file_size: file.size,
+      ...(updateDocId ? { doc_id: updateDocId } : {}),
+    });
+    session = { ...created, completed: new Set() };
+    localStorage.setItem(sessionKey(file), JSON.stringify({
+      upload_id: session.upload_id,
+      s3_key: session.s3_key,
+      doc_id: session.doc_id,
+      part_size: session.part_size,
+      part_count: session.part_count,
+    }));
+  }
+
+  const pending = [];
+  for (let n = 1; n <= session.part_count; n++) {
+    if (!session.completed.has(n)) {
+      pending.push(n);
+    }
+  }
+
+  let uploadedBytes = 0;
+  session.completed.forEach(n => {
+    uploadedBytes += Math.min(session.part_size, file.size - (n - 1) * session.part_size);
+  });
+  onProgress({ uploadedBytes, totalBytes: file.size, resumed: session.completed.size > 0 });
+
+  // Workers pull part numbers from a shared queue; URLs are signed in batches just ahead of use
+  const urls = {};
+  const signAhead = async (partNumber) => {
+    if (!urls[partNumber]) {
+      const batch = pending.slice(pending.indexOf(partNumber), pending.indexOf(partNumber) + SIGN_BATCH_SIZE)
+        .filter(n => !urls[n]);
+      const signed = await callApi('sign-parts', token, {
+        upload_id: session.upload_id,
+        s3_key: session.s3_key,
+        part_numbers: batch,
+      });
+      Object.assign(urls, signed.urls);
+    }
+    return urls[partNumber];
+  };
+
+  let next = 0;
+  const worker = async () => {
+    while (next < pending.length) {
+      const partNumber = pending[next++];
+      let size;
+      try {
+        size = await uploadPart(file, session, partNumber, await signAhead(partNumber));
+      } catch (error) {
+        if (!error.resign) {
+          throw error;
+        }
+        delete urls[partNumber];
+        size = await uploadPart(file, session, partNumber, await signAhead(partNumber));
+      }
+      uploadedBytes += size;
+      onProgress({ uploadedBytes, totalBytes: file.size, resumed: false });
+    }
+  };
+  // A failed worker rejects the whole upload; the session stays saved so a retry resumes
+  await Promise.all(Array.from({ length: Math.min(PART_CONCURRENCY, pending.length) }, worker));
+
+  await callApi('complete', token, { upload_id: session.upload_id, s3_key: session.s3_key });
+  localStorage.removeItem(sessionKey(file));
+  return { doc_id: session.doc_id, s3_key: session.s3_key };
+}
+
+export async function abortMultipart(file, token) {
+  const saved = localStorage.getItem(sessionKey(file));
+  if (!saved) {
+    return;
+  }
+  const session = JSON.parse(saved);
+  localStorage.removeItem(sessionKey(file));
+  await callApi('abort', token, { upload_id: session.upload_id, s3_key: session.s3_key });
+}